@@ -1,43 +1,55 @@
 # apps/analyze_procedure_data.py
 from pathlib import Path
-import pandas as pd
-from apps.utils.common import OUTPUT_DIR
+from apps.utils.catalog import latest_artifact
+from apps.utils.context import PipelineContext, from_context
+from apps.utils.parquet_meta import column_names, num_rows, distinct_count
 
 
 def get_latest_procedure_with_patient() -> Path | None:
     """最新の procedure_with_patient_*.parquet を取得"""
-    pq_files = sorted(OUTPUT_DIR.glob("procedure_with_patient_*.parquet"))
-    return pq_files[-1] if pq_files else None
+    return latest_artifact("procedure_with_patient")
 
 
-def show_procedure_header(df: pd.DataFrame, file_name: str) -> None:
+def show_procedure_header(columns, file_name: str) -> None:
     """カラム名一覧を表示"""
     print(f"\n📁 {file_name}")
     print("=" * (len(file_name) + 4))
-    print(", ".join(df.columns))
+    print(", ".join(columns))
 
 
-def analyze_procedure_data() -> None:
+def _print_summary(n_rows: int, n_patients: int, n_proc_types: int) -> None:
+    print(f"\n📊 レコード数: {n_rows:,}")
+    print(f"👥 一意患者数: {n_patients:,}")
+    print(f"💊 処置行為の種類数: {n_proc_types:,}")
+
+
+def analyze_procedure_data(ctx: PipelineContext | None = None) -> None:
     """procedure_with_patient データの基本情報と簡単な集計を表示"""
+    df = from_context(ctx, "procedure_with_patient")
+    if df is not None:
+        show_procedure_header(df.columns, f"procedure_with_patient_{ctx.suffix}")
+        _print_summary(
+            len(df),
+            df["患者番号"].nunique() if "患者番号" in df.columns else 0,
+            df["処置行為"].nunique() if "処置行為" in df.columns else 0,
+        )
+        return
+
     pq_path = get_latest_procedure_with_patient()
     if not pq_path:
         print("⚠ procedure_with_patient_*.parquet が見つかりません。")
         return
 
     print(f"📂 対象ファイル: {pq_path.name}")
-    df = pd.read_parquet(pq_path)
-
-    # ヘッダー表示
-    show_procedure_header(df, pq_path.name)
-
-    # レコード件数・患者数・処置種類の数を表示
-    n_rows = len(df)
-    n_patients = df["患者番号"].nunique() if "患者番号" in df.columns else 0
-    n_proc_types = df["処置行為"].nunique() if "処置行為" in df.columns else 0
 
-    print(f"\n📊 レコード数: {n_rows:,}")
-    print(f"👥 一意患者数: {n_patients:,}")
-    print(f"💊 処置行為の種類数: {n_proc_types:,}")
+    # ヘッダーと件数はフッターから、一意数は該当列だけを読んで計算
+    columns = column_names(pq_path)
+    show_procedure_header(columns, pq_path.name)
+    _print_summary(
+        num_rows(pq_path),
+        distinct_count(pq_path, "患者番号") if "患者番号" in columns else 0,
+        distinct_count(pq_path, "処置行為") if "処置行為" in columns else 0,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,215 @@
+# apps/enrich_free_comments.py
+import argparse
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from apps.utils.catalog import latest_artifact
+from apps.utils.common import open_parquet
+from apps.utils.context import PipelineContext
+from apps.utils.metrics import record_read
+from apps.utils.output import OutputWriter
+
+# ==========================================
+# レセプトのフリーコメントに受診（カルテ）・診療科・処置行為を付ける
+#   フリーコメントを 患者番号 → コメント日 の順に並べ、batch_size 件ずつ処理する。
+#   各バッチでは、そのバッチの患者番号の範囲と一覧を条件として
+#   unique_karte_core / procedure_with_patient（どちらも患者番号 → 日付順に保存）を読むため、
+#   読み込む行グループはコメントのある患者の分だけで、表全体の大きさにはよらない。
+#   受診は同じ患者のコメント日以前で最も近い日付の受診（as-of 結合、VISIT_TOLERANCE_DAYS 日以内）。
+#   処置行為はその受診（カルテID）の処置をまとめたもの。
+# ==========================================
+
+# 入力・出力の成果物名
+COMMENTS_ARTIFACT = "receipt_free_comments_all"
+KARTE_ARTIFACT = "unique_karte_core"
+PROCEDURE_ARTIFACT = "procedure_with_patient"
+OUTPUT_PREFIX = "receipt_free_comments_enriched"
+LINEAGE = (COMMENTS_ARTIFACT, KARTE_ARTIFACT, PROCEDURE_ARTIFACT)
+
+# 1バッチのコメント件数
+DEFAULT_BATCH_SIZE = 100_000
+
+# コメント日から何日前までの受診を対象にするか（SY の診療開始日は受診日と一致しないことがある）
+VISIT_TOLERANCE_DAYS = 31
+
+VISIT_COLUMNS = ["患者番号", "日付", "カルテID", "診療科", "保険種別"]
+
+# 付与する列（コメントの列の後ろに付く）
+ENRICHED_FIELDS = [
+    ("患者番号", pa.int64()),
+    ("カルテID", pa.string()),
+    ("受診日", pa.timestamp("ns")),
+    ("日数差", pa.int64()),
+    ("診療科", pa.string()),
+    ("保険種別", pa.string()),
+    ("処置行為", pa.string()),
+    ("処置件数", pa.int64()),
+]
+
+
+def _patient_numbers(patient_id: pd.Series) -> pd.Series:
+    """レセプトの patient_id（カルテ番号の文字列）を患者番号（Int64）にする。数字以外は欠損"""
+    s = patient_id.astype("string").str.strip()
+    return pd.to_numeric(s.where(s.str.fullmatch(r"\d+", na=False)), errors="coerce").astype("Int64")
+
+
+def _patient_filter(schema: pa.Schema, patients: np.ndarray) -> ds.Expression:
+    """
+    バッチの患者番号だけを読む条件。
+    整数の列なら範囲の条件も付け、行グループの最小・最大の統計で読み飛ばせるようにする。
+    """
+    field = ds.field("患者番号")
+    if pa.types.is_integer(schema.field("患者番号").type):
+        return (field >= int(patients[0])) & (field <= int(patients[-1])) & field.isin(pa.array(patients))
+    return field.cast(pa.string()).isin(pa.array([str(p) for p in patients]))
+
+
+def _read_patients(dataset: ds.Dataset, columns: list[str], patients: np.ndarray, extra=None) -> pd.DataFrame:
+    expr = _patient_filter(dataset.schema, patients)
+    if extra is not None:
+        expr &= extra
+    df = dataset.to_table(columns=[c for c in columns if c in dataset.schema.names], filter=expr).to_pandas()
+    for col in columns:
+        if col not in df.columns:
+            df[col] = pd.NA
+    df["患者番号"] = pd.to_numeric(df["患者番号"], errors="coerce").astype("Int64")
+    return df[columns]
+
+
+def _attach_visits(comments: pd.DataFrame, visits: pd.DataFrame) -> pd.DataFrame:
+    """患者番号ごとに、コメント日以前で最も近い受診を付ける（as-of 結合）"""
+    visits = visits.dropna(subset=["患者番号", "日付"]).assign(
+        受診日=lambda d: pd.to_datetime(d["日付"]).astype("datetime64[ns]"),
+        カルテID=lambda d: d["カルテID"].astype("string"),
+        診療科=lambda d: d["診療科"].astype("string"),
+        保険種別=lambda d: d["保険種別"].astype("string"),
+    )
+    keyed = comments["_patient"].notna() & comments["_date"].notna()
+    left = comments[keyed].sort_values("_date", kind="stable")
+    right = visits[["患者番号", "受診日", "カルテID", "診療科", "保険種別"]].sort_values("受診日", kind="stable")
+    matched = pd.merge_asof(
+        left, right,
+        left_on="_date", right_on="受診日",
+        left_by="_patient", right_by="患者番号",
+        direction="backward",
+        tolerance=pd.Timedelta(days=VISIT_TOLERANCE_DAYS),
+    )
+    matched.index = left.index
+    out = comments.join(matched[["受診日", "カルテID", "診療科", "保険種別"]])
+    out["日数差"] = (out["_date"] - out["受診日"]).dt.days.astype("Int64")
+    return out
+
+
+def _procedure_summary(procedures: pd.DataFrame) -> pd.DataFrame:
+    """カルテIDごとの処置行為（出現順に重複を除いて「、」でつなぐ）と件数"""
+    procedures = procedures.dropna(subset=["カルテID"]).assign(カルテID=lambda d: d["カルテID"].astype("string"))
+    counts = procedures.groupby("カルテID").size()
+    names = (
+        procedures.dropna(subset=["処置行為"])
+        .drop_duplicates(["カルテID", "処置行為"])
+        .groupby("カルテID")["処置行為"]
+        .agg(lambda s: "、".join(s.astype(str)))
+    )
+    return pd.DataFrame({"処置行為": names, "処置件数": counts})
+
+
+def enrich_batch(comments: pd.DataFrame, karte: ds.Dataset | None, procedure: ds.Dataset | None) -> pd.DataFrame:
+    """
+    1バッチ分（患者番号 → コメント日の順）のコメントに受診・処置行為を付ける。
+    karte / procedure はバッチの患者番号の行だけを読み込む。
+    """
+    comments = comments.assign(
+        _patient=_patient_numbers(comments["patient_id"]),
+        _date=pd.to_datetime(comments["comment_date_ymd"]).astype("datetime64[ns]"),
+    )
+    patients = np.unique(comments["_patient"].dropna().to_numpy(dtype="int64"))
+
+    if karte is not None and len(patients):
+        visits = _read_patients(karte, VISIT_COLUMNS, patients)
+        out = _attach_visits(comments, visits)
+    else:
+        out = comments.assign(**{c: None for c in ["受診日", "カルテID", "診療科", "保険種別", "日数差"]})
+
+    matched_ids = out["カルテID"].dropna().unique()
+    if procedure is not None and len(matched_ids):
+        key_type = procedure.schema.field("カルテID").type
+        ids = pa.array(matched_ids.tolist()).cast(key_type)
+        procedures = _read_patients(
+            procedure, ["患者番号", "カルテID", "処置行為"], patients, extra=ds.field("カルテID").isin(ids)
+        )
+        summary = _procedure_summary(procedures)
+        out = out.join(summary, on="カルテID")
+    else:
+        out = out.assign(処置行為=None, 処置件数=None)
+
+    out["患者番号"] = out["_patient"]
+    out["処置件数"] = out["処置件数"].astype("Int64")
+    return out.drop(columns=["_patient", "_date"])
+
+
+def comment_sources() -> list[Path]:
+    """パイプラインのスキップ判定用: 入力の最新フリーコメント Parquet"""
+    path = latest_artifact(COMMENTS_ARTIFACT)
+    return [path] if path is not None else []
+
+
+def _open(name: str) -> ds.Dataset | None:
+    path = latest_artifact(name)
+    if path is None:
+        print(f"⚠ {name} の Parquet が見つかりません（該当列は空になります）。")
+        return None
+    record_read(path)
+    return open_parquet(path)
+
+
+def enrich_free_comments(
+    ctx: PipelineContext | None = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> int:
+    """
+    最新のフリーコメントに受診・診療科・処置行為を付けて、
+    receipt_free_comments_enriched_<時刻>.{csv,parquet} に逐次書き出す。戻り値は出力件数。
+    ctx のデータは使わず、前段が保存した Parquet から必要な患者の行だけを読む。
+    """
+    comments_pq = latest_artifact(COMMENTS_ARTIFACT)
+    if comments_pq is None:
+        print(f"⚠ {COMMENTS_ARTIFACT}_*.parquet が見つかりません。先にフリーコメント抽出を実行してください。")
+        return 0
+    print(f"📂 対象ファイル: {comments_pq.name}")
+    record_read(comments_pq)
+    comments = pq.read_table(comments_pq)
+    comment_schema = comments.schema.remove_metadata()
+    karte = _open(KARTE_ARTIFACT)
+    procedure = _open(PROCEDURE_ARTIFACT)
+
+    # 患者番号 → コメント日の順に並べる（同じ患者のコメントが同じバッチに入り、読む範囲が狭くなる）
+    df = comments.to_pandas()
+    df = df.iloc[np.lexsort((df["comment_date_ymd"].to_numpy(), _patient_numbers(df["patient_id"]).to_numpy(
+        dtype="float64", na_value=np.inf)))].reset_index(drop=True)
+
+    schema = pa.schema([*comment_schema, *[pa.field(n, t) for n, t in ENRICHED_FIELDS]])
+    ts = ctx.suffix if ctx is not None else datetime.now().strftime("%Y%m%d_%H%M%S")
+    matched = 0
+    with OutputWriter(f"{OUTPUT_PREFIX}_{ts}", schema, encoding="cp932", lineage=LINEAGE) as out:
+        for lo in range(0, len(df), batch_size):
+            batch = enrich_batch(df.iloc[lo:lo + batch_size], karte, procedure)
+            matched += int(batch["カルテID"].notna().sum())
+            out.write(pa.Table.from_pandas(batch[schema.names], schema=schema, preserve_index=False))
+
+    for path in out.paths:
+        print(f"✅ 出力しました: {path.name}")
+    print(f"📊 フリーコメント {out.num_rows:,} 件中 {matched:,} 件に受診を付与しました。")
+    return out.num_rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="フリーコメントに受診・診療科・処置行為を付与")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="1バッチのコメント件数")
+    args = parser.parse_args()
+
+    print("=== フリーコメントの受診・処置行為の付与 ===")
+    enrich_free_comments(batch_size=args.batch_size)
@@ -1,51 +1,96 @@
 # apps/export_unique_karte_core.py
-from pathlib import Path
+import numpy as np
 import pandas as pd
-from apps.utils.common import get_latest_parquet, OUTPUT_DIR
+import pyarrow as pa
+from apps.utils.catalog import artifact_suffix
+from apps.utils.common import get_latest_parquet
+from apps.utils.context import PipelineContext, from_context
+from apps.utils.output import to_arrow, write_outputs
+from apps.utils.parquet_meta import column_names
+from apps.utils.reader import read_arrow, read_parquet
 
 # 対象カラム
 COLUMNS = ["カルテID", "患者番号", "患者氏名", "診療科", "保険種別", "日付"]
 
-def export_unique_karte_core():
-    """karteの主要情報をカルテID・患者番号で一意化して出力"""
-    karte_files = get_latest_parquet(["karte_"])
-    if not karte_files:
-        print("⚠ karte_ ファイルが見つかりません。先に結合を実行してください。")
-        return
+# 一意化のキーと出力の並び順（出力 Parquet のメタデータにも記録する）
+UNIQUE_KEYS = ["カルテID", "患者番号"]
+SORT_KEYS = ["患者番号", "日付"]
 
-    pq_path = karte_files[0]
-    print(f"📂 対象ファイル: {pq_path.name}")
+def unique_karte_core_arrow(table: pa.Table) -> pa.Table:
+    """
+    カルテID×患者番号で最初に現れた行を残し、患者番号→日付の順に並べる。
+    pandas の drop_duplicates + mergesort と同じ結果を pyarrow のハッシュ集計で求める。
+    """
+    # キーごとに最初の行番号をハッシュ集計で求め、元の出現順のまま取り出す
+    keys = table.select(UNIQUE_KEYS).append_column("_行", pa.array(np.arange(table.num_rows)))
+    first_rows = keys.group_by(UNIQUE_KEYS).aggregate([("_行", "min")])["_行_min"]
+    unique = table.take(np.sort(first_rows.to_numpy()))
 
-    # データ読み込み
-    df = pd.read_parquet(pq_path, engine="pyarrow")
+    # sort_by は安定ソート（欠損は末尾）なので mergesort と同じ並びになる
+    return unique.sort_by([(k, "ascending") for k in SORT_KEYS])
 
-    # 必要カラムがあるか確認
-    missing = [c for c in COLUMNS if c not in df.columns]
-    if missing:
-        print(f"⚠ 必要列が不足しています: {missing}")
-        print(f"  karteの列: {list(df.columns)}")
-        return
-
-    # 必要カラムだけ抽出
+def _unique_karte_core_pandas(df: pd.DataFrame) -> pd.DataFrame:
+    """従来の pandas 版（engine="pandas"）"""
     df = df[COLUMNS]
 
     # 一意化：カルテID×患者番号
-    unique_df = df.drop_duplicates(subset=["カルテID", "患者番号"])
+    unique_df = df.drop_duplicates(subset=UNIQUE_KEYS)
 
     # 並び替え：患者番号（昇順）→ 日付（昇順）
-    unique_df = unique_df.sort_values(by=["患者番号", "日付"], kind="mergesort").reset_index(drop=True)
+    return unique_df.sort_values(by=SORT_KEYS, kind="mergesort").reset_index(drop=True)
+
+def export_unique_karte_core(ctx: PipelineContext | None = None, engine: str = "arrow"):
+    """
+    karteの主要情報をカルテID・患者番号で一意化して出力。
+    engine="arrow" では必要な6列だけを読み、pyarrow のハッシュ集計で一意化する。
+    出力は患者番号→日付の順に並べ、その並び順を Parquet に記録する（後段の結合で再ソートを省くため）。
+    """
+    df = from_context(ctx, "karte")
+    if df is not None:
+        out_ts = ctx.suffix
+        columns = list(df.columns)
+    else:
+        karte_files = get_latest_parquet(["karte_"])
+        if not karte_files:
+            print("⚠ karte_ ファイルが見つかりません。先に結合を実行してください。")
+            return
+
+        pq_path = karte_files[0]
+        print(f"📂 対象ファイル: {pq_path.name}")
+        out_ts = artifact_suffix(pq_path)
+        columns = column_names(pq_path)
+
+    # 必要カラムがあるか確認
+    missing = [c for c in COLUMNS if c not in columns]
+    if missing:
+        print(f"⚠ 必要列が不足しています: {missing}")
+        print(f"  karteの列: {columns}")
+        return
 
-    # 出力ファイル名
-    out_ts = pq_path.stem.split("_")[-1]
-    csv_out = OUTPUT_DIR / f"unique_karte_core_{out_ts}.csv"
-    pq_out  = OUTPUT_DIR / f"unique_karte_core_{out_ts}.parquet"
+    # データ読み込み（必要な6列のみ）→ 一意化・並び替え
+    if engine == "arrow":
+        if df is not None:
+            table = pa.Table.from_pandas(df[COLUMNS], preserve_index=False)
+        else:
+            table = read_arrow(pq_path, columns=COLUMNS)
+        unique_table = unique_karte_core_arrow(table)
+        unique_df = unique_table.to_pandas()
+    else:
+        if df is None:
+            df = read_parquet(pq_path, columns=COLUMNS)
+        unique_df = _unique_karte_core_pandas(df)
+        unique_table = to_arrow(unique_df)
+    unique_df.attrs["sorted_by"] = SORT_KEYS
 
-    # 出力
-    unique_df.to_csv(csv_out, index=False, encoding="utf-8-sig")
-    unique_df.to_parquet(pq_out, index=False)
+    # 出力（Parquet には並び順を記録）
+    paths = write_outputs(
+        unique_table, f"unique_karte_core_{out_ts}", sort_keys=SORT_KEYS, lineage=("karte",)
+    )
+    if ctx is not None:
+        ctx.put("unique_karte_core", unique_df)
 
-    print(f"✅ 一意カルテリストを出力しました: {csv_out.name}")
-    print(f"✅ 一意カルテリストを出力しました: {pq_out.name}")
+    for path in paths:
+        print(f"✅ 一意カルテリストを出力しました: {path.name}")
     print(f"📊 レコード数: {len(unique_df)}")
 
 if __name__ == "__main__":
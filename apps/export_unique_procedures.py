@@ -2,13 +2,14 @@
 from pathlib import Path
 import re
 from datetime import datetime
-import pandas as pd
-from apps.utils.common import OUTPUT_DIR
+from apps.utils.catalog import latest_artifact
+from apps.utils.context import PipelineContext, from_context
+from apps.utils.output import write_outputs
+from apps.utils.reader import read_parquet
 
 def _get_latest_procedure_with_patient() -> Path | None:
     """output内の最新 procedure_with_patient_*.parquet を返す"""
-    files = sorted(OUTPUT_DIR.glob("procedure_with_patient_*.parquet"))
-    return files[-1] if files else None
+    return latest_artifact("procedure_with_patient")
 
 def _suffix_from_filename(p: Path) -> str:
     """
@@ -20,19 +21,24 @@ def _suffix_from_filename(p: Path) -> str:
         return m.group(1)
     return datetime.now().strftime("%H%M%S")
 
-def export_unique_procedures() -> None:
+def export_unique_procedures(ctx: PipelineContext | None = None) -> None:
     """
     最新の procedure_with_patient_*.parquet から
     一意の「処置行為」リストを出力（CSV/Parquet）。
     参考として件数付きの表も併せて出力。
     """
-    pq = _get_latest_procedure_with_patient()
-    if not pq:
-        print("⚠ procedure_with_patient_*.parquet が見つかりません。先に結合処理を実行してください。")
-        return
+    df = from_context(ctx, "procedure_with_patient")
+    if df is not None:
+        suf = ctx.suffix
+    else:
+        pq = _get_latest_procedure_with_patient()
+        if not pq:
+            print("⚠ procedure_with_patient_*.parquet が見つかりません。先に結合処理を実行してください。")
+            return
 
-    print(f"📂 対象ファイル: {pq.name}")
-    df = pd.read_parquet(pq)
+        print(f"📂 対象ファイル: {pq.name}")
+        df = read_parquet(pq)
+        suf = _suffix_from_filename(pq)
 
     if "処置行為" not in df.columns:
         print("⚠ カラム『処置行為』が見つかりません。")
@@ -59,19 +65,10 @@ def export_unique_procedures() -> None:
         .reset_index(drop=True)
     )
 
-    suf = _suffix_from_filename(pq)
-
     # 出力
-    out_unique_csv = OUTPUT_DIR / f"unique_procedures_{suf}.csv"
-    out_unique_pq  = OUTPUT_DIR / f"unique_procedures_{suf}.parquet"
-    unique_df.to_csv(out_unique_csv, index=False, encoding="utf-8-sig")
-    unique_df.to_parquet(out_unique_pq, index=False)
-
-    out_counts_csv = OUTPUT_DIR / f"unique_procedures_with_counts_{suf}.csv"
-    out_counts_pq  = OUTPUT_DIR / f"unique_procedures_with_counts_{suf}.parquet"
-    counts_df.to_csv(out_counts_csv, index=False, encoding="utf-8-sig")
-    counts_df.to_parquet(out_counts_pq, index=False)
+    unique_paths = write_outputs(unique_df, f"unique_procedures_{suf}", lineage=("procedure_with_patient",))
+    counts_paths = write_outputs(counts_df, f"unique_procedures_with_counts_{suf}", lineage=("procedure_with_patient",))
 
-    print(f"✅ 一意リスト: {out_unique_csv.name} / {out_unique_pq.name}")
-    print(f"✅ 件数付き   : {out_counts_csv.name} / {out_counts_pq.name}")
+    print(f"✅ 一意リスト: {' / '.join(p.name for p in unique_paths)}")
+    print(f"✅ 件数付き   : {' / '.join(p.name for p in counts_paths)}")
     print(f"🔢 一意件数: {len(unique_df):,}")
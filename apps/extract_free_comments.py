@@ -1,6 +1,229 @@
+import argparse
+import heapq
+import mmap
+import os
+import tempfile
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Executor, Future
 from datetime import datetime
+from functools import partial
 from pathlib import Path
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from apps.utils.common import OUTPUT_DIR
+from apps.utils.context import PipelineContext
+from apps.utils.metrics import record_read
+from apps.utils.output import OutputWriter, to_arrow, write_outputs
+from apps.utils.parallel import process_pool
+
+
+# フリーコメント1件あたりの列（extract_free_comments_from_file の dict と同じ並び）
+COMMENT_SCHEMA = pa.schema([
+    ("receipt_month", pa.string()),
+    ("insurer_type", pa.string()),
+    ("patient_id", pa.string()),
+    ("comment_date", pa.string()),
+    ("free_comment", pa.string()),
+    ("si_code", pa.string()),
+    ("comment_date_ymd", pa.timestamp("ns")),
+])
+
+# 出力の列（COMMENT_SCHEMA に正規化した患者ID を足したもの。patient_id は UKE の値のまま残す）
+OUTPUT_SCHEMA = COMMENT_SCHEMA.append(pa.field("normalized_patient_id", pa.string()))
+
+# 出力の並び順。患者1人分の問い合わせ（apps/patient_timeline.py）が
+# 行グループの最小・最大の統計でその患者の行グループだけを読めるようにする
+SORT_KEYS = ["normalized_patient_id", "comment_date_ymd"]
+
+# ストリーミング時の1バッチあたりの最大件数
+DEFAULT_BATCH_SIZE = 100_000
+
+# 出力メッセージ用の形式名
+_FORMAT_LABELS = {".csv": "CSV", ".parquet": "Parquet"}
+
+
+# 解析エンジン: scan（mmap 上でフリーコメントの行を探し、関係する行だけデコード）/ lines（従来の全行デコード）
+ENGINES = ("scan", "lines")
+
+# フリーコメントのコメントコード
+FREE_COMMENT_CODE = "810000001"
+
+
+def _iter_record_lines(uke_path: Path) -> Iterator[list[str]]:
+    """従来の読み込み: 全行を cp932 でデコードして split する"""
+    with open(uke_path, "r", encoding="cp932", errors="replace") as f:
+        for raw in f:
+            line = raw.rstrip()
+            if line:
+                yield line.split(",")
+
+
+def _split_line(line: bytes) -> list[str]:
+    return line.decode("cp932", errors="replace").rstrip().split(",")
+
+
+def _field(line: bytes, i: int) -> str | None:
+    """
+    1行（バイト列）の i 番目の項目。_split_line(line)[i] と同じ値を、
+    ASCII の項目ならその項目だけデコードして返す（項目がなければ None）。
+    """
+    parts = line.split(b",", i + 1)
+    if len(parts) <= i:
+        return None
+    value = parts[i]
+    if not value.isascii():
+        return _split_line(line)[i]
+    value = value.decode("ascii")
+    # 行末の項目は rstrip 後の値にそろえる
+    return value.rstrip() if len(parts) == i + 1 else value
+
+
+class _UkeBuffer:
+    """mmap した UKE を行単位で参照する（改行は \n 区切り。cp932 の2バイト目に \n と "," は現れない）"""
+
+    def __init__(self, mm: mmap.mmap):
+        self.mm = mm
+
+    def line(self, start: int) -> bytes:
+        end = self.mm.find(b"\n", start)
+        return self.mm[start:] if end < 0 else self.mm[start:end]
+
+    def rfind_line(self, tag: bytes, lo: int, hi: int) -> int:
+        """先頭位置が [lo, hi) にある行のうち、種別が tag の最後の行の先頭位置（なければ -1）"""
+        needle = b"\n" + tag
+        while hi > lo:
+            pos = self.mm.rfind(needle, max(lo - 1, 0), hi + 1)
+            if pos >= 0:
+                start = pos + 1
+            elif lo == 0 and self.mm[:len(tag)] == tag:
+                start = 0
+            else:
+                return -1
+            if start < lo:
+                return -1
+            # "RES" のような別の種別を除く（種別の後が "," 以外なら項目を見て判定）
+            if self.mm[start + len(tag):start + len(tag) + 1] == b"," or _field(self.line(start), 0) == tag.decode("ascii"):
+                return start
+            hi = start
+        return -1
+
+
+def _scan_free_comments(uke_path: Path) -> Iterator[tuple[str, str, str, str]]:
+    """
+    ファイルを mmap し、810000001 を含む CO 行をバイト列のまま探す。
+    見つかった行ごとに、直前の RE / SY / SI の行だけを後ろ向きに探してデコードする。
+    IY / TO / SJ や、フリーコメントに関係しない行は一切デコード・分割しない。
+    結果は従来の1行ずつの状態遷移（engine="lines"）と同じ。
+    """
+    code = FREE_COMMENT_CODE.encode("ascii")
+    with open(uke_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            buf = _UkeBuffer(mm)
+            last_re: tuple[int, str | None] = (-1, None)
+            pos = 0
+            while (hit := mm.find(code, pos)) >= 0:
+                start = mm.rfind(b"\n", 0, hit) + 1
+                line = buf.line(start)
+                pos = start + len(line) + 1
+                if not line.startswith(b"CO"):
+                    continue
+                cols = _split_line(line)
+                if cols[0] != "CO" or len(cols) <= 3 or cols[3] != FREE_COMMENT_CODE:
+                    continue
+
+                # --- RE：患者ID（同じレセプトの2件目以降は前回の結果を使う） ---
+                re_start = buf.rfind_line(b"RE", 0, start)
+                if re_start < 0:
+                    continue
+                if re_start != last_re[0]:
+                    re_line = buf.line(re_start)
+                    last_re = (re_start, _field(re_line, 13) or _field(re_line, 1))
+                patient_id = last_re[1]
+                if not patient_id:
+                    continue
+
+                # --- SY：RE 以降で診療日のある最後の SY（SI のリセット位置は最後の SY） ---
+                comment_date = None
+                reset = re_start
+                hi = start
+                while (sy_start := buf.rfind_line(b"SY", re_start + 1, hi)) >= 0:
+                    reset = max(reset, sy_start)
+                    comment_date = _field(buf.line(sy_start), 2)
+                    if comment_date:
+                        break
+                    hi = sy_start
+                if not comment_date:
+                    continue
+
+                # --- SI：リセット位置以降で、9桁数字のコードを持つ最後の SI ---
+                si_code = ""
+                hi = start
+                while (si_start := buf.rfind_line(b"SI", reset + 1, hi)) >= 0:
+                    value = (_field(buf.line(si_start), 3) or "").strip()
+                    if len(value) == 9 and value.isdigit():
+                        si_code = value
+                        break
+                    hi = si_start
+
+                yield patient_id, comment_date, cols[4] if len(cols) > 4 else "", si_code
+
+
+def iter_free_comments(uke_path: Path, engine: str = "scan") -> Iterator[tuple[str, str, str, str]]:
+    """
+    RECEIPTC.UKE をパースして、CO(810000001) と
+    その直上にある SI コード（9桁数字）を
+    (患者ID, 診療日, コメント, SIコード) の順に1件ずつ返す。
+    engine="lines" は従来の全行デコード（比較用）。
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"engine は {ENGINES} のいずれかを指定してください: {engine}")
+    if engine == "scan":
+        yield from _scan_free_comments(uke_path)
+        return
+
+    current_re_id = None
+    current_date = None
+    last_si_code: str | None = None  # ★ 直近のSIコード（最新1つだけ保持）
+
+    for cols in _iter_record_lines(uke_path):
+        tag = cols[0]
+
+        # --- RE：患者ID ---
+        if tag == "RE":
+            if len(cols) > 13 and cols[13]:
+                current_re_id = cols[13]
+            else:
+                current_re_id = cols[1] if len(cols) > 1 else None
+
+            current_date = None
+            last_si_code = None  # ★ RE が変われば SI リセット
+
+        # --- SY：診療日 ---
+        elif tag == "SY":
+            if len(cols) > 2 and cols[2]:
+                current_date = cols[2]
+
+            last_si_code = None  # ★ SY が変われば SI もリセット
+
+        # --- SI：行為コード ---
+        elif tag == "SI":
+            if len(cols) > 3 and cols[3]:
+                si_code = cols[3].strip()
+
+                # ★ 9桁数字だけを対象
+                if len(si_code) == 9 and si_code.isdigit():
+                    last_si_code = si_code  # ★ 直近のSIだけ保持
+
+        # --- CO：フリーコメント（810000001） ---
+        elif tag == "CO":
+            if len(cols) > 3 and cols[3] == FREE_COMMENT_CODE:
+                comment_text = cols[4] if len(cols) > 4 else ""
+
+                if current_re_id and current_date:
+                    yield current_re_id, current_date, comment_text, last_si_code or ""  # ★ 直前のSI1つだけ
 
 
 def extract_free_comments_from_file(
@@ -12,66 +235,144 @@ def extract_free_comments_from_file(
     RECEIPTC.UKE をパースして、CO(810000001) と
     その直上にある SI コード（9桁数字）を抽出する。
     """
-    results: list[dict] = []
+    return [
+        {
+            "receipt_month": receipt_month,
+            "insurer_type": insurer_type,
+            "patient_id": patient_id,
+            "comment_date": comment_date,
+            "free_comment": comment_text,
+            "si_code": si_code,
+        }
+        for patient_id, comment_date, comment_text, si_code in iter_free_comments(uke_path)
+    ]
+
+
+def _to_record_batch(receipt_month: str, insurer_type: str, columns: list[list[str]]) -> pa.RecordBatch:
+    patient_ids, comment_dates, comments, si_codes = columns
+    n = len(patient_ids)
+    dates = pa.array(comment_dates, pa.string())
+    return pa.record_batch(
+        [
+            pa.array([receipt_month] * n, pa.string()),
+            pa.array([insurer_type] * n, pa.string()),
+            pa.array(patient_ids, pa.string()),
+            dates,
+            pa.array(comments, pa.string()),
+            pa.array(si_codes, pa.string()),
+            pc.strptime(dates, format="%Y%m%d", unit="ns", error_is_null=True),
+        ],
+        schema=COMMENT_SCHEMA,
+    )
 
-    current_re_id = None
-    current_date = None
-    last_si_code: str | None = None  # ★ 直近のSIコード（最新1つだけ保持）
 
-    with open(uke_path, "r", encoding="cp932", errors="replace") as f:
-        for raw in f:
-            line = raw.rstrip()
-            if not line:
-                continue
+def iter_free_comment_batches(
+    uke_path: Path,
+    insurer_type: str,
+    receipt_month: str,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> Iterator[pa.RecordBatch]:
+    """
+    extract_free_comments_from_file のストリーミング版。
+    dict を作らず列ごとのリストに貯め、batch_size 件ごとに RecordBatch を返す。
+    """
+    columns: list[list[str]] = [[], [], [], []]
+    for rec in iter_free_comments(uke_path):
+        for col, value in zip(columns, rec):
+            col.append(value)
+        if len(columns[0]) >= batch_size:
+            yield _to_record_batch(receipt_month, insurer_type, columns)
+            columns = [[], [], [], []]
+    if columns[0]:
+        yield _to_record_batch(receipt_month, insurer_type, columns)
+
+
+TARGET_INSURERS = ["kokuho", "shaho"]
+
+
+def list_receipt_files(base_path: str = "../data") -> list[Path]:
+    """receipt_*/{kokuho,shaho}/RECEIPTC.UKE のうち存在するものを月順に返す"""
+    base = Path(base_path)
+    if not base.is_dir():
+        return []
+    return [
+        receipt_dir / insurer / "RECEIPTC.UKE"
+        for receipt_dir in sorted(p for p in base.iterdir() if p.is_dir() and p.name.startswith("receipt_"))
+        for insurer in TARGET_INSURERS
+        if (receipt_dir / insurer / "RECEIPTC.UKE").exists()
+    ]
+
+
+def _receipt_labels(uke_path: Path) -> tuple[str, str]:
+    """receipt_YYYYMM/{insurer}/RECEIPTC.UKE から (請求月, 保険者区分) を返す"""
+    return uke_path.parents[1].name.replace("receipt_", ""), uke_path.parent.name
 
-            cols = line.split(",")
-            tag = cols[0]
 
-            # --- RE：患者ID ---
-            if tag == "RE":
-                if len(cols) > 13 and cols[13]:
-                    current_re_id = cols[13]
-                else:
-                    current_re_id = cols[1] if len(cols) > 1 else None
+def extract_free_comments_table(uke_path: Path) -> pa.Table:
+    """1ファイル分のフリーコメントを pyarrow Table で返す（プロセスプールの作業単位）"""
+    receipt_month, insurer = _receipt_labels(uke_path)
+    batches = iter_free_comment_batches(uke_path, insurer, receipt_month)
+    return pa.Table.from_batches(list(batches), schema=COMMENT_SCHEMA)
 
-                current_date = None
-                last_si_code = None  # ★ RE が変われば SI リセット
 
-            # --- SY：診療日 ---
-            elif tag == "SY":
-                if len(cols) > 2 and cols[2]:
-                    current_date = cols[2]
+def _map_ordered(ex: Executor, fn: Callable, items: Iterable, window: int) -> Iterator:
+    """
+    executor.map と同じく入力順で結果を返すが、先行して投入するのは window 件まで。
+    結果を消費しきれないうちに全ファイル分の結果がメモリに溜まるのを防ぐ。
+    """
+    pending: list[Future] = []
+    for item in items:
+        pending.append(ex.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.pop(0).result()
+    for fut in pending:
+        yield fut.result()
 
-                last_si_code = None  # ★ SY が変われば SI もリセット
 
-            # --- SI：行為コード ---
-            elif tag == "SI":
-                if len(cols) > 3 and cols[3]:
-                    si_code = cols[3].strip()
+def _spill_free_comments(uke_path: Path, spill_dir: Path, batch_size: int = DEFAULT_BATCH_SIZE) -> Path:
+    """
+    1ファイル分のフリーコメントをバッチごとに一時ファイル（Arrow IPC）へ書き、そのパスを返す
+    （並列ストリーミングの作業単位。Table を親プロセスへ送らないため、1ファイル分を丸ごと持たない）。
+    """
+    receipt_month, insurer = _receipt_labels(uke_path)
+    spill_path = Path(spill_dir) / f"{receipt_month}_{insurer}.arrow"
+    with pa.OSFile(str(spill_path), "wb") as sink, pa.ipc.new_stream(sink, COMMENT_SCHEMA) as writer:
+        for batch in iter_free_comment_batches(uke_path, insurer, receipt_month, batch_size):
+            writer.write_batch(batch)
+    return spill_path
 
-                    # ★ 9桁数字だけを対象
-                    if len(si_code) == 9 and si_code.isdigit():
-                        last_si_code = si_code  # ★ 直近のSIだけ保持
 
-            # --- CO：フリーコメント（810000001） ---
-            elif tag == "CO":
-                if len(cols) > 3 and cols[3] == "810000001":
-                    comment_text = cols[4] if len(cols) > 4 else ""
+def _iter_spilled_batches(
+    files: list[Path], workers: int, batch_size: int, tmp_root: Path
+) -> Iterator[pa.RecordBatch]:
+    """
+    月×保険者のファイルを並列に解析し、files と同じ順序でバッチを返す。
+    各ワーカーは結果を一時ファイルへ書き、親プロセスはそれを1バッチずつ読んでは削除する。
+    """
+    with tempfile.TemporaryDirectory(prefix="free_comments_", dir=tmp_root) as tmp:
+        spill = partial(_spill_free_comments, spill_dir=Path(tmp), batch_size=batch_size)
+        with process_pool(min(workers, len(files))) as ex:
+            for spill_path in _map_ordered(ex, spill, files, workers * 2):
+                with pa.OSFile(str(spill_path), "rb") as source:
+                    yield from pa.ipc.open_stream(source)
+                spill_path.unlink()
 
-                    if current_re_id and current_date:
-                        results.append({
-                            "receipt_month": receipt_month,
-                            "insurer_type": insurer_type,
-                            "patient_id": current_re_id,
-                            "comment_date": current_date,
-                            "free_comment": comment_text,
-                            "si_code": last_si_code or ""  # ★ 直前のSI1つだけ
-                        })
 
-    return results
+def _iter_receipt_tables(files: list[Path], workers: int) -> Iterator[tuple[Path, pa.Table]]:
+    """月×保険者のファイルを並列に解析し、files と同じ順序で返す"""
+    with process_pool(min(workers, len(files))) as ex:
+        for uke_path, table in zip(files, _map_ordered(ex, extract_free_comments_table, files, workers * 2)):
+            yield uke_path, table
 
 
-def extract_all_receipts(base_path: str = "../data") -> pd.DataFrame:
+def extract_all_receipts(base_path: str = "../data", workers: int = 1) -> pd.DataFrame:
+    """
+    receipt_* 全フォルダのフリーコメントを1つの DataFrame にまとめる。
+    workers > 1 の場合は月×保険者のファイル単位でプロセス並列に解析する（結果の順序は同じ）。
+    """
+    if workers > 1:
+        return _extract_all_receipts_parallel(base_path, workers)
+
     base = Path(base_path)
 
     receipt_dirs = sorted(
@@ -80,7 +381,6 @@ def extract_all_receipts(base_path: str = "../data") -> pd.DataFrame:
     )
 
     all_results: list[dict] = []
-    TARGET_INSURERS = ["kokuho", "shaho"]
 
     for receipt_dir in receipt_dirs:
         receipt_month = receipt_dir.name.replace("receipt_", "")
@@ -94,6 +394,7 @@ def extract_all_receipts(base_path: str = "../data") -> pd.DataFrame:
                 continue
 
             print(f"  → 読み込み: {uke_path.name} ({insurer})")
+            record_read(uke_path)
 
             recs = extract_free_comments_from_file(
                 uke_path=uke_path,
@@ -111,47 +412,244 @@ def extract_all_receipts(base_path: str = "../data") -> pd.DataFrame:
     return df
 
 
+def _extract_all_receipts_parallel(base_path: str, workers: int) -> pd.DataFrame:
+    files = list_receipt_files(base_path)
+    if not files:
+        print("⚠ 1件もフリーコメントが見つかりませんでした。")
+        return pd.DataFrame()
+
+    print(f"\n===== {len(files)} ファイルを {workers} プロセスで解析 =====")
+    record_read(files)
+    tables = []
+    for uke_path, table in _iter_receipt_tables(files, workers):
+        receipt_month, insurer = _receipt_labels(uke_path)
+        print(f"  → 読み込み完了: {receipt_month} ({insurer}) {table.num_rows:,} 件")
+        tables.append(table)
+
+    table = pa.concat_tables(tables)
+    if table.num_rows == 0:
+        print("⚠ 1件もフリーコメントが見つかりませんでした。")
+        return pd.DataFrame()
+    return table.to_pandas()
+
+
+def add_normalized_patient_ids(table: pa.Table | pa.RecordBatch) -> pa.Table:
+    """
+    patient_id の前後の空白を除き、数字だけの番号は先頭ゼロも除いた normalized_patient_id の列を足す
+    （"000123" → "123"）。カルテ番号はゼロ埋めで記録されることがあり、そのままでは患者番号（整数）と一致しないため。
+    """
+    if isinstance(table, pa.RecordBatch):
+        table = pa.Table.from_batches([table])
+    ids = pc.utf8_trim_whitespace(table["patient_id"])
+    stripped = pc.utf8_ltrim(ids, characters="0")
+    stripped = pc.if_else(pc.equal(stripped, ""), "0", stripped)
+    ids = pc.if_else(pc.match_substring_regex(ids, r"^[0-9]+$"), stripped, ids)
+    return table.append_column(OUTPUT_SCHEMA.field("normalized_patient_id"), ids)
+
+
+def _sorted_comments(table: pa.Table) -> pa.Table:
+    """
+    正規化した患者ID の列を足し、SORT_KEYS の順（欠損は末尾）に並べる（Parquet と CSV で同じ並びにする）。
+    同じキーの行は元の順（ファイル順）のまま。
+    """
+    table = add_normalized_patient_ids(table)
+    order = pc.sort_indices(table, sort_keys=[(k, "ascending") for k in SORT_KEYS], null_placement="at_end")
+    return table.take(order)
+
+
+def _sort_key(row: dict) -> tuple:
+    """1行の SORT_KEYS の値（欠損は末尾）。_sorted_comments と同じ順に並べるためのキー"""
+    return tuple((row[k] is None, row[k]) for k in SORT_KEYS)
+
+
+def _write_sorted_runs(batches: Iterable[pa.RecordBatch], spill_dir: Path, batch_size: int) -> list[Path]:
+    """
+    バッチを batch_size 件ずつまとめて SORT_KEYS の順に並べ、一時ファイル（Arrow IPC）に書いてパスを返す
+    （外部ソートの前半。メモリに載るのは batch_size 件まで）。
+    """
+    paths: list[Path] = []
+    pending: list[pa.RecordBatch] = []
+    n_pending = 0
+
+    def flush() -> None:
+        run = _sorted_comments(pa.Table.from_batches(pending, schema=COMMENT_SCHEMA))
+        path = spill_dir / f"run_{len(paths):05d}.arrow"
+        with pa.OSFile(str(path), "wb") as sink, pa.ipc.new_stream(sink, OUTPUT_SCHEMA) as writer:
+            writer.write_table(run, max_chunksize=batch_size)
+        paths.append(path)
+        pending.clear()
+
+    for batch in batches:
+        pending.append(batch)
+        n_pending += batch.num_rows
+        if n_pending >= batch_size:
+            flush()
+            n_pending = 0
+    if pending:
+        flush()
+    return paths
+
+
+def _iter_run_rows(path: Path) -> Iterator[dict]:
+    with pa.OSFile(str(path), "rb") as source:
+        for batch in pa.ipc.open_stream(source):
+            yield from batch.to_pylist()
+
+
+def _iter_merged_runs(paths: list[Path], batch_size: int) -> Iterator[pa.RecordBatch]:
+    """
+    並べ替え済みの一時ファイルを突き合わせ、全体を SORT_KEYS の順にしたバッチを返す（外部ソートの後半）。
+    同じキーの行は一時ファイルの順（＝ファイル順）に並ぶため、_sorted_comments で全体を並べた場合と同じ並びになる。
+    """
+    rows: list[dict] = []
+    for row in heapq.merge(*(_iter_run_rows(p) for p in paths), key=_sort_key):
+        rows.append(row)
+        if len(rows) >= batch_size:
+            yield pa.RecordBatch.from_pylist(rows, schema=OUTPUT_SCHEMA)
+            rows = []
+    if rows:
+        yield pa.RecordBatch.from_pylist(rows, schema=OUTPUT_SCHEMA)
+
+
 def export_comment_results(
     df: pd.DataFrame,
-    output_dir: str = "output",
+    output_dir: Path = OUTPUT_DIR,
     prefix: str = "receipt_free_comments_all"
 ):
-    output_base = Path(output_dir)
-    output_base.mkdir(parents=True, exist_ok=True)
+    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    table = _sorted_comments(to_arrow(df))
+
+    try:
+        paths = write_outputs(table, f"{prefix}_{ts}", output_dir, encoding="cp932", sort_keys=SORT_KEYS)
+    except Exception as e:
+        # 呼び出し側（パイプライン）で失敗として扱えるよう例外はそのまま送る
+        print(f"⚠ 出力失敗: {e}")
+        raise
+    for path in paths:
+        print(f"📤 {_FORMAT_LABELS[path.suffix]} 出力: {path}")
 
+
+def export_comment_results_streaming(
+    base_path: str = "../data",
+    output_dir: Path = OUTPUT_DIR,
+    prefix: str = "receipt_free_comments_all",
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    workers: int = 1,
+) -> int:
+    """
+    receipt_* の UKE をバッチ単位で読みながら CSV / Parquet に逐次書き出す。
+    全件を DataFrame に載せないため、月数が増えてもメモリ使用量は一定。
+    workers > 1 の場合はファイル単位で並列に解析する（結果は一時ファイル経由でバッチごとに受け取る）。
+    並び順は export_comment_results と同じ（SORT_KEYS）。batch_size 件ずつ並べ替えた一時ファイルを
+    突き合わせて書き出す（外部ソート）。戻り値は出力件数。
+    """
     ts = datetime.now().strftime("%Y%m%d_%H%M%S")
 
-    csv_path = output_base / f"{prefix}_{ts}.csv"
-    parquet_path = output_base / f"{prefix}_{ts}.parquet"
+    files = list_receipt_files(base_path)
+    record_read(files)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    if workers > 1 and len(files) > 1:
+        batch_iter = _iter_spilled_batches(files, workers, batch_size, output_dir)
+    else:
+        batch_iter = (
+            batch
+            for uke_path, (receipt_month, insurer) in ((p, _receipt_labels(p)) for p in files)
+            for batch in iter_free_comment_batches(uke_path, insurer, receipt_month, batch_size)
+        )
+
+    with (
+        tempfile.TemporaryDirectory(prefix="free_comments_sort_", dir=output_dir) as tmp,
+        OutputWriter(f"{prefix}_{ts}", OUTPUT_SCHEMA, output_dir, encoding="cp932", sort_keys=SORT_KEYS) as out,
+    ):
+        print(f"  → 読み込み: {len(files)} ファイル")
+        runs = _write_sorted_runs(batch_iter, Path(tmp), batch_size)
+        for batch in _iter_merged_runs(runs, batch_size):
+            out.write(batch)
+        if out.num_rows == 0:
+            out.discard()
+
+    if out.num_rows == 0:
+        print("⚠ 1件もフリーコメントが見つかりませんでした。")
+        return 0
 
-    df.to_csv(csv_path, index=False, encoding="cp932")
-    print(f"📤 CSV 出力: {csv_path}")
+    for path in out.paths:
+        print(f"📤 {_FORMAT_LABELS[path.suffix]} 出力: {path}")
+    return out.num_rows
 
-    try:
-        df.to_parquet(parquet_path, index=False)
-        print(f"📤 Parquet 出力: {parquet_path}")
-    except Exception as e:
-        print(f"⚠ Parquet 出力失敗: {e}")
+
+def export_comment_results_from_store(
+    output_dir: Path = OUTPUT_DIR,
+    prefix: str = "receipt_free_comments_all",
+) -> int:
+    """
+    レセプトストア（apps/receipt_store.py）の CO / SY / SI の表からフリーコメントを作って出力する。
+    UKE の本文は読まないため、ストアを更新した後なら抽出は列の絞り込みと結合だけで済む。
+    出力は患者ID・診療日の順（SORT_KEYS）。戻り値は出力件数。
+    """
+    # receipt_store がこのモジュールを参照するため、ここで import する
+    from apps.receipt_store import free_comments_from_store, store_file_names
+
+    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    names = store_file_names()
+    print(f"  → レセプトストアから抽出: {len(names)} ファイル")
+    tables = [free_comments_from_store(name) for name in names]
+    table = pa.concat_tables(tables) if tables else COMMENT_SCHEMA.empty_table()
+    if table.num_rows == 0:
+        print("⚠ 1件もフリーコメントが見つかりませんでした。")
+        return 0
+
+    table = _sorted_comments(table)
+    for path in write_outputs(table, f"{prefix}_{ts}", output_dir, encoding="cp932", sort_keys=SORT_KEYS):
+        print(f"📤 {_FORMAT_LABELS[path.suffix]} 出力: {path}")
+    return table.num_rows
 
 
 def run_extract_free_comments(
     base_path: str = "../data",
-    output_dir: str = "output",
+    output_dir: Path = OUTPUT_DIR,
+    ctx: PipelineContext | None = None,
+    streaming: bool = False,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    workers: int = 1,
+    from_store: bool = False,
 ):
+    """
+    フリーコメントを抽出して出力する。
+    from_store=True の場合は UKE を読まず、取り込み済みのレセプトストアから作る（build_receipt_store の後に実行する）。
+    streaming=True の場合はバッチ単位で逐次書き出す（ctx には載せない）。
+    workers > 1 の場合は月×保険者のファイル単位でプロセス並列に解析する。
+    """
     print("\n--- ⑨ レセプト・フリーコメント抽出（receipt_* 全フォルダ / kokuho+shahoのみ） ---")
 
-    df_all = extract_all_receipts(base_path)
+    if from_store:
+        n_rows = export_comment_results_from_store(output_dir)
+        print(f"📊 フリーコメント件数: {n_rows:,}")
+        return
+
+    if streaming:
+        n_rows = export_comment_results_streaming(base_path, output_dir, batch_size=batch_size, workers=workers)
+        print(f"📊 フリーコメント件数: {n_rows:,}")
+        return
+
+    df_all = extract_all_receipts(base_path, workers=workers)
 
     if df_all.empty:
         print("⚠ フリーコメントが0件でした。スキップ")
         return
 
     export_comment_results(df_all, output_dir=output_dir)
+    if ctx is not None:
+        ctx.put("receipt_free_comments", df_all)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="レセプト・フリーコメント抽出")
+    parser.add_argument("--base-path", default="../data", help="receipt_* フォルダのある場所")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="並列に解析するプロセス数")
+    args = parser.parse_args()
+
     print("\n=== 🧾 レセプト・フリーコメント抽出 単体実行 ===")
-    df_all = extract_all_receipts("../data")
+    df_all = extract_all_receipts(args.base_path, workers=args.workers)
     if not df_all.empty:
         print("\n--- 先頭5行 ---")
         print(df_all.head())
@@ -1,34 +1,67 @@
 # apps/find_duplicate_patients.py
-import pandas as pd
-from apps.utils.common import get_latest_parquet, OUTPUT_DIR
-
-def find_duplicate_patients():
-    """患者氏名あたりに複数の患者番号があるケースを検出"""
-    diagnosis_path = get_latest_parquet("diagnosis")
-    if not diagnosis_path:
-        print("⚠ diagnosis の Parquet ファイルが見つかりません。")
-        return
+import argparse
+from datetime import datetime
+from apps.patient_identity import IDENTITY_DIR, resolve_patient_identity
+from apps.receipt_store import receipt_patients
+from apps.utils.common import get_latest_parquet
+from apps.utils.context import PipelineContext, from_context
+from apps.utils.output import write_outputs
+from apps.utils.reader import read_parquet
+
+# 画面に表示するクラスタ表の行数
+PREVIEW_ROWS = 20
+
+
+def _load_names(ctx: PipelineContext | None, key: str):
+    """ctx（なければ最新の Parquet）から患者番号・患者氏名を読み込む"""
+    df = from_context(ctx, key)
+    if df is not None:
+        return df[["患者番号", "患者氏名"]]
+    targets = get_latest_parquet([f"{key}_"])
+    if not targets:
+        print(f"⚠ {key} の Parquet ファイルが見つかりません。")
+        return None
+    print(f"📂 対象ファイル: {targets[0].name}")
+    return read_parquet(targets[0], columns=["患者番号", "患者氏名"])
 
-    df = pd.read_parquet(diagnosis_path)
 
-    if not {"患者氏名", "患者番号"}.issubset(df.columns):
-        print("⚠ 必要な列（患者氏名, 患者番号）が見つかりません。")
-        print("実際の列名:", df.columns.tolist())
+def find_duplicate_patients(ctx: PipelineContext | None = None, force: bool = False):
+    """
+    karte / diagnosis / レセプト（RE）の氏名から、同一人物と思われる患者番号のクラスタを検出して出力。
+    表記ゆれ（全角/半角・ひらがな/カタカナ・空白）をそろえた氏名一致と、
+    生年月日が同じで読みが1文字違いまでの近似一致を対象にする（apps/patient_identity.py）。
+    """
+    frames = [_load_names(ctx, "karte"), _load_names(ctx, "diagnosis")]
+    receipts = from_context(ctx, "receipt_patients")
+    if receipts is None:
+        receipts = receipt_patients()
+    if all(df is None for df in frames) and receipts.empty:
+        print("⚠ 名寄せの対象データがありません。")
         return
 
-    dupes = (
-        df.groupby("患者氏名")["患者番号"]
-        .nunique()
-        .reset_index(name="患者番号の種類数")
-        .query("患者番号の種類数 > 1")
-    )
+    clusters, summary = resolve_patient_identity(frames, receipts, force=force)
+    print(f"🔎 患者番号×氏名 {summary['records']:,} 件（変更 {summary['changed_records']:,} 件、"
+          f"比較 {summary['compared_records']:,} 件）")
 
-    if dupes.empty:
-        print("✅ 患者氏名ごとの患者番号の重複はありません。")
+    out_ts = ctx.suffix if ctx is not None else datetime.now().strftime("%H%M%S")
+    paths = write_outputs(clusters, f"patient_clusters_{out_ts}", lineage=("karte", "diagnosis"))
+    for path in paths:
+        print(f"✅ 名寄せ結果を出力しました: {path.name}")
+
+    if clusters.empty:
+        print("✅ 同一人物と思われる複数の患者番号はありません。")
     else:
-        print("⚠ 以下の患者氏名に複数の患者番号があります:\n")
-        print(dupes.to_string(index=False))
+        print(f"⚠ 同一人物と思われる患者番号のクラスタ: {summary['clusters']:,} 件"
+              f"（{len(clusters):,} 患者番号、つながり {summary['links']:,} 件）\n")
+        print(clusters.head(PREVIEW_ROWS).to_string(index=False))
+        if len(clusters) > PREVIEW_ROWS:
+            print(f"... ほか {len(clusters) - PREVIEW_ROWS:,} 行")
+
 
 if __name__ == "__main__":
-    print("=== 患者氏名あたりの患者番号重複チェック ===")
-    find_duplicate_patients()
+    parser = argparse.ArgumentParser(description="同一人物と思われる患者番号の名寄せ")
+    parser.add_argument("--force", action="store_true", help=f"前回の状態（{IDENTITY_DIR.name}/）を使わず全件を比較し直す")
+    args = parser.parse_args()
+
+    print("=== 患者の名寄せ（同一人物と思われる患者番号のクラスタ） ===")
+    find_duplicate_patients(force=args.force)
@@ -1,13 +1,25 @@
 # apps/find_katakana_patients.py
 import re
 import pandas as pd
+from apps.utils.catalog import artifact_suffix
 from apps.utils.common import get_latest_parquet
+from apps.utils.context import PipelineContext, from_context
+from apps.utils.output import write_outputs
+from apps.utils.reader import read_parquet
 
 # --------------------------------------------------
 # カタカナ判定（全角カタカナ・長音・スペースを許可）
 # --------------------------------------------------
 KATAKANA_PATTERN = re.compile(r'^[\u30A0-\u30FFー\s]+$')
 
+# ベクトル化用の同じ判定。pyarrow の正規表現(RE2)の \s は ASCII の空白だけなので、
+# Python の \s と同じ空白文字（全角スペース等）を文字クラスに直接並べる
+_WHITESPACE = "\t\n\x0b\x0c\r\x1c-\x1f \x85\xa0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000"
+KATAKANA_FULLMATCH = "[\u30A0-\u30FFー" + _WHITESPACE + "]+"
+
+# 画面に表示する件数の上限（全件はレポートファイルに出力）
+PREVIEW_ROWS = 20
+
 def is_katakana_only(name: str) -> bool:
     """氏名がカタカナのみかどうか判定"""
     if not isinstance(name, str):
@@ -16,31 +28,52 @@ def is_katakana_only(name: str) -> bool:
     return bool(KATAKANA_PATTERN.fullmatch(name))
 
 
-def find_katakana_patients():
-    """最新の karte_ ファイルからカタカナ氏名の患者を抽出"""
-    targets = get_latest_parquet(["karte_"])
-    if not targets:
-        print("⚠ karte_ の Parquetファイルが見つかりません。")
-        return
+def katakana_mask(names: pd.Series) -> pd.Series:
+    """is_katakana_only を Series 全体にまとめて適用した結果（欠損は False）"""
+    names = names.astype("string[pyarrow]").str.strip()
+    return names.str.fullmatch(KATAKANA_FULLMATCH).fillna(False).astype(bool)
+
+
+def find_katakana_patients(ctx: PipelineContext | None = None):
+    """最新の karte_ ファイルからカタカナ氏名の患者を抽出し、レポートを出力"""
+    df = from_context(ctx, "karte")
+    if df is not None:
+        out_ts = ctx.suffix
+    else:
+        targets = get_latest_parquet(["karte_"])
+        if not targets:
+            print("⚠ karte_ の Parquetファイルが見つかりません。")
+            return
 
-    karte_path = targets[0]
-    print(f"📂 対象ファイル: {karte_path.name}")
+        karte_path = targets[0]
+        print(f"📂 対象ファイル: {karte_path.name}")
 
-    df = pd.read_parquet(karte_path)
+        df = read_parquet(karte_path, columns=["患者番号", "患者氏名"])
+        out_ts = artifact_suffix(karte_path)
     if "患者氏名" not in df.columns:
         print("⚠ '患者氏名' 列が見つかりません。")
         return
 
-    # カタカナ氏名の抽出
-    df_kata = df[df["患者氏名"].apply(is_katakana_only)]
+    # 受診ごとの行を患者単位に一意化してから判定
+    patients = df[["患者番号", "患者氏名"]].drop_duplicates()
+    df_kata = (
+        patients[katakana_mask(patients["患者氏名"])]
+        .sort_values(["患者番号", "患者氏名"])
+        .reset_index(drop=True)
+    )
 
+    # 該当なしでも 0 行のレポートを出力する（成果物カタログに今回の結果として登録するため）
+    paths = write_outputs(df_kata, f"katakana_patients_{out_ts}", lineage=("karte",))
     if df_kata.empty:
         print("✅ カタカナ氏名のみの患者は見つかりませんでした。")
+        print(f"✅ 0 件のレポートを出力しました: {' / '.join(p.name for p in paths)}")
         return
 
     print(f"\n🧾 カタカナ氏名のみの患者 ({len(df_kata)} 件):")
-    for _, row in df_kata.iterrows():
-        print(f"  - {row['患者番号']} : {row['患者氏名']}")
+    print(df_kata.head(PREVIEW_ROWS).to_string(index=False))
+    if len(df_kata) > PREVIEW_ROWS:
+        print(f"  …ほか {len(df_kata) - PREVIEW_ROWS} 件")
+    print(f"✅ 出力しました: {' / '.join(p.name for p in paths)}")
 
 
 if __name__ == "__main__":
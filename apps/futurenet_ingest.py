@@ -0,0 +1,404 @@
+# apps/futurenet_ingest.py
+import argparse
+import csv
+import os
+import shutil
+import tempfile
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.dataset as ds
+from apps.merge_data import BASE_DIR, detect_encoding
+from apps.utils.common import OUTPUT_DIR
+from apps.utils.metrics import record_read, record_write
+from apps.utils.output import PARQUET_COMPRESSION, PARQUET_ROW_GROUP_SIZE, write_outputs
+from apps.utils.parquet_meta import write_sorted_parquet
+
+# ==========================================
+# FutureNet（透析システム）のエクスポート取り込み
+#   data/futurenet*/ 以下の 18透析回数 / 31透析記録 / 32バイタル / 33愁訴処置 の CSV を
+#   ブロック単位で型付きのまま読み（全件を DataFrame に載せない）、
+#   患者番号で PATIENT_BUCKETS 個に分けて一時ファイルへ退避 → 区分ごとに 患者番号 → 日時 の順に並べ、
+#   output/futurenet/{テーブル}/患者区分=NN/part-0.parquet に保存する。
+#   バイタルは透析1回（患者番号 × 透析日）ごとに血圧の最小・最大・平均などを NumPy の
+#   reduceat でまとめて集計し、透析記録の体重と合わせて futurenet_session_summary_<時刻> に出力する。
+# ==========================================
+
+# FutureNet のエクスポートを置くフォルダ（data/ 直下の futurenet で始まるフォルダ）
+FUTURENET_DIR_GLOB = "futurenet*"
+
+STORE_DIR = OUTPUT_DIR / "futurenet"
+
+# 患者番号による区分の数（1区分ずつメモリ上で並べ替える）
+PATIENT_BUCKETS = 16
+
+# CSV を読む1ブロックのバイト数
+BLOCK_SIZE = 16 * 2**20
+
+# 欠損とみなす値
+NULL_VALUES = ["", "-", "－", "NULL"]
+
+# 日付・時刻列として試す書式（順に試し、最初に読めた書式を使う）
+DATE_FORMATS = ["%Y/%m/%d", "%Y-%m-%d", "%Y%m%d"]
+TIME_FORMATS = ["%H:%M:%S", "%H:%M"]
+
+# 数値として読める値（前後の空白は除いてから判定）
+INT_PATTERN = r"^[-+]?\d+$"
+FLOAT_PATTERN = r"^[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?$"
+
+
+@dataclass(frozen=True)
+class FutureNetTable:
+    """
+    1種類のエクスポート。columns は列名 → 型（CSV にない列は無視、ここにない列は文字列のまま）。
+    sort_keys は保存時の並び順（先頭は患者番号）。
+    """
+    file_prefix: str
+    name: str
+    columns: dict[str, pa.DataType]
+    sort_keys: list[str]
+
+
+TABLES = (
+    FutureNetTable("18透析回数", "dialysis_counts", {
+        "患者番号": pa.int64(),
+        "年月": pa.string(),
+        "透析回数": pa.int64(),
+    }, ["患者番号", "年月"]),
+    FutureNetTable("31透析記録", "dialysis_sessions", {
+        "患者番号": pa.int64(),
+        "透析日": pa.timestamp("s"),
+        "開始時刻": pa.time32("s"),
+        "終了時刻": pa.time32("s"),
+        "透析前体重": pa.float64(),
+        "透析後体重": pa.float64(),
+        "ドライウェイト": pa.float64(),
+        "除水量": pa.float64(),
+    }, ["患者番号", "透析日", "開始時刻"]),
+    FutureNetTable("32バイタル", "vitals", {
+        "患者番号": pa.int64(),
+        "透析日": pa.timestamp("s"),
+        "測定時刻": pa.time32("s"),
+        "収縮期血圧": pa.float64(),
+        "拡張期血圧": pa.float64(),
+        "脈拍": pa.float64(),
+    }, ["患者番号", "透析日", "測定時刻"]),
+    FutureNetTable("33愁訴処置", "complaints", {
+        "患者番号": pa.int64(),
+        "透析日": pa.timestamp("s"),
+        "時刻": pa.time32("s"),
+        "愁訴": pa.string(),
+        "処置": pa.string(),
+    }, ["患者番号", "透析日", "時刻"]),
+)
+
+# 透析1回の集計で最小・最大・平均を出すバイタル
+BP_COLUMNS = ["収縮期血圧", "拡張期血圧"]
+
+SESSION_KEYS = ["患者番号", "透析日"]
+
+
+# ==========================================
+# 読み込み（ブロック単位のストリーミング）
+# ==========================================
+
+def list_futurenet_files(base_path: Path = BASE_DIR) -> list[Path]:
+    """data/futurenet*/ 以下の対象 CSV（テーブル順 → パス順）"""
+    files = []
+    for table in TABLES:
+        for export_dir in sorted(Path(base_path).glob(FUTURENET_DIR_GLOB)):
+            if export_dir.is_dir():
+                files.extend(sorted(export_dir.rglob(f"{table.file_prefix}*.csv")))
+    return files
+
+
+def _table_of(path: Path) -> FutureNetTable:
+    return next(t for t in TABLES if path.name.startswith(t.file_prefix))
+
+
+def read_header(path: Path) -> list[str]:
+    """CSV の列名（先頭行だけ読む）"""
+    with open(path, encoding=detect_encoding(path), newline="") as f:
+        return next(csv.reader(f), [])
+
+
+def _parse_column(values: pa.Array, dtype: pa.DataType) -> pa.Array:
+    """
+    文字列の列を dtype に変換する。変換できない値（「測定不能」など）は欠損にする
+    （pyarrow の CSV の型指定は1値でも読めないと全体が失敗するため、文字列で読んでから変換する）。
+    """
+    values = pc.utf8_trim_whitespace(values)
+    if pa.types.is_integer(dtype) or pa.types.is_floating(dtype):
+        pattern = INT_PATTERN if pa.types.is_integer(dtype) else FLOAT_PATTERN
+        ok = pc.fill_null(pc.match_substring_regex(values, pattern), False)
+        return pc.cast(pc.if_else(ok, values, pa.scalar(None, pa.string())), dtype)
+    if pa.types.is_timestamp(dtype) or pa.types.is_time(dtype):
+        formats = DATE_FORMATS if pa.types.is_timestamp(dtype) else TIME_FORMATS
+        parsed = pc.coalesce(*(pc.strptime(values, format=fmt, unit="s", error_is_null=True) for fmt in formats))
+        return pc.cast(parsed, dtype)
+    return pc.cast(values, dtype)
+
+
+def iter_csv_batches(
+    path: Path, schema: pa.Schema, block_size: int = BLOCK_SIZE, coerced: dict[str, int] | None = None
+):
+    """
+    CSV をブロック単位の RecordBatch で読む（型は schema、文字コードは先頭から判定）。
+    型に変換できなかった値は欠損にし、その件数を列ごとに coerced へ足す。
+    """
+    read_options = pacsv.ReadOptions(block_size=block_size, encoding=detect_encoding(path))
+    convert_options = pacsv.ConvertOptions(
+        column_types={f.name: pa.string() for f in schema},
+        null_values=NULL_VALUES,
+        strings_can_be_null=True,
+    )
+    with pacsv.open_csv(path, read_options=read_options, convert_options=convert_options) as reader:
+        for batch in reader:
+            columns = []
+            for name in batch.schema.names:
+                values = batch.column(name)
+                dtype = schema.field(name).type
+                if dtype != pa.string():
+                    parsed = _parse_column(values, dtype)
+                    if coerced is not None:
+                        bad = parsed.null_count - values.null_count
+                        if bad:
+                            coerced[name] = coerced.get(name, 0) + bad
+                    values = parsed
+                columns.append(values)
+            yield pa.RecordBatch.from_arrays(columns, schema=pa.schema([schema.field(n) for n in batch.schema.names]))
+
+
+def _bucket_of(patient: pa.ChunkedArray | pa.Array) -> np.ndarray:
+    """患者番号 → 区分（欠損は最後の区分 PATIENT_BUCKETS）"""
+    values = pc.fill_null(patient, -1).to_numpy(zero_copy_only=False).astype("int64")
+    bucket = np.mod(values, PATIENT_BUCKETS)
+    bucket[values < 0] = PATIENT_BUCKETS
+    return bucket
+
+
+def _spill(batch: pa.RecordBatch, schema: pa.Schema, writers: dict, spill_dir: Path, name: str) -> None:
+    """バッチを患者区分ごとの一時ファイル（Arrow IPC）へ追記する"""
+    table = pa.table(
+        [batch.column(f.name) if f.name in batch.schema.names else pa.nulls(batch.num_rows, f.type) for f in schema],
+        schema=schema,
+    )
+    bucket = _bucket_of(table.column("患者番号"))
+    order = np.argsort(bucket, kind="stable")
+    table = table.take(pa.array(order))
+    edges = np.searchsorted(bucket[order], np.arange(PATIENT_BUCKETS + 2))
+    for b in range(PATIENT_BUCKETS + 1):
+        lo, hi = edges[b], edges[b + 1]
+        if lo == hi:
+            continue
+        key = (name, b)
+        if key not in writers:
+            writers[key] = pa.ipc.new_stream(spill_dir / f"{name}_{b:02d}.arrow", schema)
+        writers[key].write_table(table.slice(lo, hi - lo))
+
+
+def _unified_schema(paths: list[Path], table: FutureNetTable) -> pa.Schema:
+    """同じ種類の全ファイルの列をまとめたスキーマ（型指定のない列は文字列）"""
+    names: list[str] = []
+    for path in paths:
+        names.extend(n for n in read_header(path) if n not in names)
+    return pa.schema([pa.field(n, table.columns.get(n, pa.string())) for n in names])
+
+
+# ==========================================
+# 透析1回ごとの集計（NumPy）
+# ==========================================
+
+def _group_starts(*keys: np.ndarray) -> np.ndarray:
+    """並べ替え済みのキー列から、グループの先頭の行番号を返す"""
+    n = len(keys[0])
+    change = np.zeros(n, dtype=bool)
+    if n:
+        change[0] = True
+    for key in keys:
+        change[1:] |= key[1:] != key[:-1]
+    return np.flatnonzero(change)
+
+
+def _nan_stats(values: np.ndarray, starts: np.ndarray) -> dict[str, np.ndarray]:
+    """グループごとの件数・最小・最大・平均（NaN は除く。全部 NaN のグループは NaN）"""
+    valid = ~np.isnan(values)
+    count = np.add.reduceat(valid.astype("int64"), starts)
+    total = np.add.reduceat(np.where(valid, values, 0.0), starts)
+    vmin = np.minimum.reduceat(np.where(valid, values, np.inf), starts)
+    vmax = np.maximum.reduceat(np.where(valid, values, -np.inf), starts)
+    empty = count == 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+    for arr in (vmin, vmax, mean):
+        arr[empty] = np.nan
+    return {"count": count, "min": vmin, "max": vmax, "mean": mean}
+
+
+def _float_column(table: pa.Table, name: str) -> np.ndarray:
+    if name not in table.column_names:
+        return np.full(table.num_rows, np.nan)
+    return pc.cast(table.column(name), pa.float64()).to_numpy(zero_copy_only=False)
+
+
+def session_vitals(vitals: pa.Table) -> pd.DataFrame:
+    """
+    患者番号 → 透析日 → 測定時刻の順に並んだバイタルから、透析1回ごとの集計を作る。
+    グループの境界を求めて reduceat でまとめるため、行ごとの Python の処理はない。
+    """
+    keyed = vitals.filter(pc.and_(pc.is_valid(vitals.column("患者番号")), pc.is_valid(vitals.column("透析日"))))
+    if keyed.num_rows == 0:
+        return pd.DataFrame(columns=SESSION_KEYS)
+    patient = keyed.column("患者番号").to_numpy()
+    day = pc.cast(keyed.column("透析日"), pa.timestamp("s")).cast(pa.int64()).to_numpy()
+    starts = _group_starts(patient, day)
+
+    out = {
+        "患者番号": patient[starts],
+        "透析日": day[starts].astype("datetime64[s]"),
+        "測定回数": np.diff(np.append(starts, keyed.num_rows)),
+    }
+    for col in BP_COLUMNS:
+        stats = _nan_stats(_float_column(keyed, col), starts)
+        out[f"{col}_最小"] = stats["min"]
+        out[f"{col}_最大"] = stats["max"]
+        out[f"{col}_平均"] = stats["mean"]
+    out["脈拍_平均"] = _nan_stats(_float_column(keyed, "脈拍"), starts)["mean"]
+    return pd.DataFrame(out)
+
+
+def session_summary(vitals: pa.Table | None, sessions: pa.Table | None) -> pd.DataFrame:
+    """1区分分のバイタル集計と透析記録（体重）を 患者番号 × 透析日 で合わせる"""
+    summary = session_vitals(vitals) if vitals is not None else pd.DataFrame(columns=SESSION_KEYS)
+    if sessions is not None and sessions.num_rows:
+        weights = pd.DataFrame({
+            "患者番号": sessions.column("患者番号").to_numpy(zero_copy_only=False),
+            "透析日": pc.cast(sessions.column("透析日"), pa.timestamp("s")).to_numpy(zero_copy_only=False),
+            "透析前体重": _float_column(sessions, "透析前体重"),
+            "透析後体重": _float_column(sessions, "透析後体重"),
+        }).dropna(subset=SESSION_KEYS).drop_duplicates(SESSION_KEYS)
+        weights["体重変化"] = weights["透析後体重"] - weights["透析前体重"]
+        weights["患者番号"] = weights["患者番号"].astype("int64")
+        if summary.empty:
+            summary = weights
+        else:
+            summary = summary.merge(weights, on=SESSION_KEYS, how="outer")
+    return summary
+
+
+# ==========================================
+# 取り込み
+# ==========================================
+
+def _write_bucket(table: pa.Table, spec: FutureNetTable, out_dir: Path, bucket: int) -> tuple[Path, pa.Table]:
+    """1区分を並べ替えて保存し、(保存先, 並べ替えた表) を返す"""
+    path = out_dir / f"患者区分={bucket:02d}" / "part-0.parquet"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    keys = [k for k in spec.sort_keys if k in table.column_names]
+    table = table.sort_by([(k, "ascending") for k in keys])
+    write_sorted_parquet(table, path, keys, compression=PARQUET_COMPRESSION, row_group_size=PARQUET_ROW_GROUP_SIZE)
+    return path, table
+
+
+def ingest_futurenet(base_path: Path = BASE_DIR, block_size: int = BLOCK_SIZE) -> pd.DataFrame | None:
+    """
+    FutureNet の CSV を取り込み、テーブルごとの Parquet（患者区分ごと・患者番号 → 日時順）を作り直す。
+    戻り値は透析1回ごとの集計（対象ファイルがなければ None）。
+    """
+    files = list_futurenet_files(base_path)
+    if not files:
+        print(f"⚠ FutureNet のファイルが見つかりません（{Path(base_path) / FUTURENET_DIR_GLOB}）。")
+        return None
+    record_read(files)
+
+    by_table: dict[str, list[Path]] = {}
+    for path in files:
+        by_table.setdefault(_table_of(path).name, []).append(path)
+    specs = {t.name: t for t in TABLES if t.name in by_table}
+
+    STORE_DIR.mkdir(parents=True, exist_ok=True)
+    summaries = []
+    with tempfile.TemporaryDirectory(prefix="futurenet_", dir=OUTPUT_DIR) as tmp:
+        spill_dir = Path(tmp) / "spill"
+        spill_dir.mkdir()
+        schemas: dict[str, pa.Schema] = {}
+        writers: dict[tuple[str, int], pa.ipc.RecordBatchStreamWriter] = {}
+        try:
+            for name, spec in specs.items():
+                schemas[name] = _unified_schema(by_table[name], spec)
+                for path in by_table[name]:
+                    n = 0
+                    coerced: dict[str, int] = {}
+                    for batch in iter_csv_batches(path, schemas[name], block_size, coerced):
+                        _spill(batch, schemas[name], writers, spill_dir, name)
+                        n += batch.num_rows
+                    print(f"  → {path.parent.name}/{path.name}: {n:,} 行")
+                    for col, count in coerced.items():
+                        print(f"  ⚠ {path.name} の {col} に型（{schemas[name].field(col).type}）に変換できない値が "
+                              f"{count:,} 件あるため欠損にしました。")
+        finally:
+            for w in writers.values():
+                w.close()
+
+        # 区分ごとに並べ替えて保存（作り直したフォルダは最後に入れ替える）
+        staged = Path(tmp) / "store"
+        for b in range(PATIENT_BUCKETS + 1):
+            loaded: dict[str, pa.Table] = {}
+            for name, spec in specs.items():
+                spill = spill_dir / f"{name}_{b:02d}.arrow"
+                if not spill.exists():
+                    continue
+                with pa.ipc.open_stream(spill) as reader:
+                    table = reader.read_all()
+                path, table = _write_bucket(table, spec, staged / name, b)
+                record_write(path, table.num_rows)
+                if name in ("vitals", "dialysis_sessions"):
+                    loaded[name] = table
+            if loaded:
+                summaries.append(session_summary(loaded.get("vitals"), loaded.get("dialysis_sessions")))
+
+        for name in specs:
+            dest = STORE_DIR / name
+            shutil.rmtree(dest, ignore_errors=True)
+            os.replace(staged / name, dest)
+            print(f"✅ 保存しました: {dest.relative_to(OUTPUT_DIR)}")
+
+    summaries = [s for s in summaries if not s.empty]
+    if not summaries:
+        return pd.DataFrame(columns=SESSION_KEYS)
+    summary = pd.concat(summaries, ignore_index=True)
+    return summary.sort_values(SESSION_KEYS, kind="stable").reset_index(drop=True)
+
+
+def open_futurenet(name: str) -> ds.Dataset | None:
+    """取り込み済みのテーブル（dialysis_counts / dialysis_sessions / vitals / complaints）を開く"""
+    path = STORE_DIR / name
+    if not path.is_dir():
+        return None
+    return ds.dataset(path, format="parquet", partitioning="hive")
+
+
+def run_ingest_futurenet(ctx=None, base_path: Path = BASE_DIR) -> None:
+    print("\n--- ⑬ FutureNet（透析回数・透析記録・バイタル・愁訴処置）の取り込み ---")
+    summary = ingest_futurenet(base_path)
+    if summary is None:
+        return
+    ts = ctx.run_ts if ctx is not None else datetime.now().strftime("%Y%m%d_%H%M%S")
+    paths = write_outputs(summary, f"futurenet_session_summary_{ts}", sort_keys=SESSION_KEYS,
+                          lineage=tuple(f"futurenet/{t.name}" for t in TABLES))
+    for path in paths:
+        print(f"✅ 透析1回ごとの集計: {path.name}")
+    print(f"📊 透析回数（集計）: {len(summary):,} 回")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FutureNet のエクスポート取り込み")
+    parser.add_argument("--base-path", type=Path, default=BASE_DIR, help="futurenet* フォルダのある場所")
+    args = parser.parse_args()
+
+    run_ingest_futurenet(base_path=args.base_path)
@@ -1,32 +1,50 @@
 # apps/inspect_headers.py
 from pathlib import Path
-import re
-import pandas as pd
-from apps.utils.common import OUTPUT_DIR
+from apps.utils.catalog import latest_artifact
+from apps.utils.context import PipelineContext, from_context
+from apps.utils.parquet_meta import column_names, column_stats, num_rows
 
-RE_DIAG = re.compile(r"^diagnosis_\d{8}_\d{6}\.parquet$")
-RE_KARTE = re.compile(r"^karte_\d{8}_\d{6}\.parquet$")
-RE_PROC_BASE = re.compile(r"^procedure_\d{8}_\d{6}\.parquet$")  # with_patient を除外
-
-def _pick_latest_by_regex(regex: re.Pattern) -> Path | None:
-    files = sorted(OUTPUT_DIR.glob("*.parquet"))
-    matched = [f for f in files if regex.match(f.name)]
-    return matched[-1] if matched else None
+def show_column_stats(pq_path: Path):
+    """フッターの行グループの統計から、列ごとの最小値・最大値・欠損数を表示（データ本体は読まない）"""
+    stats = column_stats(pq_path)
+    if stats.empty:
+        return
+    print("📈 列ごとの統計（フッター）:")
+    print(stats[["列", "最小値", "最大値", "欠損数"]].to_string(index=False))
 
 def show_parquet_header(pq_path: Path):
+    """フッターだけを読んで列名・件数・列ごとの統計を表示（データ本体は読まない）"""
     try:
-        df = pd.read_parquet(pq_path, columns=None)
+        columns = column_names(pq_path)
+        n_rows = num_rows(pq_path)
         print(f"\n📁 {pq_path.name}")
         print("=" * (len(pq_path.name) + 4))
-        print(", ".join(df.columns))
+        print(", ".join(columns))
+        print(f"📊 レコード数: {n_rows:,}")
+        show_column_stats(pq_path)
     except Exception as e:
         print(f"⚠ {pq_path.name} の読み込みに失敗: {e}")
 
-def show_latest_headers():
+def show_latest_headers(ctx: PipelineContext | None = None):
     print("=== diagnosis / karte / procedure の Parquetヘッダーを確認 ===")
+    frames = {key: from_context(ctx, key) for key in ("diagnosis", "karte", "procedure")}
+    if all(df is not None for df in frames.values()):
+        # 結合直後のデータがあれば列名はそこから表示し、統計は保存済みファイルのフッターから読む
+        for key, df in frames.items():
+            print(f"\n📁 {key}_{ctx.run_ts}")
+            print("=" * (len(key) + len(ctx.run_ts) + 5))
+            print(", ".join(df.columns))
+            p = latest_artifact(key)
+            if p:
+                try:
+                    show_column_stats(p)
+                except Exception as e:
+                    print(f"⚠ {p.name} の統計の読み込みに失敗: {e}")
+        return
+
     targets = []
-    for regex in (RE_DIAG, RE_KARTE, RE_PROC_BASE):
-        p = _pick_latest_by_regex(regex)
+    for key in ("diagnosis", "karte", "procedure"):
+        p = latest_artifact(key)
         if p:
             targets.append(p)
 
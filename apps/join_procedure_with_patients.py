@@ -1,41 +1,151 @@
 # apps/join_procedure_with_patients.py
+import argparse
+import math
+import tempfile
+from dataclasses import dataclass
 from pathlib import Path
-import re
+import numpy as np
 import pandas as pd
-from apps.utils.common import OUTPUT_DIR
+import pyarrow as pa
+from apps.utils.catalog import artifact_suffix, latest_artifact
+from apps.utils.common import OUTPUT_DIR, open_parquet
+from apps.utils.context import PipelineContext, from_context
+from apps.utils.output import OutputWriter, to_arrow, write_outputs
+from apps.utils.parquet_meta import read_schema, sorted_by
+from apps.utils.reader import read_parquet
 
-# 正規表現で「素の procedure」「unique_karte_core」だけを厳密に拾う
-RE_PROCEDURE_BASE = re.compile(r"^procedure_\d{8}_\d{6}\.parquet$")
-RE_UNIQUE_KARTE_CORE = re.compile(r"^unique_karte_core_\d{6}\.parquet$")
+# 入力の成果物名（カタログの lineage にも記録）
+LINEAGE = ("procedure", "unique_karte_core")
 
-def _pick_latest_by_regex(regex: re.Pattern) -> Path | None:
-    files = sorted(OUTPUT_DIR.glob("*.parquet"))
-    matched = [f for f in files if regex.match(f.name)]
-    return matched[-1] if matched else None
+# 出力の並び順（unique_karte_core がこの順で保存されていれば再ソートを省ける）
+SORT_KEYS = ["患者番号", "日付"]
 
-def join_procedure_with_patients() -> None:
-    # ← ここで with_patient を除外した「素の」procedure_* を取得
-    proc_pq = _pick_latest_by_regex(RE_PROCEDURE_BASE)
-    core_pq = _pick_latest_by_regex(RE_UNIQUE_KARTE_CORE)
+# 結合に使う core の列（カルテID → 患者番号・患者氏名）
+CORE_COLUMNS = ["カルテID", "患者番号", "患者氏名"]
+
+# ストリーミング結合で procedure を読む1バッチの行数（外部ソートの1バケットもこの程度の行数にする）
+DEFAULT_BATCH_SIZE = 100_000
+
+def _sort_values_i8(s: pd.Series) -> np.ndarray | None:
+    """整数・日付列を大小比較用の int64 配列にする（欠損は別途判定。対象外の型は None）"""
+    if pd.api.types.is_integer_dtype(s):
+        return s.to_numpy(dtype="int64", na_value=0)
+    if pd.api.types.is_datetime64_dtype(s):
+        return s.to_numpy().view("i8")
+    if isinstance(s.dtype, pd.ArrowDtype) and pa.types.is_timestamp(s.dtype.pyarrow_dtype):
+        return pa.array(s).cast(pa.int64()).fill_null(0).to_numpy()
+    return None
+
+def _is_sorted_by(df: pd.DataFrame, cols: list[str]) -> bool:
+    """df が cols の昇順（欠損は末尾）に並んでいるかを隣接行の比較で判定"""
+    if len(df) < 2:
+        return True
+    ok = np.ones(len(df) - 1, dtype=bool)
+    for col in reversed(cols):
+        values = _sort_values_i8(df[col])
+        if values is None:
+            return False
+        # 欠損フラグ → 値 の順に辞書式比較（欠損は末尾）
+        for arr in (values, df[col].isna().to_numpy()):
+            prev, nxt = arr[:-1], arr[1:]
+            ok = (prev < nxt) | ((prev == nxt) & ok)
+    return bool(ok.all())
+
+def _merge_in_core_order(core: pd.DataFrame, proc: pd.DataFrame) -> pd.DataFrame:
+    """
+    患者番号→日付順に並んだ core を左にして結合し、core の並びを引き継ぐ。
+    core に無いカルテIDの procedure 行は患者番号を欠損として末尾に日付順で付け足す。
+    """
+    matched = core.merge(proc, on="カルテID", how="inner", sort=False)
+    rest = proc[~proc["カルテID"].isin(core["カルテID"])]
+    if rest.empty:
+        return matched
+    rest = rest.assign(
+        患者番号=pd.Series(pd.NA, index=rest.index, dtype=core["患者番号"].dtype),
+        患者氏名=pd.Series(pd.NA, index=rest.index, dtype=core["患者氏名"].dtype),
+    )
+    if "日付" in rest.columns:
+        rest = rest.sort_values("日付", kind="stable", na_position="last")
+    return pd.concat([matched, rest[matched.columns]], ignore_index=True)
+
+def _latest_inputs() -> tuple[Path, Path, str] | None:
+    """最新の procedure_* / unique_karte_core_* と出力ファイル名に使う時刻部分"""
+    # 成果物名で引くので procedure_with_patient_* と取り違えない
+    proc_pq = latest_artifact("procedure")
+    core_pq = latest_artifact("unique_karte_core")
 
     if proc_pq is None:
         print("⚠ procedure_* の Parquet が見つかりません。")
-        return
+        return None
     if core_pq is None:
         print("⚠ unique_karte_core_* の Parquet が見つかりません。")
-        return
+        return None
 
     print(f"📂 procedure: {proc_pq.name}")
     print(f"📂 unique_karte_core: {core_pq.name}")
 
-    proc = pd.read_parquet(proc_pq)
-    core = pd.read_parquet(core_pq)[["カルテID", "患者番号", "患者氏名"]].drop_duplicates()
+    # 出力ファイル名は procedure_* の時刻部分を流用（データセットのフォルダは更新時刻）
+    # 例: procedure_20251102_110939.parquet → 110939
+    return proc_pq, core_pq, artifact_suffix(proc_pq)
 
-    # 左結合で患者番号・患者氏名を付与
-    df = core.merge(proc, on="カルテID", how="right")
+def join_procedure_with_patients(
+    ctx: PipelineContext | None = None,
+    streaming: bool = False,
+    sort: bool = True,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> None:
+    """
+    procedure の各行に unique_karte_core の患者番号・患者氏名を付与して出力。
+    streaming=True では Parquet からバッチ単位で結合・出力し、procedure 全体をメモリに載せない
+    （sort=True なら外部ソートで患者番号→日付順にする）。
+    """
+    if streaming:
+        join_procedure_with_patients_streaming(sort=sort, batch_size=batch_size)
+        return
 
-    # 患者番号を数値として扱う（欠損はNA）
-    if "患者番号" in df.columns:
+    proc = from_context(ctx, "procedure")
+    core = from_context(ctx, "unique_karte_core")
+
+    if proc is not None:
+        # 出力ファイル名は save_outputs の時刻部分を流用
+        ts = ctx.suffix
+        if core is None:
+            # unique_karte_core のステップがスキップされた場合は、結合直後の procedure はそのまま使い、
+            # core だけを成果物カタログから読む（procedure と同じ numpy の nullable 型で）
+            core_pq = latest_artifact("unique_karte_core")
+            if core_pq is None:
+                print("⚠ unique_karte_core_* の Parquet が見つかりません。")
+                return
+            print(f"📂 unique_karte_core: {core_pq.name}")
+            core = read_parquet(core_pq, columns=["カルテID", "患者番号", "患者氏名"], dtype_backend="numpy_nullable")
+            core.attrs["sorted_by"] = sorted_by(core_pq)
+    else:
+        inputs = _latest_inputs()
+        if inputs is None:
+            return
+        proc_pq, core_pq, ts = inputs
+
+        proc = read_parquet(proc_pq)
+        core = read_parquet(core_pq)
+        core.attrs["sorted_by"] = sorted_by(core_pq)
+
+    core_sorted = core.attrs.get("sorted_by") == SORT_KEYS
+    core = core[["カルテID", "患者番号", "患者氏名"]].drop_duplicates()
+
+    # 型付きで読み込めなかった側がある場合は文字列にそろえて結合
+    if core["カルテID"].dtype != proc["カルテID"].dtype:
+        core = core.assign(カルテID=core["カルテID"].astype("string"))
+        proc = proc.assign(カルテID=proc["カルテID"].astype("string"))
+
+    # 患者番号・患者氏名を付与（procedure の全行を残す）
+    if core_sorted and pd.api.types.is_integer_dtype(core["患者番号"]):
+        # core が患者番号→日付順に保存済みなら、その並びのまま結合する
+        df = _merge_in_core_order(core, proc)
+    else:
+        df = core.merge(proc, on="カルテID", how="right")
+
+    # 患者番号を数値として扱う（欠損はNA）。読み込み時に Int64 化済みなら不要
+    if "患者番号" in df.columns and not pd.api.types.is_integer_dtype(df["患者番号"]):
         df["患者番号"] = pd.to_numeric(df["患者番号"], errors="coerce").astype("Int64")
 
     # 並び替え（患者番号 昇順 → 日付 昇順）
@@ -44,23 +154,231 @@ def join_procedure_with_patients() -> None:
         sort_cols.append("患者番号")
     if "日付" in df.columns:
         sort_cols.append("日付")
-    if sort_cols:
-        df = df.sort_values(sort_cols, na_position="last").reset_index(drop=True)
+    if sort_cols and not _is_sorted_by(df, sort_cols):
+        df = df.sort_values(sort_cols, na_position="last", kind="stable").reset_index(drop=True)
 
     # 列順（患者情報を先頭へ）
     front = [c for c in ["患者番号", "患者氏名"] if c in df.columns]
     cols = front + [c for c in df.columns if c not in front]
     df = df[cols]
 
-    # 出力ファイル名は procedure_* の時刻部分を流用
-    # 例: procedure_20251102_110939.parquet → 110939
-    ts = proc_pq.stem.split("_")[-1]
-    csv_out = OUTPUT_DIR / f"procedure_with_patient_{ts}.csv"
-    pq_out = OUTPUT_DIR / f"procedure_with_patient_{ts}.parquet"
-
-    df.to_csv(csv_out, index=False, encoding="utf-8-sig")
-    df.to_parquet(pq_out, index=False)
+    paths = write_outputs(df, f"procedure_with_patient_{ts}", lineage=LINEAGE)
+    if ctx is not None:
+        ctx.put("procedure_with_patient", df)
 
-    print(f"✅ 出力しました: {csv_out.name}")
-    print(f"✅ 出力しました: {pq_out.name}")
+    for path in paths:
+        print(f"✅ 出力しました: {path.name}")
     print(f"📊 レコード数: {len(df):,}")
+
+
+# ==========================================
+# ストリーミング結合（procedure をバッチ単位で処理）
+# ==========================================
+
+# カルテIDの照合用に pandas へ変換するときの型（schema.py の型に合わせる）
+_KEY_TYPES = {
+    pa.int64(): pd.Int64Dtype(),
+    pa.string(): pd.StringDtype(),
+    pa.large_string(): pd.StringDtype(),
+}
+
+@dataclass
+class _CoreLookup:
+    """カルテID → 患者番号・患者氏名 の対応表（メモリ上のハッシュ表）"""
+    frame: pd.DataFrame  # カルテID順に並べた core（pandas の型のまま）
+    table: pa.Table      # frame の患者番号・患者氏名
+    index: pd.Index      # 一意なカルテID（get_indexer でハッシュ検索）
+    starts: np.ndarray   # 各カルテIDの table 上の先頭行
+    counts: np.ndarray   # 各カルテIDの行数（通常は 1）
+
+    @classmethod
+    def from_parquet(cls, core_pq: Path, key_as_string: bool) -> "_CoreLookup":
+        core = read_parquet(core_pq, columns=CORE_COLUMNS, dtype_backend="numpy_nullable").drop_duplicates()
+        if not pd.api.types.is_integer_dtype(core["患者番号"]):
+            core["患者番号"] = pd.to_numeric(core["患者番号"], errors="coerce").astype("Int64")
+        if key_as_string:
+            core = core.assign(カルテID=core["カルテID"].astype("string"))
+
+        # カルテIDが欠損した行は照合できないので除く。同じカルテIDの行は連続させる
+        core = core[core["カルテID"].notna()].sort_values("カルテID", kind="stable")
+        codes, uniques = pd.factorize(core["カルテID"])
+        counts = np.bincount(codes, minlength=len(uniques))
+        return cls(
+            frame=core.reset_index(drop=True),
+            table=pa.Table.from_pandas(core[["患者番号", "患者氏名"]], preserve_index=False),
+            index=pd.Index(uniques),
+            starts=np.cumsum(counts) - counts,
+            counts=counts,
+        )
+
+    def probe(self, keys: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+        """
+        keys の各行に一致する core の行を引く。
+        戻り値は (keys 側の行番号, core 側の行番号)。一致しない行は core 側が -1 で1行だけ残る。
+        """
+        group = self.index.get_indexer(keys)
+        found = group >= 0
+        n = np.where(found, self.counts[group], 1)
+        rows = np.repeat(np.arange(len(keys)), n)
+        first = np.repeat(np.where(found, self.starts[group], -1), n)
+        offset = np.arange(len(rows)) - np.repeat(np.cumsum(n) - n, n)
+        return rows, np.where(first >= 0, first + offset, -1)
+
+def _output_layout(lookup: _CoreLookup, proc_schema: pa.Schema) -> tuple[list[tuple[str, str, str]], pa.Schema]:
+    """
+    インメモリ版（core.merge(proc, how="right") → 患者情報を先頭へ）と同じ列名・列順と、
+    出力 Parquet のスキーマ（pandas の型情報付き）を求める。
+    列ごとに (出力列名, "core" / "proc", 元の列名) を返す。
+    """
+    proc_columns = proc_schema.names
+    source = {}
+    for c in CORE_COLUMNS:
+        if c == "カルテID":
+            source[c] = ("proc", c)  # right 結合なのでキーは procedure 側の値
+        else:
+            source[c + "_x" if c in proc_columns else c] = ("core", c)
+    for c in proc_columns:
+        if c != "カルテID":
+            source[c + "_y" if c in CORE_COLUMNS else c] = ("proc", c)
+
+    # 空の DataFrame で同じ結合をして、列順と型を決める
+    empty_proc = proc_schema.empty_table().to_pandas()
+    if lookup.frame["カルテID"].dtype != empty_proc["カルテID"].dtype:
+        empty_proc = empty_proc.assign(カルテID=empty_proc["カルテID"].astype("string"))
+    empty = lookup.frame.iloc[:0].merge(empty_proc, on="カルテID", how="right")
+    front = [c for c in ["患者番号", "患者氏名"] if c in empty.columns]
+    empty = empty[front + [c for c in empty.columns if c not in front]]
+
+    layout = [(c, *source[c]) for c in empty.columns]
+    fields = []
+    for name, side, col in layout:
+        schema = lookup.table.schema if side == "core" else proc_schema
+        fields.append(pa.field(name, schema.field(col).type))
+    metadata = to_arrow(empty).schema.metadata
+    return layout, pa.schema(fields, metadata=metadata)
+
+def _join_batch(
+    batch: pa.RecordBatch,
+    lookup: _CoreLookup,
+    layout: list[tuple[str, str, str]],
+    schema: pa.Schema,
+) -> pa.Table:
+    """procedure の1バッチに患者番号・患者氏名を付与（procedure の行順のまま）"""
+    keys = batch.column("カルテID").to_pandas(types_mapper=_KEY_TYPES.get)
+    rows, core_rows = lookup.probe(keys)
+    if len(rows) != batch.num_rows:
+        batch = batch.take(pa.array(rows))
+    patients = lookup.table.take(pa.array(core_rows, mask=core_rows < 0))
+
+    columns = [
+        patients.column(col) if side == "core" else batch.column(col)
+        for _, side, col in layout
+    ]
+    return pa.Table.from_arrays(columns, schema=schema)
+
+def _bucket_bounds(lookup: _CoreLookup, total_rows: int, bucket_rows: int) -> np.ndarray:
+    """
+    外部ソートのバケット境界（患者番号）。core の患者番号の分位点で区切り、
+    1バケットがおよそ bucket_rows 行になるようにする。同じ患者は必ず同じバケットに入る。
+    """
+    ids = lookup.frame["患者番号"].dropna().to_numpy(dtype="int64")
+    n_buckets = math.ceil(total_rows / max(1, bucket_rows))
+    if n_buckets <= 1 or len(ids) == 0:
+        return np.array([], dtype="int64")
+    q = np.linspace(0, 1, n_buckets + 1)[1:-1]
+    return np.unique(np.quantile(ids, q, method="lower"))
+
+def _spill_to_buckets(table: pa.Table, bounds: np.ndarray, writers: dict, spill_dir: Path) -> None:
+    """結合済みバッチを患者番号のバケットごとに一時ファイル（Arrow IPC）へ追記する"""
+    patient = table.column("患者番号").to_pandas(types_mapper=_KEY_TYPES.get)
+    bucket = np.searchsorted(bounds, patient.to_numpy(dtype="int64", na_value=0), side="right")
+    bucket[patient.isna().to_numpy()] = len(bounds) + 1  # 患者番号なしは最後
+    order = np.argsort(bucket, kind="stable")
+    bucket = bucket[order]
+    table = table.take(pa.array(order))
+    edges = np.searchsorted(bucket, np.arange(len(bounds) + 3))
+    for b in range(len(bounds) + 2):
+        lo, hi = edges[b], edges[b + 1]
+        if lo == hi:
+            continue
+        if b not in writers:
+            writers[b] = pa.ipc.new_stream(spill_dir / f"bucket_{b:05d}.arrow", table.schema)
+        writers[b].write_table(table.slice(lo, hi - lo))
+
+def join_procedure_with_patients_streaming(
+    sort: bool = True,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> int:
+    """
+    最新の procedure_* Parquet を行グループ単位のバッチで読み、
+    メモリ上のハッシュ表（カルテID → 患者番号・患者氏名）で結合して逐次書き出す。
+    sort=True の場合は患者番号の範囲でバケットに分けて一時ファイルに退避し、
+    バケット順にソートして出力する（外部ソート。結果はインメモリ版と同じ並び）。
+    戻り値は出力件数。
+    """
+    inputs = _latest_inputs()
+    if inputs is None:
+        return 0
+    proc_pq, core_pq, ts = inputs
+
+    # procedure はファイルでもデータセットのフォルダ（save_outputs(layout="dataset")）でもよい
+    proc_data = open_parquet(proc_pq)
+    proc_schema = proc_data.schema
+    core_key_type = read_schema(core_pq).field("カルテID").type
+    key_as_string = core_key_type != proc_schema.field("カルテID").type
+    if key_as_string:
+        # 型付きで読み込めなかった側がある場合は文字列にそろえて結合
+        proc_schema = proc_schema.set(
+            proc_schema.get_field_index("カルテID"), pa.field("カルテID", pa.string())
+        )
+
+    lookup = _CoreLookup.from_parquet(core_pq, key_as_string)
+    layout, schema = _output_layout(lookup, proc_schema)
+    sort_cols = [c for c in SORT_KEYS if c in schema.names]
+
+    def joined_batches():
+        for batch in proc_data.to_batches(batch_size=batch_size):
+            if key_as_string:
+                i = batch.schema.get_field_index("カルテID")
+                batch = batch.set_column(i, "カルテID", batch.column(i).cast(pa.string()))
+            yield _join_batch(batch, lookup, layout, schema)
+
+    with OutputWriter(f"procedure_with_patient_{ts}", schema, lineage=LINEAGE) as out:
+        if not sort or not sort_cols:
+            for table in joined_batches():
+                out.write(table)
+        elif "患者番号" not in sort_cols:
+            # 患者番号の列が無い（列名が重複した）場合はバケット分けできないのでメモリ上でソート
+            print("⚠ 患者番号の列が無いため、メモリ上でソートします。")
+            out.write(pa.concat_tables(joined_batches()).sort_by([(c, "ascending") for c in sort_cols]))
+        else:
+            bounds = _bucket_bounds(lookup, proc_data.count_rows(), batch_size)
+            with tempfile.TemporaryDirectory(prefix="join_spill_", dir=OUTPUT_DIR) as tmp:
+                spill_dir = Path(tmp)
+                writers: dict[int, pa.ipc.RecordBatchStreamWriter] = {}
+                try:
+                    for table in joined_batches():
+                        _spill_to_buckets(table, bounds, writers, spill_dir)
+                finally:
+                    for w in writers.values():
+                        w.close()
+                print(f"  → 外部ソート: {len(writers)} バケット")
+                # バケットは患者番号の範囲順。各バケット内を安定ソート（欠損は末尾）
+                for b in sorted(writers):
+                    with pa.ipc.open_stream(spill_dir / f"bucket_{b:05d}.arrow") as reader:
+                        table = reader.read_all()
+                    out.write(table.sort_by([(c, "ascending") for c in sort_cols]))
+
+    for path in out.paths:
+        print(f"✅ 出力しました: {path.name}")
+    print(f"📊 レコード数: {out.num_rows:,}")
+    return out.num_rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="procedure に患者番号・氏名を付与")
+    parser.add_argument("--streaming", action="store_true", help="バッチ単位で結合し、procedure 全体をメモリに載せない")
+    parser.add_argument("--no-sort", action="store_true", help="患者番号→日付の並び替えをしない（procedure の行順で出力）")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="1バッチの行数")
+    args = parser.parse_args()
+
+    join_procedure_with_patients(streaming=args.streaming, sort=not args.no_sort, batch_size=args.batch_size)
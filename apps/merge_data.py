@@ -1,7 +1,24 @@
 from pathlib import Path
 import pandas as pd
+import argparse
+import codecs
+import hashlib
+import json
+import os
 import re
+import shutil
 from datetime import datetime
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from apps.utils.catalog import artifact_info, latest_artifact, register_dataset
+from apps.utils.common import DATASET_DIR
+from apps.utils.output import PARQUET_COMPRESSION, PARQUET_ROW_GROUP_SIZE, to_arrow, write_outputs
+from apps.utils.parquet_meta import SORTED_BY_KEY
+from apps.utils.schema import DATE_FORMATS as SCHEMA_DATE_FORMATS, TABLE_SCHEMAS, apply_schema
+from apps.utils.manifest import load_manifest, save_manifest, file_fingerprint, same_content
+from apps.utils.metrics import record_read, record_write
+from apps.utils.parallel import process_pool
 
 # ==========================================
 # 設定
@@ -24,18 +41,105 @@ OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 # business_report_YYYYMMDD_YYYYMMDD という形式のみ許可
 DATE_DIR_RE = re.compile(r"^business_report_(\d{8})_(\d{8})$")
 
+# 差分取り込み用: 期間ごとの Parquet（種類ごとのデータセット）とマニフェストの保存先
+INCREMENTAL_DIR = OUTPUT_DIR / "incremental"
+MANIFEST_PATH = INCREMENTAL_DIR / "manifest.json"
+
+# 期間ごとの Parquet の形式の版（load_period / read_csv_with_fallback の読み方を変えたら上げる）
+PERIOD_CACHE_VERSION = 3
+
+# save_outputs の保存形式
+#   timestamped : {種類}_<時刻>.parquet / .csv（実行のたびに全件を新しいファイルに書く）
+#   dataset     : output/dataset/{種類}/ の Hive 形式のパーティション付きデータセット（固定パスを置き換え）
+#   環境変数 OUTPUT_LAYOUT（既定 timestamped）と OUTPUT_PARTITION_BY（source / month、既定 source）で指定する
+#   例: OUTPUT_LAYOUT=dataset OUTPUT_PARTITION_BY=month python main.py
+OUTPUT_LAYOUT_ENV = "OUTPUT_LAYOUT"
+OUTPUT_PARTITION_ENV = "OUTPUT_PARTITION_BY"
+LAYOUTS = ("timestamped", "dataset")
+
+# CSV を読み込むプロセス数（期間フォルダ単位で並列化）。環境変数 MERGE_WORKERS（既定 CPU 数）で指定する
+#   例: MERGE_WORKERS=4 python main.py
+MERGE_WORKERS_ENV = "MERGE_WORKERS"
+
+# パーティション出力のキー: ソースフォルダ単位 / 期間開始の年月単位
+PARTITION_SCHEMES = {
+    "source": ["ソースフォルダ"],
+    "month": ["期間年", "期間月"],
+}
+
+# save_outputs で保存するときの並び順（患者ごとの問い合わせで行グループを読み飛ばせるように）
+OUTPUT_SORT_KEYS = {
+    "karte": ["患者番号", "日付"],
+    "procedure": ["カルテID", "日付"],
+    "diagnosis": ["患者番号", "期間開始"],
+}
+
+# エンコーディング判定で読む先頭バイト数
+SNIFF_BYTES = 64 * 1024
+
 # ==========================================
 # 関数定義
 # ==========================================
 
-def read_csv_with_fallback(csv_path: Path) -> pd.DataFrame:
-    """日本語CSVに対応するため、エンコーディングを順番に試す"""
-    for enc in ("cp932", "utf-8-sig", "utf-8"):
+def detect_encoding(csv_path: Path, sniff_bytes: int = SNIFF_BYTES) -> str:
+    """
+    先頭 sniff_bytes バイトだけを見てエンコーディングを判定する。
+    BOM → utf-8-sig、UTF-8 として正しく読めれば utf-8、それ以外は cp932。
+    ASCII のみの場合は従来どおり cp932 を優先する。
+    """
+    with open(csv_path, "rb") as f:
+        head = f.read(sniff_bytes)
+    if head.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if head.isascii():
+        return "cp932"
+    # 先頭で切った位置がマルチバイト文字の途中でも誤判定しないよう、増分デコーダで判定
+    final = len(head) < sniff_bytes
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=final)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "cp932"
+
+# 判定したエンコーディングで読めなかった場合に試す、もう一方のエンコーディング
+ALTERNATE_ENCODINGS = {"cp932": "utf-8", "utf-8": "cp932", "utf-8-sig": "cp932"}
+
+REPLACEMENT_CHAR = "\ufffd"
+
+def _count_replacement_chars(df: pd.DataFrame) -> int:
+    """列名と値に含まれる置換文字（U+FFFD）の数"""
+    n = sum(str(c).count(REPLACEMENT_CHAR) for c in df.columns)
+    for i in range(df.shape[1]):
+        n += int(df.iloc[:, i].str.count(REPLACEMENT_CHAR).sum())
+    return n
+
+def read_csv_with_fallback(csv_path: Path, encoding: str | None = None) -> pd.DataFrame:
+    """
+    日本語CSVを1回のパースで読み込む。
+    encoding が未指定なら先頭バイトから判定する。判定と異なる不正バイトが後半にあった場合
+    （先頭 SNIFF_BYTES が ASCII だけで cp932 と判定した UTF-8 など）は、もう一方のエンコーディングで
+    読み直し、それでも読めない場合だけ置換文字で読み込む。
+    読み込んだ結果に置換文字（U+FFFD）があれば、その数を警告する。
+    """
+    enc = encoding or detect_encoding(csv_path)
+    candidates = [enc, *([ALTERNATE_ENCODINGS[enc]] if enc in ALTERNATE_ENCODINGS else [])]
+    df = None
+    for candidate in candidates:
         try:
-            return pd.read_csv(csv_path, encoding=enc, dtype=str)
+            df = pd.read_csv(csv_path, encoding=candidate, dtype=str)
         except UnicodeDecodeError:
             continue
-    return pd.read_csv(csv_path, encoding="cp932", errors="ignore", dtype=str)
+        if candidate != enc:
+            print(f"  ⚠ {csv_path.name} は {enc} で読めないバイトがあるため {candidate} で読み込みました。")
+        break
+    if df is None:
+        print(f"  ⚠ {csv_path.name} に {' / '.join(candidates)} のどちらでも読めないバイトがあります。置換して読み込みます。")
+        df = pd.read_csv(csv_path, encoding=enc, encoding_errors="replace", dtype=str)
+
+    replaced = _count_replacement_chars(df)
+    if replaced:
+        print(f"  ⚠ {csv_path.name} に置換文字（{REPLACEMENT_CHAR}）が {replaced:,} 文字あります。文字化けしていないか元の CSV を確認してください。")
+    return df
 
 def parse_period_from_dir(dir_name: str) -> tuple[str, str]:
     """フォルダ名から期間を抽出（business_report_YYYYMMDD_YYYYMMDD のみ）"""
@@ -51,52 +155,353 @@ def iter_period_dirs(base: Path):
         if p.is_dir() and DATE_DIR_RE.match(p.name):
             yield p
 
-def load_all_periods() -> dict[str, pd.DataFrame]:
-    """全期間フォルダのデータを読み込み、種類ごとに結合"""
-    buckets: dict[str, list[pd.DataFrame]] = {v: [] for v in TARGET_FILES.values()}
+def load_period(period_dir: Path, encodings: dict[str, str] | None = None) -> dict[str, pd.DataFrame]:
+    """
+    1期間フォルダ分のCSVを読み込み、期間情報を付与して種類ごとに返す。
+    encodings（ファイル名 → エンコーディング）があれば判定を省略する。
+    """
+    period_start, period_end = parse_period_from_dir(period_dir.name)
+    frames: dict[str, pd.DataFrame] = {}
+    for file_name, key in TARGET_FILES.items():
+        csv_path = period_dir / file_name
+        if not csv_path.exists():
+            print(f"  ⚠ {file_name} が存在しません。スキップします。")
+            continue
+        df = read_csv_with_fallback(csv_path, (encodings or {}).get(file_name))
+        df["期間開始"] = period_start
+        df["期間終了"] = period_end
+        df["ソースフォルダ"] = period_dir.name
+        frames[key] = df
+    return frames
 
-    for period_dir in iter_period_dirs(BASE_DIR):
-        period_start, period_end = parse_period_from_dir(period_dir.name)
+def _combine(buckets: dict[str, list[pd.DataFrame]]) -> dict[str, pd.DataFrame]:
+    """期間ごとのデータを結合し、テーブルごとの型（apps.utils.schema）を適用"""
+    combined = {}
+    for key, frames in buckets.items():
+        combined[key] = apply_schema(pd.concat(frames, ignore_index=True), key) if frames else pd.DataFrame()
+    return combined
+
+def load_periods(
+    period_dirs: list[Path],
+    workers: int = 1,
+    encodings: dict[str, dict[str, str]] | None = None,
+) -> list[dict[str, pd.DataFrame]]:
+    """
+    複数の期間フォルダを読み込む。workers > 1 ならプロセスプールで並列に読む。
+    戻り値は period_dirs と同じ順序（並列時も順序は固定）。
+    encodings は期間フォルダ名 → {ファイル名: エンコーディング}。
+    """
+    encodings = encodings or {}
+    period_encodings = [encodings.get(d.name) for d in period_dirs]
+    for period_dir in period_dirs:
         print(f"処理中: {period_dir.name}")
+        record_read(period_dir / file_name for file_name in TARGET_FILES)
+    if workers > 1 and len(period_dirs) > 1:
+        with process_pool(min(workers, len(period_dirs))) as ex:
+            return list(ex.map(load_period, period_dirs, period_encodings))
+    return [load_period(d, e) for d, e in zip(period_dirs, period_encodings)]
+
+def load_all_periods(incremental: bool = False, workers: int = 1) -> dict[str, pd.DataFrame]:
+    """
+    全期間フォルダのデータを読み込み、種類ごとに結合。
+    incremental=True の場合は新規・変更された期間だけCSVを読んで期間ごとのデータセットを更新し
+    （update_period_datasets）、データセットからまとめて読み込む（read_period_datasets）。
+    workers > 1 の場合、CSVの読み込みを期間フォルダ単位で並列化する。
+    """
+    if incremental:
+        update_period_datasets(workers)
+        return read_period_datasets()
+
+    buckets: dict[str, list[pd.DataFrame]] = {v: [] for v in TARGET_FILES.values()}
+
+    for frames in load_periods(list(iter_period_dirs(BASE_DIR)), workers):
+        for key, df in frames.items():
+            buckets[key].append(df)
+
+    return _combine(buckets)
+
+def _period_parquet(key: str, period_name: str) -> Path:
+    return INCREMENTAL_DIR / key / f"{period_name}.parquet"
+
+def _write_period_parquet(df: pd.DataFrame, pq_out: Path) -> None:
+    """期間ごとの Parquet を一時ファイル経由で保存"""
+    pq_out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = pq_out.with_name(pq_out.name + ".tmp")
+    df.to_parquet(tmp, index=False, engine="pyarrow", compression=PARQUET_COMPRESSION)
+    tmp.replace(pq_out)
+    record_write(pq_out)
+
+def period_cache_key() -> str:
+    """
+    期間ごとの Parquet の形式を表すキー。PERIOD_CACHE_VERSION と、読み込み・型付けの設定
+    （対象ファイル・TABLE_SCHEMAS・日付の書式）から作る。キーが変わったら全期間を読み直す。
+    """
+    spec = repr((PERIOD_CACHE_VERSION, TARGET_FILES, TABLE_SCHEMAS, SCHEMA_DATE_FORMATS))
+    return hashlib.sha256(spec.encode("utf-8")).hexdigest()[:16]
+
+def output_layout(layout: str | None = None, partition_by: str | None = None) -> tuple[str, str]:
+    """
+    save_outputs の (保存形式, パーティションの単位) を返す。
+    未指定なら環境変数 OUTPUT_LAYOUT / OUTPUT_PARTITION_BY（既定 timestamped / source）。
+    """
+    layout = (layout or os.environ.get(OUTPUT_LAYOUT_ENV) or "timestamped").strip().lower()
+    partition_by = (partition_by or os.environ.get(OUTPUT_PARTITION_ENV) or "source").strip().lower()
+    if layout not in LAYOUTS:
+        raise ValueError(f"保存形式は {' / '.join(LAYOUTS)} で指定してください: {layout!r}")
+    if partition_by not in PARTITION_SCHEMES:
+        raise ValueError(f"パーティションの単位は {' / '.join(PARTITION_SCHEMES)} で指定してください: {partition_by!r}")
+    return layout, partition_by
+
+def merge_workers(workers: int | None = None) -> int:
+    """CSV を読み込むプロセス数。未指定なら環境変数 MERGE_WORKERS（既定 CPU 数）"""
+    raw = workers if workers is not None else os.environ.get(MERGE_WORKERS_ENV, "").strip()
+    if raw == "":
+        return os.cpu_count() or 1
+    message = f"プロセス数は1以上の整数で指定してください: {raw!r}"
+    try:
+        n = int(raw)
+    except ValueError:
+        raise ValueError(message) from None
+    if n < 1:
+        raise ValueError(message)
+    return n
+
+def _layout_key(layout: str, partition_by: str) -> str:
+    return f"dataset:{partition_by}" if layout == "dataset" else layout
+
+def update_period_datasets(workers: int = 1) -> list[str]:
+    """
+    マニフェストと突き合わせ、新規・変更のあった期間だけCSVを読んで
+    output/incremental/{種類}/{期間フォルダ名}.parquet（種類ごとのデータセット）を書き換える。
+    戻り値は更新・削除した期間フォルダ名（空なら前回から変更なし）。
+    結合済みの出力が最新かどうかは merged_outputs_current で確かめる（ここでは記録しない）。
+    """
+    manifest = load_manifest(MANIFEST_PATH)
+    cache_key = period_cache_key()
+    if manifest.get("cache_key") != cache_key:
+        if manifest.get("periods"):
+            print("期間ごとの保存データの形式が変わったため、全期間を読み直します。")
+        for key in TARGET_FILES.values():
+            shutil.rmtree(INCREMENTAL_DIR / key, ignore_errors=True)
+        manifest = {"version": manifest["version"], "cache_key": cache_key}
+    entries: dict[str, dict] = manifest.setdefault("periods", {})
+    period_dirs = list(iter_period_dirs(BASE_DIR))
+
+    # --- 変更検出（サイズ・更新時刻・内容ハッシュ） ---
+    fingerprints: dict[str, dict[str, dict | None]] = {}
+    changed_dirs: list[Path] = []
+    for period_dir in period_dirs:
+        name = period_dir.name
+        prev_files = entries.get(name, {}).get("files", {})
+        fps: dict[str, dict | None] = {}
+        changed = name not in entries
         for file_name, key in TARGET_FILES.items():
             csv_path = period_dir / file_name
-            if not csv_path.exists():
-                print(f"  ⚠ {file_name} が存在しません。スキップします。")
-                continue
-            df = read_csv_with_fallback(csv_path)
-            df["期間開始"] = period_start
-            df["期間終了"] = period_end
-            df["ソースフォルダ"] = period_dir.name
-            buckets[key].append(df)
+            old = prev_files.get(file_name)
+            fp = file_fingerprint(csv_path, old) if csv_path.exists() else None
+            if fp is not None and "encoding" not in fp:
+                # 内容が変わったファイルだけ先頭バイトからエンコーディングを判定
+                fp["encoding"] = detect_encoding(csv_path)
+            fps[file_name] = fp
+            if not same_content(old, fp):
+                changed = True
+            elif fp is not None and not _period_parquet(key, name).exists():
+                changed = True
+        fingerprints[name] = fps
+        if changed:
+            changed_dirs.append(period_dir)
+        else:
+            print(f"変更なし（保存済みを使用）: {name}")
+            if fps != prev_files:
+                # 内容は同じだが更新時刻だけ変わった場合
+                entries[name] = {"files": fps}
+
+    # --- 変更のあった期間だけCSVを読み、その期間のファイルだけを書き換える ---
+    encodings = {
+        name: {file_name: fp["encoding"] for file_name, fp in fps.items() if fp is not None}
+        for name, fps in fingerprints.items()
+    }
+    updated = []
+    for period_dir, frames in zip(changed_dirs, load_periods(changed_dirs, workers, encodings)):
+        name = period_dir.name
+        for key in TARGET_FILES.values():
+            pq_path = _period_parquet(key, name)
+            if key in frames:
+                _write_period_parquet(frames[key], pq_path)
+            else:
+                pq_path.unlink(missing_ok=True)
+        entries[name] = {"files": fingerprints[name]}
+        updated.append(name)
+
+    # --- 消えた期間フォルダの後始末 ---
+    for name in sorted(set(entries) - set(fingerprints)):
+        print(f"期間フォルダが見つからないため除外: {name}")
+        for key in TARGET_FILES.values():
+            _period_parquet(key, name).unlink(missing_ok=True)
+        del entries[name]
+        updated.append(name)
+
+    save_manifest(manifest, MANIFEST_PATH)
+    return updated
+
+def _files_state(entry: dict) -> dict:
+    """マニフェストの期間の項目 → CSVファイル名ごとの (サイズ, ハッシュ)"""
+    return {
+        file_name: fp and (fp.get("size"), fp.get("sha256"))
+        for file_name, fp in entry.get("files", {}).items()
+    }
+
+def _state_key(*parts) -> str:
+    spec = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(spec.encode("utf-8")).hexdigest()[:16]
+
+def _period_state(manifest: dict) -> str:
+    """マニフェストが指す期間データの内容（形式のキーと各CSVのサイズ・ハッシュ）を表すキー"""
+    files = {name: _files_state(entry) for name, entry in manifest.get("periods", {}).items()}
+    return _state_key(manifest.get("cache_key"), files)
+
+def period_keys() -> dict[str, str]:
+    """
+    期間フォルダ名 → その期間のCSVの内容（形式のキーと各CSVのサイズ・ハッシュ）を表すキー。
+    update_period_datasets が記録したマニフェストから作るため、CSV もデータも読まない。
+    """
+    manifest = load_manifest(MANIFEST_PATH)
+    return {
+        name: _state_key(manifest.get("cache_key"), _files_state(entry))
+        for name, entry in manifest.get("periods", {}).items()
+    }
+
+def merged_outputs_current(layout: str = "timestamped", partition_by: str = "source") -> bool:
+    """
+    結合済みの出力（save_outputs）が、今の期間データから同じ保存形式で書かれたもので、
+    成果物カタログから karte / procedure / diagnosis のすべてを引けるか。
+    """
+    # latest_artifact(key) は最新がデータセットでもフォルダを返すため、形式はカタログの項目で確かめる
+    fmt = "dataset" if layout == "dataset" else "parquet"
+    for key in TARGET_FILES.values():
+        entry = artifact_info(key)
+        if entry is None or fmt not in entry["files"] or latest_artifact(key, fmt) is None:
+            return False
+    manifest = load_manifest(MANIFEST_PATH)
+    return manifest.get("merged_from") == f"{_period_state(manifest)}|{_layout_key(layout, partition_by)}"
+
+def mark_merged_outputs(layout: str = "timestamped", partition_by: str = "source") -> None:
+    """
+    save_outputs が最後まで成功した後に呼び、今の期間データから出力したことを記録する。
+    途中で失敗・中断した場合は記録されないため、次回も save_outputs をやり直す。
+    """
+    manifest = load_manifest(MANIFEST_PATH)
+    manifest["merged_from"] = f"{_period_state(manifest)}|{_layout_key(layout, partition_by)}"
+    save_manifest(manifest, MANIFEST_PATH)
 
+def read_period_datasets() -> dict[str, pd.DataFrame]:
+    """
+    期間ごとのデータセットを種類ごとに1回で読み込み、型（apps.utils.schema）を適用する。
+    期間によって列が違う場合は列をそろえる（ない列は欠損）。並びは期間フォルダ名の順。
+    """
     combined = {}
-    for key, frames in buckets.items():
-        combined[key] = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    for key in TARGET_FILES.values():
+        files = sorted((INCREMENTAL_DIR / key).glob("*.parquet"))
+        if not files:
+            combined[key] = pd.DataFrame()
+            continue
+        record_read(files)
+        schema = pa.unify_schemas([pq.read_schema(f).remove_metadata() for f in files])
+        table = ds.dataset(files, schema=schema, format="parquet").to_table()
+        combined[key] = apply_schema(table.to_pandas(), key)
     return combined
 
-def save_outputs(dfs: dict[str, pd.DataFrame]):
-    """CSV (UTF-8-BOM) と Parquet の保存（例外時も強制保存）"""
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+def _sorted_table(df: pd.DataFrame, key: str) -> tuple[pa.Table, list[str]]:
+    """OUTPUT_SORT_KEYS の順に並べた Table と、並べたキー"""
+    sort_keys = [c for c in OUTPUT_SORT_KEYS.get(key, []) if c in df.columns]
+    table = to_arrow(df)
+    if sort_keys:
+        table = table.sort_by([(c, "ascending") for c in sort_keys])
+    return table, sort_keys
+
+def save_dataset(dfs: dict[str, pd.DataFrame], partition_by: str = "source"):
+    """
+    種類ごとに Hive 形式のパーティション付き Parquet データセットとして保存。
+    出力先は output/dataset/{key}/ で固定（実行のたびにファイルが増えない）。
+    partition_by="source" ならソースフォルダ単位、"month" なら期間開始の年/月単位。
+    各パーティションの中は OUTPUT_SORT_KEYS の順。一時フォルダに全件を書いてから入れ替えるため、
+    途中で失敗しても前回のデータセットはそのまま残る。書き終えたら成果物カタログに登録する。
+    """
+    if partition_by not in PARTITION_SCHEMES:
+        raise ValueError(f"partition_by が不正です: {partition_by}")
+    part_cols = PARTITION_SCHEMES[partition_by]
+
     for key, df in dfs.items():
-        # --- CSV 出力 ---
-        csv_out = OUTPUT_DIR / f"{key}_{ts}.csv"
-        df.to_csv(csv_out, index=False, encoding="utf-8-sig")
-        print(f"✅ 出力完了: {csv_out.name}")
+        if df.empty:
+            print(f"⚠ {key} は0件のためデータセット出力をスキップします。")
+            continue
+        if partition_by == "month":
+            start = pd.to_datetime(df["期間開始"])
+            df = df.assign(期間年=start.dt.strftime("%Y"), 期間月=start.dt.strftime("%m"))
+
+        table, sort_keys = _sorted_table(df, key)
+        if sort_keys:
+            metadata = dict(table.schema.metadata or {})
+            metadata[SORTED_BY_KEY] = json.dumps(sort_keys, ensure_ascii=False).encode("utf-8")
+            table = table.replace_schema_metadata(metadata)
 
-        # --- Parquet 出力 ---
-        pq_out = OUTPUT_DIR / f"{key}_{ts}.parquet"
+        out_dir = DATASET_DIR / key
+        staged = DATASET_DIR / f".{key}.tmp"
+        shutil.rmtree(staged, ignore_errors=True)
+        # use_threads=False: 並べた順のままパーティションに書く
+        ds.write_dataset(
+            table,
+            staged,
+            format="parquet",
+            partitioning=part_cols,
+            partitioning_flavor="hive",
+            basename_template="part-{i}.parquet",
+            use_threads=False,
+            max_rows_per_group=PARQUET_ROW_GROUP_SIZE,
+            file_options=ds.ParquetFileFormat().make_write_options(compression=PARQUET_COMPRESSION),
+        )
+
+        # 書き終えたものと入れ替える（削除された期間や、以前の分割方式のフォルダも残らない）
+        old = DATASET_DIR / f".{key}.old"
+        shutil.rmtree(old, ignore_errors=True)
+        if out_dir.exists():
+            os.replace(out_dir, old)
+        os.replace(staged, out_dir)
+        shutil.rmtree(old, ignore_errors=True)
+
+        record_write(sorted(out_dir.rglob("*.parquet")), table.num_rows)
+        register_dataset(key, out_dir, table.schema, table.num_rows)
+        print(f"✅ データセット出力完了: {out_dir.relative_to(OUTPUT_DIR)} ({partition_by})")
+
+def save_outputs(dfs: dict[str, pd.DataFrame], layout: str | None = None, partition_by: str | None = None) -> str:
+    """
+    CSV (UTF-8-BOM) と Parquet の保存（例外時も強制保存）。出力形式は OUTPUT_FORMATS の設定に従う。
+    layout="dataset" の場合は固定パスのパーティション付きデータセットとして保存する
+    （layout / partition_by 未指定なら OUTPUT_LAYOUT / OUTPUT_PARTITION_BY の設定に従う）。
+    戻り値は今回の出力の時刻 (YYYYMMDD_HHMMSS)。
+    """
+    layout, partition_by = output_layout(layout, partition_by)
+    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    if layout == "dataset":
+        save_dataset(dfs, partition_by=partition_by)
+        return ts
+
+    for key, df in dfs.items():
+        stem = f"{key}_{ts}"
         try:
-            # 通常の書き出し
-            df.to_parquet(pq_out, index=False, engine="pyarrow", compression="snappy")
-            print(f"✅ 出力完了: {pq_out.name}")
+            # 通常の書き出し（OUTPUT_SORT_KEYS の順に並べ、並び順を Parquet に記録）
+            table, sort_keys = _sorted_table(df, key)
+            for path in write_outputs(table, stem, OUTPUT_DIR, sort_keys=sort_keys or None):
+                print(f"✅ 出力完了: {path.name}")
         except Exception as e:
-            print(f"⚠ Parquet 出力失敗（{key}）: {e}")
+            print(f"⚠ 出力失敗（{key}）: {e}")
             # 型混在・辞書・リスト対策
             df2 = df.copy()
             for c in df2.columns:
                 df2[c] = df2[c].apply(lambda x: str(x) if isinstance(x, (list, dict)) else x)
-            df2.to_parquet(pq_out, index=False, engine="pyarrow", compression="snappy")
-            print(f"✅ （整形後）Parquet 出力完了: {pq_out.name}")
+            for path in write_outputs(df2, stem, OUTPUT_DIR):
+                print(f"✅ （整形後）出力完了: {path.name}")
+    return ts
 
 
 # ==========================================
@@ -104,8 +509,22 @@ def save_outputs(dfs: dict[str, pd.DataFrame]):
 # ==========================================
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="期間フォルダ内のCSVの統合")
+    parser.add_argument("--layout", choices=LAYOUTS, help=f"保存形式（既定: 環境変数 {OUTPUT_LAYOUT_ENV} または timestamped）")
+    parser.add_argument("--partition-by", choices=list(PARTITION_SCHEMES),
+                        help=f"layout=dataset のパーティションの単位（既定: 環境変数 {OUTPUT_PARTITION_ENV} または source）")
+    parser.add_argument("--workers", type=int,
+                        help=f"CSV を読み込むプロセス数（既定: 環境変数 {MERGE_WORKERS_ENV} または CPU 数）")
+    parser.add_argument("--incremental", action="store_true",
+                        help="新規・変更された期間だけCSVを読み、期間ごとのデータセットから結合する")
+    args = parser.parse_args()
+
     print("=== 期間フォルダ内のCSVを統合します ===")
-    dfs = load_all_periods()
-    save_outputs(dfs)
+    layout, partition_by = output_layout(args.layout, args.partition_by)
+    dfs = load_all_periods(incremental=args.incremental, workers=merge_workers(args.workers))
+    save_outputs(dfs, layout=layout, partition_by=partition_by)
+    if args.incremental:
+        # main.py が期間に変更がなければこの出力を再利用できるように記録する
+        mark_merged_outputs(layout, partition_by)
     print("\n=== すべて完了しました ===")
     print(f"出力フォルダ: {OUTPUT_DIR.resolve()}")
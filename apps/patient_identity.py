@@ -0,0 +1,325 @@
+# apps/patient_identity.py
+import os
+import re
+import unicodedata
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from apps.utils.common import OUTPUT_DIR
+from apps.utils.output import PARQUET_COMPRESSION
+from apps.utils.schema import STRING_DTYPE, apply_schema
+
+# ==========================================
+# 患者の名寄せ（同一人物と思われる患者番号のクラスタ）
+#   1. 氏名を正規化（NFKC・ひらがな→カタカナ・空白/中点の除去）
+#      レセプト（RE）のカタカナ氏名は、その患者番号の氏名の1つ（読み）として加える
+#   2. ブロッキング
+#        ・正規化した氏名が同じ患者番号         → 氏名一致
+#        ・生年月日 + 読みの先頭2文字が同じ患者番号 → 読みが同じか1文字違いなら 生年月日+氏名近似
+#          （カナだけの氏名・読みが対象。漢字の氏名は1文字違いでも別人（伊藤一郎/伊藤二郎）のため完全一致のみ）
+#      1つの患者番号に複数の氏名（漢字・カナなど）があれば、どの氏名のブロックにも入る
+#      → 漢字で登録された患者番号とカナで登録された患者番号は、レセプトの読みを介してつながる
+#   3. つながった患者番号を union-find でクラスタにまとめる
+#   取り込んだ氏名とつながり（links。どのブロックから作ったかも記録）は output/patient_identity/ に保存し、
+#   次回は増えた・消えた・変わった氏名が入るブロックだけを比較し直して、そのブロックのつながりを置き換える
+#   （つながりはブロックの中の氏名だけで決まるため、結果は全件を比較し直した場合と同じ）
+# ==========================================
+
+IDENTITY_DIR = OUTPUT_DIR / "patient_identity"
+RECORDS_PATH = IDENTITY_DIR / "records.parquet"
+LINKS_PATH = IDENTITY_DIR / "links.parquet"
+CLUSTERS_PATH = IDENTITY_DIR / "clusters.parquet"
+
+REASON_NAME = "氏名一致"
+REASON_FUZZY = "生年月日+氏名近似"
+
+# 近似一致のブロック（生年月日 + 読みの先頭）の文字数と、比較する最大人数
+PREFIX_LENGTH = 2
+MAX_BLOCK_SIZE = 200
+
+# 1文字違いを近似一致とみなす読みの最小文字数
+MIN_FUZZY_LENGTH = 4
+
+RECORD_COLUMNS = ["患者番号", "患者氏名", "生年月日", "name_key", "loose_key"]
+# ブロック: つながりを作ったブロック（氏名一致は name_key、生年月日+氏名近似は生年月日+読みの先頭）
+LINK_COLUMNS = ["患者番号_a", "患者番号_b", "理由", "ブロック"]
+
+# ひらがな → カタカナ、長音に似た記号 → ー
+_FOLD = {c: c + 0x60 for c in range(0x3041, 0x3097)}
+_FOLD.update({0x309D: 0x30FD, 0x309E: 0x30FE})
+_FOLD.update({ord(c): "ー" for c in "-‐‑‒–—―−～〜"})
+
+# 読みの比較用: 小書き → 通常、ヂ/ヅ → ジ/ズ、ヲ → オ
+_LOOSE = str.maketrans("ァィゥェォッャュョヮヵヶヂヅヲ", "アイウエオツヤユヨワカケジズオ")
+
+# 近似一致の対象にするカナだけの氏名（normalize_name の後。長音・繰り返し記号を含む）
+_KANA_ONLY = r"[ァ-ヺー-ヿ]+"
+
+# 除去する文字（空白・中点）。NFKC 後なので全角スペースや半角中点もここに含まれる
+_SEPARATORS = re.compile(r"[\s・]+")
+
+# 濁点・半濁点（NFD で分解したもの）
+_VOICED_MARKS = re.compile("[゙゚]")
+
+
+def normalize_name(name: str) -> str:
+    """氏名の表記ゆれ（全角/半角・ひらがな/カタカナ・空白）をそろえたキー"""
+    name = unicodedata.normalize("NFKC", name).translate(_FOLD)
+    return _SEPARATORS.sub("", name).casefold()
+
+
+def loose_name(key: str) -> str:
+    """normalize_name の結果から、さらに小書き・濁点・長音の違いを無視した読みのキー"""
+    key = unicodedata.normalize("NFD", key.translate(_LOOSE))
+    return unicodedata.normalize("NFC", _VOICED_MARKS.sub("", key)).replace("ー", "")
+
+
+def _normalize_ids(ids: pd.Series) -> pd.Series:
+    """患者番号を文字列にそろえる（数字だけなら先頭ゼロを除く。レセプトのカルテ番号と突き合わせるため）"""
+    ids = ids.astype(STRING_DTYPE).str.strip()
+    digits = ids.str.fullmatch(r"\d+", na=False)
+    stripped = ids.str.lstrip("0").mask(lambda s: s == "", "0")
+    return ids.mask(digits, stripped)
+
+
+def _id_order(ids: pd.Series) -> pd.Series:
+    """患者番号の並び順に使うキー（数字だけの番号は数値順、それ以外はその後ろ）"""
+    return ids.str.zfill(20).where(ids.str.fullmatch(r"\d+", na=False), "~" + ids)
+
+
+def _empty(columns: list[str]) -> pd.DataFrame:
+    return pd.DataFrame({c: pd.Series(dtype=STRING_DTYPE) for c in columns})
+
+
+def collect_names(frames: list[pd.DataFrame | None], receipts: pd.DataFrame | None = None) -> pd.DataFrame:
+    """
+    karte / diagnosis（患者番号・患者氏名）と、レセプトの RE（patient_id・氏名・カタカナ氏名・生年月日）から
+    患者番号 × 氏名の一意な表を作る。カタカナ氏名は氏名とは別の行として加える。
+    生年月日は患者番号ごとに1つ（最初に見つかったもの）。
+    """
+    parts = [
+        df[["患者番号", "患者氏名"]].drop_duplicates()
+        for df in frames
+        if df is not None and {"患者番号", "患者氏名"}.issubset(df.columns)
+    ]
+    if receipts is not None and not receipts.empty:
+        parts.append(receipts.rename(columns={"patient_id": "患者番号", "氏名": "患者氏名"})[["患者番号", "患者氏名", "生年月日"]])
+        if "カタカナ氏名" in receipts.columns:
+            readings = receipts.rename(columns={"patient_id": "患者番号", "カタカナ氏名": "患者氏名"})
+            parts.append(readings[["患者番号", "患者氏名", "生年月日"]])
+    if not parts:
+        return _empty(RECORD_COLUMNS)
+
+    names = pd.concat([p.astype(STRING_DTYPE) for p in parts], ignore_index=True)
+    if "生年月日" not in names.columns:
+        names["生年月日"] = pd.Series(pd.NA, index=names.index, dtype=STRING_DTYPE)
+    names["患者番号"] = _normalize_ids(names["患者番号"])
+    names["患者氏名"] = names["患者氏名"].str.strip()
+    names["生年月日"] = names["生年月日"].str.strip().replace("", pd.NA)
+    names = names.dropna(subset=["患者番号", "患者氏名"])
+    names = names[(names["患者番号"] != "") & (names["患者氏名"] != "")]
+
+    births = names.dropna(subset=["生年月日"]).drop_duplicates("患者番号").set_index("患者番号")["生年月日"]
+    records = names[["患者番号", "患者氏名"]].drop_duplicates().reset_index(drop=True)
+    records["生年月日"] = records["患者番号"].map(births).astype(STRING_DTYPE)
+
+    # 正規化は氏名の種類ごとに1回だけ
+    unique = records["患者氏名"].unique()
+    keys = {name: normalize_name(name) for name in unique}
+    loose = {key: loose_name(key) for key in set(keys.values())}
+    records["name_key"] = records["患者氏名"].map(keys).astype(STRING_DTYPE)
+    records["loose_key"] = records["name_key"].map(loose).astype(STRING_DTYPE)
+    return records[records["name_key"] != ""].reset_index(drop=True)[RECORD_COLUMNS]
+
+
+def _fuzzy_block(records: pd.DataFrame) -> pd.Series:
+    """近似一致のブロックキー（生年月日 + 読みの先頭）。生年月日がない・カナだけの氏名でなければ NA"""
+    block = (records["生年月日"] + "|" + records["loose_key"].str.slice(0, PREFIX_LENGTH)).astype(STRING_DTYPE)
+    return block.where(records["name_key"].str.fullmatch(_KANA_ONLY, na=False))
+
+
+def _chain(groups: pd.DataFrame, key: str, reason: str, block: str) -> pd.DataFrame:
+    """同じ key の患者番号を、各グループの先頭の患者番号とつなぐ（block はグループを含むブロックの列）"""
+    members = groups[[key, block, "患者番号"]].drop_duplicates([key, "患者番号"])
+    members = members.assign(_order=_id_order(members["患者番号"])).sort_values([key, "_order"])
+    anchors = members.groupby(key, sort=False)["患者番号"].transform("first")
+    mask = anchors != members["患者番号"]
+    return pd.DataFrame({
+        "患者番号_a": anchors[mask].to_numpy(),
+        "患者番号_b": members.loc[mask, "患者番号"].to_numpy(),
+        "理由": reason,
+        "ブロック": members.loc[mask, block].to_numpy(),
+    })
+
+
+def name_links(records: pd.DataFrame) -> pd.DataFrame:
+    """
+    正規化した氏名が同じ患者番号をつなぐ。
+    同じ氏名で生年月日が2種類以上ある場合は、生年月日ごとに分け、生年月日のない患者番号はつながない。
+    """
+    n_births = records.groupby("name_key")["生年月日"].nunique()
+    conflicted = records["name_key"].map(n_births) > 1
+    groups = records.assign(_group=records["name_key"].where(~conflicted, records["name_key"] + "|" + records["生年月日"]))
+    return _chain(groups.dropna(subset=["_group"]), "_group", REASON_NAME, "name_key")
+
+
+def _within_one_edit(a: str, b: str) -> bool:
+    """編集距離が1以下か（置換・挿入・削除のいずれか1回）"""
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return a[i + 1:] == b[i + 1:]
+    return a[i:] == b[i + 1:]
+
+
+def fuzzy_links(records: pd.DataFrame) -> pd.DataFrame:
+    """
+    生年月日 + 読みの先頭2文字のブロック内で、読み（loose_key）が同じか1文字違いの患者番号をつなぐ。
+    カナだけの氏名（読み）が対象で、漢字の氏名は name_links の完全一致だけでつなぐ。
+    比較はブロック内のペアだけで、MAX_BLOCK_SIZE 人を超えるブロックは比較しない。
+    """
+    blocked = records.assign(_block=_fuzzy_block(records)).dropna(subset=["_block"])
+    blocked = blocked[["_block", "患者番号", "loose_key"]].drop_duplicates()
+    sizes = blocked.groupby("_block")["患者番号"].transform("nunique")
+    blocked = blocked[(sizes > 1) & (sizes <= MAX_BLOCK_SIZE)]
+    if blocked.empty:
+        return pd.DataFrame(columns=LINK_COLUMNS)
+
+    pairs = blocked.merge(blocked, on="_block", suffixes=("_a", "_b"))
+    pairs = pairs[pairs["患者番号_a"] < pairs["患者番号_b"]]
+    same = (pairs["loose_key_a"] == pairs["loose_key_b"]).fillna(False).to_numpy(dtype=bool)
+    near = (
+        ~same
+        & ((pairs["loose_key_a"].str.len() - pairs["loose_key_b"].str.len()).abs() <= 1)
+        & (pairs[["loose_key_a", "loose_key_b"]].apply(lambda s: s.str.len()).min(axis=1) >= MIN_FUZZY_LENGTH)
+    ).fillna(False).to_numpy(dtype=bool)
+    near[near] = [_within_one_edit(a, b) for a, b in zip(pairs.loc[near, "loose_key_a"], pairs.loc[near, "loose_key_b"])]
+    linked = pairs[same | near]
+    return pd.DataFrame({
+        "患者番号_a": linked["患者番号_a"].to_numpy(),
+        "患者番号_b": linked["患者番号_b"].to_numpy(),
+        "理由": REASON_FUZZY,
+        "ブロック": linked["_block"].to_numpy(),
+    })
+
+
+def _clusters(records: pd.DataFrame, links: pd.DataFrame) -> pd.DataFrame:
+    """つながりを union-find でまとめ、2人以上のクラスタに属する患者番号の表を返す"""
+    parent: dict[str, str] = {}
+
+    def find(x: str) -> str:
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for a, b in zip(links["患者番号_a"], links["患者番号_b"]):
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[rb] = ra
+
+    ids = pd.Series(list(parent), dtype=STRING_DTYPE)
+    members = pd.DataFrame({"患者番号": ids, "_root": ids.map(find)})
+    members["_order"] = _id_order(members["患者番号"])
+    members = members.sort_values("_order")
+    members["クラスタID"] = members.groupby("_root")["患者番号"].transform("first")
+    members["クラスタ人数"] = members.groupby("_root")["患者番号"].transform("size")
+
+    member_records = records[records["患者番号"].isin(parent)]
+    names = member_records.groupby("患者番号")["患者氏名"].agg(lambda s: "／".join(sorted(s.unique())))
+    births = member_records.drop_duplicates("患者番号").set_index("患者番号")["生年月日"]
+    link_roots = links["患者番号_a"].map(find)
+    reasons = links.groupby(link_roots)["理由"].agg(lambda s: "、".join(sorted(s.unique())))
+
+    out = pd.DataFrame({
+        "クラスタID": members["クラスタID"],
+        "患者番号": members["患者番号"],
+        "患者氏名": members["患者番号"].map(names),
+        "生年月日": members["患者番号"].map(births),
+        "クラスタ人数": members["クラスタ人数"],
+        "一致理由": members["_root"].map(reasons),
+    })
+    out = out[out["クラスタ人数"] > 1]
+    order = _id_order(out["クラスタID"]) + "\t" + _id_order(out["患者番号"])
+    return out.iloc[order.argsort(kind="stable")].reset_index(drop=True)
+
+
+def _read_state(path, columns: list[str]) -> pd.DataFrame:
+    if not path.exists():
+        return _empty(columns)
+    return pq.read_table(path).to_pandas().astype(STRING_DTYPE)
+
+
+def _write_state(df: pd.DataFrame, path) -> None:
+    """状態ファイルを一時ファイル経由で保存"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp, compression=PARQUET_COMPRESSION)
+    os.replace(tmp, path)
+
+
+def resolve_patient_identity(
+    frames: list[pd.DataFrame | None],
+    receipts: pd.DataFrame | None = None,
+    force: bool = False,
+) -> tuple[pd.DataFrame, dict]:
+    """
+    名寄せを行い、(クラスタ表, 件数の概要) を返す。
+    前回の状態（records / links）があれば、前回から増えた・消えた・変わった氏名が入るブロックだけを比較し直し、
+    そのブロックの前回のつながりと置き換える。つながりが切れた場合はクラスタも分かれる。
+    force=True の場合（と、ブロックを記録していない古い状態の場合）は全件を比較し直す。
+    """
+    records = collect_names(frames, receipts)
+    prev_records, prev_links = _read_state(RECORDS_PATH, RECORD_COLUMNS), _read_state(LINKS_PATH, LINK_COLUMNS)
+    if force or not set(LINK_COLUMNS).issubset(prev_links.columns):
+        prev_records, prev_links = _empty(RECORD_COLUMNS), _empty(LINK_COLUMNS)
+
+    # 前回から増えた氏名と、消えた氏名（生年月日が変わった氏名は両方に入る）
+    key = ["患者番号", "患者氏名", "生年月日"]
+    prev_index = pd.MultiIndex.from_frame(prev_records[key].fillna(""))
+    current_index = pd.MultiIndex.from_frame(records[key].fillna(""))
+    changed = pd.concat(
+        [records[~current_index.isin(prev_index)], prev_records[~prev_index.isin(current_index)]],
+        ignore_index=True,
+    )
+
+    compared = 0
+    if changed.empty:
+        links = prev_links
+    else:
+        # 変わった氏名が入る（入っていた）ブロックは、今の氏名で全員を比較し直す
+        names = changed["name_key"].dropna().unique()
+        blocks = _fuzzy_block(changed).dropna().unique()
+        in_names = records["name_key"].isin(names)
+        in_blocks = _fuzzy_block(records).isin(blocks).fillna(False)
+        compared = int((in_names | in_blocks).sum())
+        stale = (
+            ((prev_links["理由"] == REASON_NAME) & prev_links["ブロック"].isin(names))
+            | ((prev_links["理由"] == REASON_FUZZY) & prev_links["ブロック"].isin(blocks))
+        )
+        links = (
+            pd.concat([prev_links[~stale], name_links(records[in_names]), fuzzy_links(records[in_blocks])],
+                      ignore_index=True)
+            .astype(STRING_DTYPE)
+            .drop_duplicates()
+            .reset_index(drop=True)
+        )
+        _write_state(records, RECORDS_PATH)
+        _write_state(links, LINKS_PATH)
+
+    clusters = apply_schema(_clusters(records, links), "patient_clusters")
+    _write_state(clusters, CLUSTERS_PATH)
+    summary = {
+        "records": len(records),
+        "changed_records": len(changed),
+        "compared_records": compared,
+        "links": len(links),
+        "clusters": clusters["クラスタID"].nunique(),
+    }
+    return clusters, summary
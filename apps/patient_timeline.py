@@ -0,0 +1,222 @@
+# apps/patient_timeline.py
+import argparse
+from dataclasses import dataclass
+from pathlib import Path
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from apps.utils.catalog import latest_artifact
+from apps.utils.common import open_dataset, period_partition_filter
+from apps.utils.reader import to_frame
+from apps.utils.schema import STRING_DTYPE
+
+# ==========================================
+# 患者ごとのタイムライン（1人分の受診・処置・傷病名・レセプトのフリーコメントを日付順に）
+#   各テーブルの最新 Parquet を pyarrow.dataset で開き、患者番号・カルテID・日付の条件を
+#   読み込み時に押し下げる。行グループの統計（最小・最大）で対象外の行グループは読まない。
+#   save_outputs / join_procedure_with_patients / フリーコメントの抽出は患者番号順に保存するため、
+#   1人分の問い合わせはほぼその患者の行グループだけを読む（フリーコメントは normalized_patient_id の文字列の順）。
+#   save_outputs(layout="dataset") の出力は、さらに日付の範囲と重ならないパーティション（期間）を開かない。
+#
+#     python -m apps.patient_timeline 123 --start 2024-01-01 --end 2024-03-31 --explain
+# ==========================================
+
+
+@dataclass(frozen=True)
+class TimelineSource:
+    """
+    タイムラインに載せるテーブル。
+    date_end がある場合は [date, date_end] の期間が問い合わせ範囲と重なる行を対象にする。
+    """
+    label: str
+    artifact: str
+    patient: str
+    date: str
+    date_end: str | None = None
+    karte: str | None = None
+
+
+SOURCES = (
+    TimelineSource("受診", "karte", "患者番号", "日付", karte="カルテID"),
+    TimelineSource("処置", "procedure_with_patient", "患者番号", "日付", karte="カルテID"),
+    TimelineSource("傷病名", "diagnosis", "患者番号", "期間開始", date_end="期間終了"),
+    TimelineSource("フリーコメント", "receipt_free_comments_all", "normalized_patient_id", "comment_date_ymd"),
+)
+
+TIMELINE_COLUMNS = ["日付", "種別", "カルテID", "内容"]
+
+# 内容に含めない列（キー・期間・出力元の情報）
+_HIDDEN_COLUMNS = {
+    "患者氏名", "ソースフォルダ", "期間開始", "期間終了", "期間年", "期間月",
+    "receipt_month", "insurer_type", "patient_id", "comment_date", "comment_date_ymd",
+}
+
+
+def open_source(source: TimelineSource) -> tuple[ds.Dataset, str, bool] | None:
+    """
+    最新の Parquet（最新がデータセットならそのフォルダ）を開き、
+    (データセット, 表示名, パーティション付きか) を返す。
+    """
+    path = latest_artifact(source.artifact)
+    if path is None:
+        return None
+    if path.is_dir():
+        return open_dataset(path), f"dataset/{path.name}", True
+    return ds.dataset(path, format="parquet"), path.name, False
+
+
+def _scalar(value, field_type: pa.DataType) -> pa.Scalar:
+    """列の型に合わせた比較用の値（患者番号 123 と "123" のどちらでも引けるように）"""
+    if pa.types.is_dictionary(field_type):
+        field_type = field_type.value_type
+    return pa.scalar(value).cast(field_type)
+
+
+def _date_bounds(start, end) -> tuple[pd.Timestamp | None, pd.Timestamp | None]:
+    """[start, end] の日付範囲（end はその日を含む）を [下限, 上限) にする"""
+    lower = pd.Timestamp(start).normalize() if start is not None else None
+    upper = pd.Timestamp(end).normalize() + pd.Timedelta(days=1) if end is not None else None
+    return lower, upper
+
+
+def build_filter(
+    source: TimelineSource,
+    schema: pa.Schema,
+    patient_id,
+    start=None,
+    end=None,
+    karte_id=None,
+) -> ds.Expression | None:
+    """
+    source に対する絞り込み条件。必要な列が無い場合は None（そのテーブルは対象外）。
+    日付の条件は日付列が timestamp 型の場合だけ押し下げる（それ以外は読み込み後に絞る）。
+    """
+    if source.patient not in schema.names:
+        return None
+    try:
+        expr = ds.field(source.patient) == _scalar(patient_id, schema.field(source.patient).type)
+        if karte_id is not None:
+            if source.karte is None or source.karte not in schema.names:
+                return None
+            expr &= ds.field(source.karte) == _scalar(karte_id, schema.field(source.karte).type)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        # 列の型に変換できない値（数値の患者番号列に "A001" など）は該当なし
+        return None
+
+    lower, upper = _date_bounds(start, end)
+    end_col = source.date_end if source.date_end in schema.names else source.date
+    for col, bound, op in ((end_col, lower, "ge"), (source.date, upper, "lt")):
+        if bound is None or col not in schema.names or not pa.types.is_timestamp(schema.field(col).type):
+            continue
+        value = _scalar(bound.to_datetime64(), schema.field(col).type)
+        expr &= ds.field(col) >= value if op == "ge" else ds.field(col) < value
+    return expr
+
+
+def count_row_groups(dataset: ds.Dataset, expr: ds.Expression) -> tuple[int, int]:
+    """(条件に合う可能性のある行グループ数, 全行グループ数)。フッターの統計だけで数える"""
+    total = sum(frag.num_row_groups for frag in dataset.get_fragments())
+    selected = sum(
+        len(frag.split_by_row_group(expr, schema=dataset.schema)) for frag in dataset.get_fragments(filter=expr)
+    )
+    return selected, total
+
+
+def _content(df: pd.DataFrame, columns: list[str]) -> pd.Series:
+    """内容列（「列: 値」を読点でつないだもの。欠損の列は省く）"""
+    parts = [(col + ": " + df[col].astype(STRING_DTYPE)).tolist() for col in columns]
+    return pd.Series(
+        ["、".join(v for v in values if pd.notna(v)) for values in zip(*parts)] if parts else [""] * len(df),
+        index=df.index,
+        dtype=STRING_DTYPE,
+    )
+
+
+def _read_source(source: TimelineSource, patient_id, start, end, karte_id, explain: bool) -> pd.DataFrame | None:
+    opened = open_source(source)
+    if opened is None:
+        return None
+    dataset, name, partitioned = opened
+    expr = build_filter(source, dataset.schema, patient_id, start, end, karte_id)
+    if expr is None:
+        return None
+    if partitioned:
+        partition_expr = period_partition_filter(dataset, *_date_bounds(start, end))
+        if partition_expr is not None:
+            expr &= partition_expr
+
+    keys = [source.date, source.date_end, source.karte]
+    detail = [c for c in dataset.schema.names if c not in _HIDDEN_COLUMNS and c != source.patient and c not in keys]
+    columns = [c for c in (*keys, *detail) if c is not None and c in dataset.schema.names]
+    df = to_frame(dataset.to_table(columns=columns, filter=expr), "numpy_nullable")
+    if explain:
+        selected, total = count_row_groups(dataset, expr)
+        print(f"  📂 {source.label:<8} {name}: 行グループ {selected}/{total} → {len(df):,} 行")
+
+    # 押し下げられなかった日付の条件（文字列の日付列など）
+    dates = pd.to_datetime(df[source.date], errors="coerce")
+    ends = pd.to_datetime(df[source.date_end], errors="coerce") if source.date_end in df.columns else dates
+    lower, upper = _date_bounds(start, end)
+    if lower is not None:
+        df, dates = df[ends >= lower], dates[ends >= lower]
+    if upper is not None:
+        df, dates = df[dates < upper], dates[dates < upper]
+
+    karte = df[source.karte].astype(STRING_DTYPE) if source.karte in df.columns else pd.NA
+    return pd.DataFrame({
+        "日付": dates,
+        "種別": source.label,
+        "カルテID": pd.Series(karte, index=df.index, dtype=STRING_DTYPE),
+        "内容": _content(df, detail),
+    })
+
+
+def patient_timeline(
+    patient_id,
+    start=None,
+    end=None,
+    karte_id=None,
+    sources: tuple[TimelineSource, ...] = SOURCES,
+    explain: bool = False,
+) -> pd.DataFrame:
+    """
+    患者1人分のタイムライン（日付・種別・カルテID・内容）を日付順に返す。
+    start / end は日付（end はその日を含む）、karte_id を指定するとカルテIDを持つテーブルだけを対象にする。
+    同じ日付の行は SOURCES の順（受診 → 処置 → 傷病名 → フリーコメント）、その中は保存順。
+    explain=True の場合はテーブルごとに読んだ行グループ数を表示する。
+    """
+    parts = []
+    for order, source in enumerate(sources):
+        part = _read_source(source, patient_id, start, end, karte_id, explain)
+        if part is not None and not part.empty:
+            parts.append(part.assign(_order=order))
+    if not parts:
+        return pd.DataFrame({
+            "日付": pd.Series(dtype="datetime64[ns]"),
+            **{c: pd.Series(dtype=STRING_DTYPE) for c in TIMELINE_COLUMNS[1:]},
+        })
+    timeline = pd.concat(parts, ignore_index=True)
+    timeline = timeline.sort_values(["日付", "_order"], kind="stable", na_position="last")
+    return timeline[TIMELINE_COLUMNS].reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="患者1人分のタイムライン（受診・処置・傷病名・フリーコメント）")
+    parser.add_argument("patient_id", help="患者番号（レセプトはカルテ番号）")
+    parser.add_argument("--start", help="開始日（例: 2024-01-01）")
+    parser.add_argument("--end", help="終了日（その日を含む）")
+    parser.add_argument("--karte-id", help="カルテIDで絞り込む（受診・処置のみ）")
+    parser.add_argument("--explain", action="store_true", help="テーブルごとに読んだ行グループ数を表示")
+    parser.add_argument("--out", type=Path, help="CSV（UTF-8 BOM付き）に保存するパス")
+    args = parser.parse_args()
+
+    print(f"=== 患者 {args.patient_id} のタイムライン ===")
+    result = patient_timeline(args.patient_id, args.start, args.end, args.karte_id, explain=args.explain)
+    if result.empty:
+        print("⚠ 該当するデータがありません。")
+    else:
+        print(result.to_string(index=False))
+        print(f"\n📊 {len(result):,} 件")
+    if args.out:
+        result.to_csv(args.out, index=False, encoding="utf-8-sig")
+        print(f"✅ 保存しました: {args.out}")
@@ -0,0 +1,252 @@
+# apps/procedure_rollups.py
+import argparse
+import os
+import shutil
+from collections.abc import Callable
+from dataclasses import dataclass
+import pandas as pd
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from apps.merge_data import merged_outputs_current, output_layout, period_keys
+from apps.utils.catalog import artifact_info, artifact_suffix, latest_artifact
+from apps.utils.common import OUTPUT_DIR
+from apps.utils.context import PipelineContext, from_context
+from apps.utils.manifest import load_manifest, save_manifest
+from apps.utils.metrics import record_read
+from apps.utils.output import PARQUET_COMPRESSION, to_arrow, write_outputs
+from apps.utils.reader import read_parquet
+
+# ==========================================
+# 処置行為の集計（ロールアップ）
+#   処置行為 × 月 × 診療科 : 件数・数量合計
+#   処置行為 × 患者番号    : 件数・数量合計・初回日・最終日
+#   期間フォルダ（ソースフォルダ）ごとの部分集計を output/rollups/{集計名}/{期間}.parquet に保存し、
+#   新規・変更された期間だけ読み込んで集計し直し、全期間の部分集計を足し合わせる。
+#   期間の変更は merge_data のマニフェスト（期間ごとのCSVのサイズ・ハッシュ）で判定するため、
+#   変更のない期間の明細は読まない。
+# ==========================================
+
+ROLLUP_DIR = OUTPUT_DIR / "rollups"
+MANIFEST_PATH = ROLLUP_DIR / "manifest.json"
+
+# 集計に使う procedure_with_patient の列
+INPUT_COLUMNS = ["ソースフォルダ", "期間開始", "日付", "カルテID", "患者番号", "診療科", "処置行為", "数量"]
+
+LINEAGE = ("procedure_with_patient",)
+
+
+@dataclass(frozen=True)
+class Rollup:
+    """1つの集計表。partial は明細 → 部分集計、merge は部分集計を足し合わせるときの列ごとの集計方法"""
+    name: str
+    keys: list[str]
+    partial: Callable[[pd.DataFrame], pd.DataFrame]
+    merge: dict[str, str]
+
+
+def _month_department(df: pd.DataFrame) -> pd.DataFrame:
+    return (
+        df.groupby(["処置行為", "月", "診療科"], dropna=False, observed=True, sort=False)
+        .agg(件数=("処置行為", "size"), 数量合計=("数量", "sum"))
+        .reset_index()
+    )
+
+
+def _patient(df: pd.DataFrame) -> pd.DataFrame:
+    return (
+        df.groupby(["処置行為", "患者番号"], dropna=False, observed=True, sort=False)
+        .agg(件数=("処置行為", "size"), 数量合計=("数量", "sum"), 初回日=("日付", "min"), 最終日=("日付", "max"))
+        .reset_index()
+    )
+
+
+ROLLUPS = (
+    Rollup("procedure_month_department", ["処置行為", "月", "診療科"], _month_department,
+           {"件数": "sum", "数量合計": "sum"}),
+    Rollup("procedure_patient", ["患者番号", "処置行為"], _patient,
+           {"件数": "sum", "数量合計": "sum", "初回日": "min", "最終日": "max"}),
+)
+
+
+# ==========================================
+# 入力
+# ==========================================
+
+def _departments(ctx: PipelineContext | None) -> pd.Series | None:
+    """カルテID → 診療科（procedure に診療科の列が無い場合に unique_karte_core から引く）"""
+    core = from_context(ctx, "unique_karte_core")
+    if core is None:
+        path = latest_artifact("unique_karte_core")
+        if path is None:
+            return None
+        core = read_parquet(path, columns=["カルテID", "診療科"], dtype_backend="numpy_nullable")
+    if "診療科" not in core.columns:
+        return None
+    return core.drop_duplicates("カルテID").set_index("カルテID")["診療科"]
+
+
+def _to_datetime(s: pd.Series) -> pd.Series:
+    """日付の列を datetime64 にそろえる（pyarrow 型の列は to_period が使えないため numpy 型に戻す）"""
+    dates = pd.to_datetime(s, errors="coerce")
+    if isinstance(dates.dtype, pd.ArrowDtype):
+        dates = dates.astype("datetime64[ns]")
+    return dates
+
+
+def _prepare(df: pd.DataFrame, departments: pd.Series | None) -> pd.DataFrame:
+    """集計用の列（月・診療科・数量）をそろえる"""
+    dates = _to_datetime(df["日付"]) if "日付" in df.columns else pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns]")
+    if "期間開始" in df.columns:
+        dates = dates.fillna(_to_datetime(df["期間開始"]))
+    if "診療科" in df.columns:
+        department = df["診療科"].astype("string")
+    elif departments is not None and "カルテID" in df.columns:
+        department = df["カルテID"].map(departments).astype("string")
+    else:
+        department = pd.Series(pd.NA, index=df.index, dtype="string")
+    quantity = pd.to_numeric(df["数量"], errors="coerce") if "数量" in df.columns else pd.Series(pd.NA, index=df.index)
+    return pd.DataFrame({
+        "処置行為": df["処置行為"].astype("string"),
+        "月": dates.dt.to_period("M").dt.to_timestamp(),
+        "診療科": department,
+        "患者番号": df["患者番号"] if "患者番号" in df.columns else pd.NA,
+        "日付": dates,
+        "数量": quantity.astype("Float64"),
+    })
+
+
+def _read_periods(periods: list[str]) -> pd.DataFrame:
+    """最新の procedure_with_patient から指定期間の行だけを読む（ソースフォルダの条件を押し下げる）"""
+    path = latest_artifact("procedure_with_patient")
+    dataset = ds.dataset(path, format="parquet")
+    columns = [c for c in INPUT_COLUMNS if c in dataset.schema.names]
+    record_read(path)
+    table = dataset.to_table(columns=columns, filter=ds.field("ソースフォルダ").isin(periods))
+    return table.to_pandas()
+
+
+def _joined_current() -> bool:
+    """
+    最新の procedure_with_patient が、merge_data のマニフェストどおりの結合済み出力から作られたものか
+    （結合より後に期間データを取り込み直していれば、マニフェストのキーと明細が食い違う）
+    """
+    if not merged_outputs_current(*output_layout()):
+        return False
+    joined = artifact_info("procedure_with_patient")
+    inputs = [artifact_info(name) for name in ("procedure", "unique_karte_core")]
+    return joined is not None and all(e is not None and joined["updated"] >= e["updated"] for e in inputs)
+
+
+# ==========================================
+# 部分集計の保存と足し合わせ
+# ==========================================
+
+def _part_path(rollup: Rollup, period: str):
+    return ROLLUP_DIR / rollup.name / f"{period}.parquet"
+
+
+def _write_part(df: pd.DataFrame, path) -> None:
+    """部分集計を一時ファイル経由で保存"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    pq.write_table(to_arrow(df), tmp, compression=PARQUET_COMPRESSION)
+    os.replace(tmp, path)
+
+
+def _merge_parts(rollup: Rollup, periods: list[str]) -> pd.DataFrame:
+    """全期間の部分集計を読み込み、キーごとに足し合わせる"""
+    paths = [_part_path(rollup, p) for p in periods if _part_path(rollup, p).exists()]
+    record_read(paths)
+    parts = [pq.read_table(p).to_pandas() for p in paths]
+    if not parts:
+        return pd.DataFrame(columns=[*rollup.keys, *rollup.merge])
+    merged = (
+        pd.concat(parts, ignore_index=True)
+        .groupby(rollup.keys, dropna=False, observed=True)
+        .agg(rollup.merge)
+        .reset_index()
+    )
+    return merged.sort_values(rollup.keys, na_position="last", kind="stable").reset_index(drop=True)
+
+
+def update_rollups(ctx: PipelineContext | None = None, force: bool = False) -> dict[str, pd.DataFrame] | None:
+    """
+    新規・変更された期間だけ明細を読んで部分集計を作り直し、全期間を足し合わせた集計表を返す。
+    期間の変更は merge_data のマニフェストが記録した期間ごとのCSVのサイズ・ハッシュで判定する。
+    force=True の場合や、procedure_with_patient がマニフェストより古い場合は全期間を集計し直す。
+    """
+    df = from_context(ctx, "procedure_with_patient")
+    if df is not None and "処置行為" not in df.columns:
+        print("⚠ カラム『処置行為』が見つかりません。")
+        return None
+    if df is None and latest_artifact("procedure_with_patient") is None:
+        print("⚠ procedure_with_patient_*.parquet が見つかりません。先に結合処理を実行してください。")
+        return None
+
+    current = period_keys()
+    periods = sorted(current)
+    if not periods:
+        print("⚠ 期間データのマニフェストが見つかりません。先に merge_data を実行してください。")
+        return None
+
+    # パイプラインでは procedure_with_patient は同じ実行の結合結果。単体実行では結合が取り込みより古いと
+    # マニフェストのキーを当てにできないため、全期間を集計し直す
+    if df is None and not force and not _joined_current():
+        print("⚠ procedure_with_patient が期間データの取り込みより古いため、全期間を集計し直します。")
+        force = True
+    if force:
+        shutil.rmtree(ROLLUP_DIR, ignore_errors=True)
+    manifest = load_manifest(MANIFEST_PATH)
+    entries: dict[str, str] = manifest.setdefault("periods", {})
+
+    changed = [
+        p for p in periods
+        if entries.get(p) != current[p] or not all(_part_path(r, p).exists() for r in ROLLUPS)
+    ]
+    print(f"🧮 処置行為の集計: {len(periods)} 期間中 {len(changed)} 期間を集計します。")
+
+    if changed:
+        rows = df[df["ソースフォルダ"].isin(changed)] if df is not None else _read_periods(changed)
+        # 診療科の列が無い場合は unique_karte_core から引く
+        departments = None if "診療科" in rows.columns else _departments(ctx)
+        by_period = rows.groupby("ソースフォルダ", observed=True).indices
+        for period in changed:
+            period_rows = rows.iloc[by_period.get(period, [])]
+            prepared = _prepare(period_rows, departments)
+            for rollup in ROLLUPS:
+                _write_part(rollup.partial(prepared), _part_path(rollup, period))
+            entries[period] = current[period]
+            print(f"  → {period}: {len(prepared):,} 行")
+
+    # 消えた期間の部分集計を削除
+    for period in sorted(set(entries) - set(periods)):
+        print(f"  ⚠ 期間が見つからないため集計から除外: {period}")
+        for rollup in ROLLUPS:
+            _part_path(rollup, period).unlink(missing_ok=True)
+        del entries[period]
+    save_manifest(manifest, MANIFEST_PATH)
+
+    return {rollup.name: _merge_parts(rollup, periods) for rollup in ROLLUPS}
+
+
+def export_procedure_rollups(ctx: PipelineContext | None = None, force: bool = False) -> None:
+    """処置行為 × 月 × 診療科、処置行為 × 患者番号 の集計表を出力（CSV/Parquet）"""
+    rollups = update_rollups(ctx, force=force)
+    if rollups is None:
+        return
+    suf = ctx.suffix if ctx is not None else artifact_suffix(latest_artifact("procedure_with_patient"))
+    for rollup in ROLLUPS:
+        table = rollups[rollup.name]
+        paths = write_outputs(table, f"{rollup.name}_{suf}", sort_keys=rollup.keys, lineage=LINEAGE)
+        print(f"✅ {rollup.name}: {' / '.join(p.name for p in paths)} ({len(table):,} 行)")
+        if ctx is not None:
+            ctx.put(rollup.name, table)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="処置行為の集計（月×診療科、患者別）を差分更新")
+    parser.add_argument("--force", action="store_true", help="保存済みの部分集計を使わず全期間を集計し直す")
+    args = parser.parse_args()
+
+    print("=== 処置行為の集計 ===")
+    export_procedure_rollups(force=args.force)
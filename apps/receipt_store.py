@@ -0,0 +1,359 @@
+# apps/receipt_store.py
+import argparse
+import os
+import shutil
+from pathlib import Path
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from apps.extract_free_comments import COMMENT_SCHEMA, FREE_COMMENT_CODE, list_receipt_files, _receipt_labels
+from apps.utils.common import OUTPUT_DIR
+from apps.utils.context import PipelineContext
+from apps.utils.manifest import load_manifest, save_manifest, file_fingerprint, same_content
+from apps.utils.metrics import record_read, record_write
+from apps.utils.output import PARQUET_COMPRESSION
+from apps.utils.parallel import process_pool
+
+# ==========================================
+# 設定
+# ==========================================
+
+# レコード種別ごとの Parquet と索引の保存先
+#   receipt_store/{種別}/{請求月}_{保険者}.parquet
+#   receipt_store/index/{請求月}_{保険者}.parquet
+STORE_DIR = OUTPUT_DIR / "receipt_store"
+INDEX_DIR = STORE_DIR / "index"
+MANIFEST_PATH = STORE_DIR / "manifest.json"
+
+# ストアの形式の版（列を変えたら上げる。違う版のストアは全ファイルを取り込み直す）
+STORE_VERSION = 3
+
+# レコード種別ごとの項目名（先頭のレコード識別情報を除いた並び）
+# ここにない種別は "other" テーブルに識別子と生の項目で保存する
+RECORD_FIELDS: dict[str, list[str]] = {
+    "IR": ["審査支払機関", "都道府県", "点数表", "医療機関コード", "予備", "医療機関名称",
+           "請求年月", "マルチボリューム識別情報", "電話番号"],
+    "RE": ["レセプト番号", "レセプト種別", "診療年月", "氏名", "男女区分", "生年月日",
+           "給付割合", "入院年月日", "病棟区分", "一部負担金区分", "レセプト特記事項",
+           "病床数", "カルテ番号", "割引点数単価", "予備1", "予備2", "予備3", "検索番号",
+           "記録条件仕様年月", "請求情報",
+           "診療科1", "人体の部位等1", "性別等1", "医学的処置1", "特定疾病1",
+           "診療科2", "人体の部位等2", "性別等2", "医学的処置2", "特定疾病2",
+           "診療科3", "人体の部位等3", "性別等3", "医学的処置3", "特定疾病3",
+           "カタカナ氏名", "患者の状態"],
+    "HO": ["保険者番号", "被保険者証記号", "被保険者証番号", "診療実日数", "合計点数",
+           "予備", "食事療養回数", "食事療養合計金額", "職務上の事由", "証明書番号", "負担金額"],
+    "KO": ["公費負担者番号", "公費受給者番号", "任意給付区分", "診療実日数", "合計点数", "負担金額"],
+    "SY": ["傷病名コード", "診療開始日", "転帰区分", "修飾語コード", "傷病名称", "主傷病", "補足コメント"],
+    "SI": ["診療識別", "負担区分", "診療行為コード", "数量データ", "点数", "回数"],
+    "IY": ["診療識別", "負担区分", "医薬品コード", "使用量", "点数", "回数"],
+    "TO": ["診療識別", "負担区分", "特定器材コード", "使用量", "点数", "回数",
+           "単位コード", "単価", "予備", "商品名及び規格"],
+    "CO": ["診療識別", "負担区分", "コメントコード", "文字データ"],
+    "SJ": ["症状詳記区分", "症状詳記データ"],
+}
+
+# すべてのテーブルに付くレセプトキーと位置情報
+#   patient_id_source は patient_id の出どころ（RE のカルテ番号 / カルテ番号がない場合のレセプト番号）
+KEY_COLUMNS = ["receipt_month", "insurer_type", "receipt_seq", "patient_id", "patient_id_source"]
+POSITION_COLUMNS = ["line_no", "byte_offset"]
+
+SOURCE_KARTE = "カルテ番号"
+SOURCE_SERIAL = "レセプト番号"
+
+# ==========================================
+# 解析
+# ==========================================
+
+def _new_buffer(tag: str) -> dict[str, list]:
+    names = RECORD_FIELDS.get(tag, ["レコード識別", "項目"])
+    extra = ["追加項目"] if tag in RECORD_FIELDS else []
+    return {c: [] for c in ["receipt_seq", "patient_id", "patient_id_source", *POSITION_COLUMNS, *names, *extra]}
+
+
+def parse_uke_file(uke_path: Path) -> tuple[dict[str, pa.Table], pa.Table]:
+    """
+    RECEIPTC.UKE の全レコードを種別ごとの Table にし、
+    レセプト（RE 単位）ごとのバイト位置索引と合わせて返す。
+    patient_id は extract_free_comments と同じく RE のカルテ番号、なければレセプト番号
+    （どちらを使ったかを patient_id_source に記録する。レセプト番号は患者番号ではない）。
+    """
+    receipt_month, insurer = _receipt_labels(uke_path)
+    buffers: dict[str, dict[str, list]] = {}
+    index: dict[str, list] = {"receipt_seq": [], "patient_id": [], "patient_id_source": [], "診療年月": [],
+                              "line_no": [], "byte_start": [], "byte_end": []}
+
+    receipt_seq = 0
+    patient_id = None
+    patient_id_source = None
+    offset = 0
+    with open(uke_path, "rb") as f:
+        for line_no, raw in enumerate(f, start=1):
+            start = offset
+            offset += len(raw)
+            line = raw.decode("cp932", errors="replace").rstrip()
+            if not line:
+                continue
+
+            cols = line.split(",")
+            tag = cols[0]
+            fields = cols[1:]
+
+            if tag == "RE":
+                if index["byte_start"]:
+                    index["byte_end"].append(start)
+                receipt_seq += 1
+                if len(cols) > 13 and cols[13]:
+                    patient_id, patient_id_source = cols[13], SOURCE_KARTE
+                else:
+                    patient_id = (cols[1] if len(cols) > 1 else None) or None
+                    patient_id_source = SOURCE_SERIAL if patient_id is not None else None
+                index["receipt_seq"].append(receipt_seq)
+                index["patient_id"].append(patient_id)
+                index["patient_id_source"].append(patient_id_source)
+                index["診療年月"].append(cols[3] if len(cols) > 3 and cols[3] else None)
+                index["line_no"].append(line_no)
+                index["byte_start"].append(start)
+
+            table_key = tag if tag in RECORD_FIELDS else "other"
+            buf = buffers.get(table_key)
+            if buf is None:
+                buf = buffers[table_key] = _new_buffer(table_key)
+            buf["receipt_seq"].append(receipt_seq)
+            buf["patient_id"].append(patient_id)
+            buf["patient_id_source"].append(patient_id_source)
+            buf["line_no"].append(line_no)
+            buf["byte_offset"].append(start)
+
+            names = RECORD_FIELDS.get(tag)
+            if names is None:
+                buf["レコード識別"].append(tag)
+                buf["項目"].append(",".join(fields))
+                continue
+            for i, name in enumerate(names):
+                buf[name].append(fields[i] if i < len(fields) and fields[i] else None)
+            buf["追加項目"].append(",".join(fields[len(names):]).rstrip(",") or None)
+
+    if index["byte_start"]:
+        index["byte_end"].append(offset)
+
+    def to_table(columns: dict[str, list]) -> pa.Table:
+        n = len(columns["receipt_seq"])
+        arrays = {
+            "receipt_month": pa.array([receipt_month] * n, pa.string()),
+            "insurer_type": pa.array([insurer] * n, pa.string()),
+        }
+        for name, values in columns.items():
+            if name in ("receipt_seq", "line_no"):
+                arrays[name] = pa.array(values, pa.int32())
+            elif name in ("byte_offset", "byte_start", "byte_end"):
+                arrays[name] = pa.array(values, pa.int64())
+            else:
+                arrays[name] = pa.array(values, pa.string())
+        return pa.table(arrays)
+
+    tables = {tag: to_table(buf) for tag, buf in buffers.items()}
+    index_table = to_table(index).append_column("source_path", pa.array([str(uke_path.resolve())] * len(index["receipt_seq"]), pa.string()))
+    return tables, index_table
+
+
+def _store_file_name(uke_path: Path) -> str:
+    receipt_month, insurer = _receipt_labels(uke_path)
+    return f"{receipt_month}_{insurer}.parquet"
+
+
+def _remove_from_store(file_name: str) -> None:
+    if not STORE_DIR.exists():
+        return
+    for p in STORE_DIR.glob(f"*/{file_name}"):
+        p.unlink()
+
+
+def _write_store(uke_path: Path) -> int:
+    """1ファイル分を解析してストアに書き出す（プロセスプールの作業単位）。戻り値はレコード数"""
+    tables, index_table = parse_uke_file(uke_path)
+    file_name = _store_file_name(uke_path)
+    _remove_from_store(file_name)
+    for tag, table in tables.items():
+        out = STORE_DIR / tag / file_name
+        out.parent.mkdir(parents=True, exist_ok=True)
+        pq.write_table(table, out, compression=PARQUET_COMPRESSION)
+    INDEX_DIR.mkdir(parents=True, exist_ok=True)
+    pq.write_table(index_table, INDEX_DIR / file_name, compression=PARQUET_COMPRESSION)
+    return sum(t.num_rows for t in tables.values())
+
+
+def build_receipt_store(base_path: str = "../data", workers: int = 1) -> None:
+    """
+    receipt_* の全 UKE をレコード種別ごとの Parquet と索引に取り込む。
+    マニフェストで前回と内容が同じファイルは再解析しない。
+    """
+    manifest = load_manifest(MANIFEST_PATH)
+    if manifest.get("store_version") != STORE_VERSION:
+        # 形式の違うストアは捨てて全ファイルを取り込み直す
+        if STORE_DIR.exists():
+            for old in STORE_DIR.iterdir():
+                if old.is_dir():
+                    shutil.rmtree(old)
+        manifest = {"version": manifest["version"], "store_version": STORE_VERSION}
+    entries: dict[str, dict] = manifest.setdefault("files", {})
+    files = list_receipt_files(base_path)
+
+    changed: list[Path] = []
+    fingerprints: dict[str, dict] = {}
+    for uke_path in files:
+        name = _store_file_name(uke_path)
+        old = entries.get(name)
+        fp = file_fingerprint(uke_path, old)
+        fingerprints[name] = fp
+        if not same_content(old, fp) or not (INDEX_DIR / name).exists():
+            changed.append(uke_path)
+        else:
+            entries[name] = fp
+
+    print(f"🧾 レセプトストア: {len(files)} ファイル中 {len(changed)} ファイルを取り込みます。")
+    record_read(changed)
+    if workers > 1 and len(changed) > 1:
+        with process_pool(min(workers, len(changed))) as ex:
+            counts = list(ex.map(_write_store, changed))
+    else:
+        counts = [_write_store(p) for p in changed]
+
+    for uke_path, n in zip(changed, counts):
+        name = _store_file_name(uke_path)
+        print(f"  → {name.removesuffix('.parquet')}: {n:,} レコード")
+        record_write(STORE_DIR.glob(f"*/{name}"), n)  # 索引（index/）も含む
+        entries[name] = fingerprints[name]
+
+    # 元ファイルが消えたものはストアからも削除
+    for name in sorted(set(entries) - set(fingerprints)):
+        print(f"  ⚠ 元ファイルがないため削除: {name}")
+        _remove_from_store(name)
+        del entries[name]
+
+    save_manifest(manifest, MANIFEST_PATH)
+
+# ==========================================
+# 参照
+# ==========================================
+
+def read_store(tag: str, columns: list[str] | None = None, filter=None) -> pd.DataFrame:
+    """レコード種別 tag のテーブルを読み込む（列の絞り込み・条件の押し下げ可）"""
+    path = STORE_DIR / tag
+    if not path.is_dir():
+        return pd.DataFrame(columns=columns or KEY_COLUMNS)
+    return ds.dataset(path, format="parquet").to_table(columns=columns, filter=filter).to_pandas()
+
+
+def find_receipts(patient_id: str | None = None, receipt_month: str | None = None) -> pd.DataFrame:
+    """患者ID・請求月から該当レセプトの索引（元ファイルとバイト位置）を返す"""
+    cond = None
+    if patient_id is not None:
+        cond = ds.field("patient_id") == patient_id
+    if receipt_month is not None:
+        c = ds.field("receipt_month") == receipt_month
+        cond = c if cond is None else cond & c
+    return read_store("index", filter=cond)
+
+
+def read_receipt_lines(index_row) -> list[str]:
+    """索引の1行から元の UKE の該当レセプト部分だけを読み出す"""
+    with open(index_row["source_path"], "rb") as f:
+        f.seek(int(index_row["byte_start"]))
+        raw = f.read(int(index_row["byte_end"]) - int(index_row["byte_start"]))
+    return raw.decode("cp932", errors="replace").splitlines()
+
+
+def store_file_names() -> list[str]:
+    """ストアに取り込み済みのファイル名（{請求月}_{保険者}.parquet）を list_receipt_files と同じ順に返す"""
+    if not INDEX_DIR.is_dir():
+        return []
+    return sorted(p.name for p in INDEX_DIR.glob("*.parquet"))
+
+
+def _read_store_file(tag: str, file_name: str, columns: list[str], filters=None) -> pd.DataFrame:
+    """1ファイル分の tag のテーブルを読む（そのファイルに tag のレコードがなければ空）"""
+    path = STORE_DIR / tag / file_name
+    if not path.exists():
+        return pd.DataFrame(columns=columns)
+    return pq.read_table(path, columns=columns, filters=filters).to_pandas()
+
+
+def free_comments_from_store(file_name: str) -> pa.Table:
+    """
+    ストアの1ファイル分（{請求月}_{保険者}.parquet）から、extract_free_comments と同じフリーコメントの表を作る。
+    CO(810000001) ごとに、同じレセプト内で直前の（診療日のある）SY の診療日と、
+    直前の SY より後の直近の SI コード（9桁数字）を as-of 結合で付ける。UKE の本文は読まない。
+    """
+    by = ["receipt_seq"]
+    co = _read_store_file("CO", file_name, [*KEY_COLUMNS, "line_no", "文字データ"],
+                          filters=[("コメントコード", "==", FREE_COMMENT_CODE)])
+    co = co[co["patient_id"].notna() & (co["patient_id"] != "")]
+    if co.empty:
+        return COMMENT_SCHEMA.empty_table()
+
+    sy = _read_store_file("SY", file_name, [*by, "line_no", "診療開始日"]).sort_values("line_no")
+    dated = sy.dropna(subset=["診療開始日"]).rename(columns={"診療開始日": "comment_date"})
+    if dated.empty:
+        return COMMENT_SCHEMA.empty_table()
+    si = _read_store_file("SI", file_name, [*by, "line_no", "診療行為コード"])
+    si["診療行為コード"] = si["診療行為コード"].str.strip()
+    si = si[si["診療行為コード"].str.fullmatch(r"\d{9}", na=False)].sort_values("line_no")
+
+    df = co.sort_values("line_no")
+    # 直前の（診療日のある）SY → 診療日
+    df = pd.merge_asof(df, dated[[*by, "line_no", "comment_date"]], on="line_no", by=by, direction="backward")
+    df = df[df["comment_date"].notna()]
+    if si.empty:
+        df["si_code"] = ""
+    else:
+        # 直前の SY（診療日の有無を問わない）→ SI のリセット位置
+        df = pd.merge_asof(df, sy[[*by, "line_no"]].assign(sy_line=sy["line_no"]), on="line_no", by=by,
+                           direction="backward")
+        # 直前の SI（直前の SY より後のものだけ採用）
+        df = pd.merge_asof(df, si.assign(si_line=si["line_no"]), on="line_no", by=by, direction="backward")
+        valid_si = df["si_line"].notna() & (df["si_line"] > df["sy_line"])
+        df["si_code"] = df["診療行為コード"].where(valid_si, "").fillna("")
+
+    dates = pa.array(df["comment_date"], pa.string())
+    return pa.table(
+        [
+            pa.array(df["receipt_month"], pa.string()),
+            pa.array(df["insurer_type"], pa.string()),
+            pa.array(df["patient_id"], pa.string()),
+            dates,
+            pa.array(df["文字データ"].fillna(""), pa.string()),
+            pa.array(df["si_code"], pa.string()),
+            pc.strptime(dates, format="%Y%m%d", unit="ns", error_is_null=True),
+        ],
+        schema=COMMENT_SCHEMA,
+    )
+
+
+def receipt_patients() -> pd.DataFrame:
+    """
+    RE レコードの患者ID・氏名・カタカナ氏名・生年月日の一意な表（名寄せ用）。
+    カルテ番号のある RE だけを対象にする（レセプト番号は患者番号と突き合わせられない）。
+    """
+    df = read_store("RE", columns=["patient_id", "patient_id_source", "氏名", "カタカナ氏名", "生年月日"])
+    df = df[df["patient_id_source"] == SOURCE_KARTE].drop(columns="patient_id_source")
+    return df.dropna(subset=["patient_id"]).drop_duplicates().reset_index(drop=True)
+
+
+def run_build_receipt_store(base_path: str = "../data", workers: int = 1, ctx: PipelineContext | None = None) -> None:
+    print("\n--- ⑩ レセプト全レコードのストア更新（種別ごとの Parquet + 索引） ---")
+    build_receipt_store(base_path, workers=workers)
+    if ctx is not None:
+        ctx.put("receipt_patients", receipt_patients())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="レセプト全レコードのストア作成")
+    parser.add_argument("--base-path", default="../data", help="receipt_* フォルダのある場所")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="並列に解析するプロセス数")
+    args = parser.parse_args()
+
+    run_build_receipt_store(args.base_path, workers=args.workers)
+    print(f"\n=== ✅ 完了: {STORE_DIR} ===")
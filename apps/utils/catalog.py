@@ -0,0 +1,151 @@
+# apps/utils/catalog.py
+import os
+import re
+import threading
+from datetime import datetime
+from pathlib import Path
+import pyarrow as pa
+from apps.utils.common import OUTPUT_DIR
+from apps.utils.manifest import load_manifest, save_manifest
+
+# ==========================================
+# 成果物カタログ（output/catalog.json）
+#   成果物名（karte / unique_karte_core など）→ 最新ファイル・列・件数・元データ
+#   write_outputs / OutputWriter / save_outputs(layout="dataset") が出力のたびに更新する
+# ==========================================
+
+CATALOG_NAME = "catalog.json"
+
+# ファイル名末尾の時刻（_YYYYMMDD_HHMMSS または _HHMMSS）
+_TS_SUFFIX = re.compile(r"_(?:\d{8}_)?\d{6}$")
+
+# パイプラインのタスクはスレッドで並行に出力するため、読み書きをまとめて排他する
+_LOCK = threading.Lock()
+
+# 読み込んだカタログ（ファイルの更新時刻・サイズが変わるまで再利用）
+_cache: dict[Path, tuple[tuple[int, int], dict]] = {}
+
+
+def artifact_name(stem: str) -> str:
+    """出力ファイル名（拡張子なし）から時刻部分を除いた成果物名"""
+    return _TS_SUFFIX.sub("", stem)
+
+
+def _catalog_path(output_dir: Path) -> Path:
+    return Path(output_dir) / CATALOG_NAME
+
+
+def load_catalog(output_dir: Path = OUTPUT_DIR) -> dict:
+    """カタログを読み込む（前回から変わっていなければキャッシュを返す）"""
+    path = _catalog_path(output_dir)
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return {"artifacts": {}}
+    key = (st.st_mtime_ns, st.st_size)
+    cached = _cache.get(path)
+    if cached is None or cached[0] != key:
+        catalog = load_manifest(path)
+        catalog.setdefault("artifacts", {})
+        _cache[path] = (key, catalog)
+    return _cache[path][1]
+
+
+def _register(
+    name: str,
+    files: dict[str, Path],
+    schema: pa.Schema,
+    num_rows: int,
+    lineage: tuple[str, ...],
+    output_dir: Path,
+) -> None:
+    """カタログの name の項目を置き換える（一時ファイル経由で置き換え保存）"""
+    with _LOCK:
+        path = _catalog_path(output_dir)
+        catalog = load_manifest(path)
+        artifacts = catalog.setdefault("artifacts", {})
+        artifacts[name] = {
+            "files": {fmt: os.path.relpath(p, output_dir) for fmt, p in files.items()},
+            "columns": {f.name: str(f.type) for f in schema},
+            "num_rows": num_rows,
+            "lineage": {
+                src: artifacts.get(src, {}).get("files", {}).get("parquet") for src in lineage
+            },
+            "updated": datetime.now().isoformat(timespec="seconds"),
+        }
+        save_manifest(catalog, path)
+
+
+def register_artifact(
+    paths: list[Path],
+    schema: pa.Schema,
+    num_rows: int,
+    lineage: tuple[str, ...] = (),
+    output_dir: Path = OUTPUT_DIR,
+) -> None:
+    """
+    出力したファイルをカタログに登録する（一時ファイル経由で置き換え保存）。
+    lineage には元にした成果物名を渡し、その時点の最新ファイル名を記録する。
+    """
+    if not paths:
+        return
+    files = {p.suffix.lstrip("."): p for p in paths}
+    _register(artifact_name(paths[0].stem), files, schema, num_rows, lineage, Path(output_dir))
+
+
+def register_dataset(
+    name: str,
+    path: Path,
+    schema: pa.Schema,
+    num_rows: int,
+    lineage: tuple[str, ...] = (),
+    output_dir: Path = OUTPUT_DIR,
+) -> None:
+    """
+    パーティション付きデータセット（フォルダ）を name の最新として登録する（形式は "dataset"）。
+    同じ name の時刻付きファイルは最新ではなくなる（latest_artifact(name) はこのフォルダを返す）。
+    """
+    _register(name, {"dataset": Path(path)}, schema, num_rows, lineage, Path(output_dir))
+
+
+def _scan_latest(name: str, fmt: str, output_dir: Path) -> Path | None:
+    """カタログ未登録（以前の出力）の場合は時刻付きのファイル名を探し、更新時刻が最新のものを返す"""
+    pattern = re.compile(rf"^{re.escape(name)}_(?:\d{{8}}_)?\d{{6}}\.{fmt}$")
+    files = [p for p in Path(output_dir).glob(f"{name}_*.{fmt}") if pattern.match(p.name)]
+    if not files:
+        return None
+    return max(files, key=lambda p: p.stat().st_mtime_ns)
+
+
+def latest_artifact(name: str, fmt: str = "parquet", output_dir: Path = OUTPUT_DIR) -> Path | None:
+    """
+    成果物名の最新ファイル（fmt="dataset" ならデータセットのフォルダ）を返す（見つからなければ None）。
+    fmt="parquet" で最新の出力がデータセット（save_outputs(layout="dataset")）の場合はそのフォルダを返す
+    （reader.read_parquet / parquet_meta / common.open_parquet はフォルダも読める）。
+    カタログの最新の出力に fmt が含まれない場合は、それより古いファイルを探さずに None を返す。
+    """
+    entry = load_catalog(output_dir)["artifacts"].get(name)
+    if entry is not None:
+        files = entry["files"]
+        if fmt not in files and not (fmt == "parquet" and "dataset" in files):
+            return None
+        path = Path(output_dir) / files.get(fmt, files.get("dataset"))
+        if path.exists():
+            return path
+    return _scan_latest(name, fmt, output_dir)
+
+
+def artifact_suffix(path: Path) -> str:
+    """
+    成果物から作る出力のファイル名に付ける時刻部分（例: karte_20251102_110939.parquet → 110939）。
+    時刻を持たないデータセットのフォルダは、フォルダの更新時刻（HHMMSS）を使う。
+    """
+    path = Path(path)
+    if path.is_dir():
+        return datetime.fromtimestamp(path.stat().st_mtime).strftime("%H%M%S")
+    return path.stem.split("_")[-1]
+
+
+def artifact_info(name: str, output_dir: Path = OUTPUT_DIR) -> dict | None:
+    """カタログに記録された成果物の情報（files / columns / num_rows / lineage / updated）"""
+    return load_catalog(output_dir)["artifacts"].get(name)
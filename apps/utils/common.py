@@ -1,14 +1,98 @@
 # apps/utils/common.py
+import operator
+import re
+from functools import reduce
 from pathlib import Path
+import pandas as pd
+import pyarrow.dataset as ds
 
 OUTPUT_DIR = Path(__file__).resolve().parents[2] / "output"
 
+# save_outputs(layout="dataset") の出力先（output/dataset/{key}/）
+DATASET_DIR = OUTPUT_DIR / "dataset"
+
 def get_latest_parquet(prefixes):
-    """prefix のリストに対して、output フォルダ内の最新 Parquet を取得"""
-    pq_files = sorted(OUTPUT_DIR.glob("*.parquet"))
+    """
+    prefix（"karte_" など）のリストに対して、成果物カタログから最新 Parquet を取得
+    （最新がデータセットの場合はそのフォルダ。reader.read_parquet でそのまま読める）
+    """
+    # catalog が OUTPUT_DIR を参照するため、ここで import する
+    from apps.utils.catalog import latest_artifact
+
     targets = []
     for prefix in prefixes:
-        matches = sorted([f for f in pq_files if f.name.startswith(prefix)])
-        if matches:
-            targets.append(matches[-1])
+        path = latest_artifact(prefix.rstrip("_"))
+        if path is not None:
+            targets.append(path)
     return targets
+
+def open_dataset(key: str | Path) -> ds.Dataset | None:
+    """
+    output/dataset/{key} のパーティション付きデータセットを開く（なければ None）。
+    key にはフォルダのパス（latest_artifact が返したもの）も渡せる。
+    """
+    path = DATASET_DIR / key if isinstance(key, str) else Path(key)
+    if not path.is_dir():
+        return None
+    return ds.dataset(path, format="parquet", partitioning="hive")
+
+def open_parquet(path: Path) -> ds.Dataset:
+    """latest_artifact が返した Parquet ファイル、またはデータセットのフォルダを pyarrow.dataset で開く"""
+    path = Path(path)
+    if path.is_dir():
+        return open_dataset(path)
+    return ds.dataset(path, format="parquet")
+
+# ソースフォルダ（business_report_YYYYMMDD_YYYYMMDD）の期間の開始・終了
+_PERIOD_RE = re.compile(r"_(\d{8})_(\d{8})$")
+
+def period_partition_filter(
+    dataset: ds.Dataset, lower: pd.Timestamp | None, upper: pd.Timestamp | None
+) -> ds.Expression | None:
+    """
+    open_dataset で開いたデータセットのパーティション（ソースフォルダ / 期間年・期間月）のうち、
+    日付の範囲 [lower, upper) と重なりうるものだけを残す条件（該当するパーティションの列がなければ None）。
+    ソースフォルダは期間の開始・終了、期間年・期間月は期間開始の年月で判定する
+    （期間の長さが分からないため、年月は上限だけで絞る）。
+    条件はパーティションの値の一致だけで組み立てる（読み込み時にそのまま読み飛ばせる）。
+    """
+    partitioning = getattr(dataset, "partitioning", None)
+    if partitioning is None or (lower is None and upper is None):
+        return None
+    names = partitioning.schema.names
+    lo = lower.strftime("%Y%m%d") if lower is not None else None
+    hi = (upper - pd.Timedelta(days=1)).strftime("%Y%m%d") if upper is not None else None
+
+    if "ソースフォルダ" in names:
+        def overlaps(keys: dict) -> bool:
+            m = _PERIOD_RE.search(str(keys.get("ソースフォルダ", "")))
+            if m is None:
+                return True
+            return (hi is None or m.group(1) <= hi) and (lo is None or m.group(2) >= lo)
+    elif {"期間年", "期間月"}.issubset(names) and hi is not None:
+        def overlaps(keys: dict) -> bool:
+            if keys.get("期間年") is None or keys.get("期間月") is None:
+                return True
+            return int(keys["期間年"]) * 100 + int(keys["期間月"]) <= int(hi[:6])
+    else:
+        return None
+
+    selected = []
+    for fragment in dataset.get_fragments():
+        keys = ds.get_partition_keys(fragment.partition_expression)
+        if overlaps(keys) and keys not in selected:
+            selected.append(keys)
+    if not selected:
+        return ds.scalar(False)
+    exprs = [reduce(operator.and_, (ds.field(c) == v for c, v in keys.items())) for keys in selected]
+    return reduce(operator.or_, exprs)
+
+def read_dataset(key: str | Path, columns: list[str] | None = None, filter=None) -> pd.DataFrame | None:
+    """
+    データセットから必要な列・パーティションだけを読み込む（key は open_dataset と同じ）。
+    filter には pyarrow.dataset の式を渡す（例: ds.field("期間年") == 2024）。
+    """
+    dataset = open_dataset(key)
+    if dataset is None:
+        return None
+    return dataset.to_table(columns=columns, filter=filter).to_pandas()
@@ -0,0 +1,33 @@
+# apps/utils/context.py
+from dataclasses import dataclass, field
+import pandas as pd
+
+
+@dataclass
+class PipelineContext:
+    """
+    main.py の各ステップ間でメモリ上のデータを共有するための入れ物。
+    frames には load_all_periods の結果（karte / procedure / diagnosis）と
+    各ステップの出力（unique_karte_core / procedure_with_patient など）を名前で保持する。
+    ステップ側は frames を書き換えず、新しい DataFrame を put すること。
+    """
+    run_ts: str
+    frames: dict[str, pd.DataFrame] = field(default_factory=dict)
+
+    @property
+    def suffix(self) -> str:
+        """出力ファイル名の末尾に使う HHMMSS（save_outputs の時刻部分）"""
+        return self.run_ts.split("_")[-1]
+
+    def get(self, name: str) -> pd.DataFrame | None:
+        return self.frames.get(name)
+
+    def put(self, name: str, df: pd.DataFrame) -> None:
+        self.frames[name] = df
+
+
+def from_context(ctx: PipelineContext | None, name: str) -> pd.DataFrame | None:
+    """ctx があれば name のデータを返す（単体実行時や未登録なら None）"""
+    if ctx is None:
+        return None
+    return ctx.get(name)
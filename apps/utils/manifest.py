@@ -0,0 +1,48 @@
+# apps/utils/manifest.py
+import hashlib
+import json
+import os
+from pathlib import Path
+
+MANIFEST_VERSION = 1
+
+
+def load_manifest(path: Path) -> dict:
+    """マニフェスト(JSON)を読み込む。存在しない・壊れている場合は空で返す"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"version": MANIFEST_VERSION}
+    if data.get("version") != MANIFEST_VERSION:
+        return {"version": MANIFEST_VERSION}
+    return data
+
+
+def save_manifest(manifest: dict, path: Path) -> None:
+    """マニフェストを一時ファイル経由で置き換え保存（途中終了でも壊れない）"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def file_fingerprint(path: Path, previous: dict | None = None) -> dict:
+    """
+    ファイルのサイズ・更新時刻・内容ハッシュを返す。
+    サイズと更新時刻が前回と同じならハッシュ計算を省略して前回値を流用する。
+    """
+    st = path.stat()
+    if previous and previous.get("size") == st.st_size and previous.get("mtime_ns") == st.st_mtime_ns:
+        return dict(previous)
+    with open(path, "rb") as f:
+        digest = hashlib.file_digest(f, "sha256").hexdigest()
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest}
+
+
+def same_content(old: dict | None, new: dict | None) -> bool:
+    """2つのフィンガープリントが同じ内容を指すか（両方 None も同一とみなす）"""
+    if old is None or new is None:
+        return old is None and new is None
+    return old.get("size") == new.get("size") and old.get("sha256") == new.get("sha256")
@@ -0,0 +1,260 @@
+# apps/utils/metrics.py
+import contextvars
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from apps.utils.common import OUTPUT_DIR
+
+# ==========================================
+# main.py の各ステップの計測
+#   所要時間（wall / CPU）・ピークRSS・入出力の行数・読み書きしたバイト数を
+#   output/metrics/pipeline_<実行時刻>.jsonl に1ステップ1行で記録し、最後に一覧を表示する。
+#   環境変数で指定したステップだけプロファイルを取る（ステップ名をカンマ区切り、all で全ステップ）
+#     PIPELINE_PROFILE=join_procedure_with_patients python main.py      ← cProfile
+#     PIPELINE_TRACEMALLOC=export_unique_karte_core python main.py      ← tracemalloc
+# ==========================================
+
+METRICS_DIR = OUTPUT_DIR / "metrics"
+PROFILE_ENV = "PIPELINE_PROFILE"
+TRACEMALLOC_ENV = "PIPELINE_TRACEMALLOC"
+
+# RSS を調べる間隔（秒）
+RSS_INTERVAL = 0.05
+
+# プロファイル結果を画面に出す件数
+PROFILE_TOP = 20
+
+
+@dataclass
+class StepMetrics:
+    """
+    1ステップの計測結果。
+    cpu_s はステップを実行したスレッドの CPU 時間（ワーカープロセスの分は含まない）。
+    peak_rss_mb は実行中のプロセス全体の RSS の最大値（並行実行中の他ステップの分も含む）。
+    rows_out は出力ファイルに書いた行数（書き出しがなければ ctx に置いたデータの行数）。
+    """
+    name: str
+    status: str = "done"
+    wall_s: float = 0.0
+    cpu_s: float = 0.0
+    peak_rss_mb: float | None = None
+    rows_in: int = 0
+    rows_out: int = 0
+    bytes_read: int = 0
+    bytes_written: int = 0
+    error: str | None = None
+    profile: str | None = None
+    traced_peak_mb: float | None = None
+
+
+# 計測中のステップ（ステップを実行しているスレッドごと）
+_current: contextvars.ContextVar[StepMetrics | None] = contextvars.ContextVar("current_step", default=None)
+
+
+def _as_paths(paths: Path | str | Iterable[Path | str]) -> list[Path]:
+    if isinstance(paths, (str, Path)):
+        return [Path(paths)]
+    return [Path(p) for p in paths]
+
+
+def _file_size(path: Path) -> int:
+    if path.is_dir():
+        # データセット（save_outputs(layout="dataset")）はフォルダ内の Parquet の合計
+        return sum(_file_size(p) for p in path.rglob("*.parquet"))
+    try:
+        return path.stat().st_size
+    except OSError:
+        return 0
+
+
+def record_read(paths: Path | str | Iterable[Path | str]) -> None:
+    """計測中のステップに、読み込んだファイルのバイト数を加える（計測外なら何もしない）"""
+    step = _current.get()
+    if step is not None:
+        step.bytes_read += sum(_file_size(p) for p in _as_paths(paths))
+
+
+def record_write(paths: Path | str | Iterable[Path | str], num_rows: int = 0) -> None:
+    """計測中のステップに、書き出したファイルのバイト数と行数を加える（計測外なら何もしない）"""
+    step = _current.get()
+    if step is not None:
+        step.bytes_written += sum(_file_size(p) for p in _as_paths(paths))
+        step.rows_out += num_rows
+
+
+def current_rss_mb() -> float | None:
+    """
+    現在の RSS（MB）。Linux は /proc/self/statm、それ以外は ru_maxrss（起動後の最大値）。
+    どちらも取れない環境（Windows）では None。
+    """
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS は byte、それ以外は KB
+    return rss / 2**20 if os.uname().sysname == "Darwin" else rss / 2**10
+
+
+class _RssSampler:
+    """ステップ実行中、一定間隔で RSS を調べて最大値を残す"""
+
+    def __init__(self, interval: float = RSS_INTERVAL):
+        self.interval = interval
+        self.peak = current_rss_mb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _update(self) -> None:
+        rss = current_rss_mb()
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._update()
+
+    def __enter__(self) -> "_RssSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        self._update()
+
+
+def _selected(env: str, name: str) -> bool:
+    names = {v.strip() for v in os.environ.get(env, "").split(",") if v.strip()}
+    return "all" in names or name in names
+
+
+def profiling_requested() -> bool:
+    """cProfile / tracemalloc のどちらかが指定されているか"""
+    return any(os.environ.get(env, "").strip() for env in (PROFILE_ENV, TRACEMALLOC_ENV))
+
+
+class MetricsLog:
+    """1回の実行分の計測結果。ステップが終わるたびに JSON Lines へ追記する"""
+
+    def __init__(self, run_ts: str, metrics_dir: Path = METRICS_DIR):
+        self.run_ts = run_ts
+        self.metrics_dir = Path(metrics_dir)
+        self.path = self.metrics_dir / f"pipeline_{run_ts}.jsonl"
+        self.steps: list[StepMetrics] = []
+        self._lock = threading.Lock()
+
+    def _append(self, record: dict) -> None:
+        self.metrics_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def add(self, step: StepMetrics) -> None:
+        with self._lock:
+            self.steps.append(step)
+            self._append({"type": "step", "run_ts": self.run_ts, **asdict(step)})
+
+    def _dump_profile(self, step: StepMetrics, profiler: cProfile.Profile) -> None:
+        path = self.metrics_dir / f"{self.run_ts}_{step.name}.prof"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(path)
+        step.profile = str(path)
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(PROFILE_TOP)
+        print(f"\n🔬 cProfile: {step.name}（上位 {PROFILE_TOP} 件 / 全体: {path.name}）")
+        print(out.getvalue())
+
+    def _dump_tracemalloc(self, step: StepMetrics) -> None:
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        step.traced_peak_mb = round(peak / 2**20, 1)
+        print(f"\n🔬 tracemalloc: {step.name}（ピーク {step.traced_peak_mb:,.1f} MB、確保量の上位 10 行）")
+        for stat in snapshot.statistics("lineno")[:10]:
+            print(f"  {stat}")
+
+    @contextmanager
+    def step(self, name: str, rows_in: int = 0) -> Iterator[StepMetrics]:
+        """
+        with ブロックの処理を1ステップとして計測する。
+        例外は status=failed として記録したうえで呼び出し元へ送る。
+        """
+        metrics = StepMetrics(name, rows_in=rows_in)
+        token = _current.set(metrics)
+        profiler = cProfile.Profile() if _selected(PROFILE_ENV, name) else None
+        trace = _selected(TRACEMALLOC_ENV, name) and not tracemalloc.is_tracing()
+        if trace:
+            tracemalloc.start()
+        sampler = _RssSampler()
+        t0 = time.perf_counter()
+        c0 = time.thread_time()
+        try:
+            with sampler:
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    yield metrics
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+        except Exception as e:
+            metrics.status = "failed"
+            metrics.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            metrics.wall_s = round(time.perf_counter() - t0, 4)
+            metrics.cpu_s = round(time.thread_time() - c0, 4)
+            metrics.peak_rss_mb = None if sampler.peak is None else round(sampler.peak, 1)
+            _current.reset(token)
+            if profiler is not None:
+                self._dump_profile(metrics, profiler)
+            if trace:
+                self._dump_tracemalloc(metrics)
+                tracemalloc.stop()
+            self.add(metrics)
+
+    def skip(self, name: str, status: str) -> None:
+        """実行しなかったステップ（skipped / blocked）を記録する"""
+        self.add(StepMetrics(name, status=status))
+
+    def print_summary(self) -> None:
+        """ステップごとの一覧を表示し、合計を JSON Lines の最後に追記する"""
+        print("\n=== ステップ別の計測結果 ===")
+        print(f"{'ステップ':<30} {'状態':<8} {'wall(s)':>8} {'cpu(s)':>8} {'RSS(MB)':>8} "
+              f"{'行(入)':>11} {'行(出)':>11} {'読込(MB)':>9} {'書込(MB)':>9}")
+        for s in self.steps:
+            rss = "-" if s.peak_rss_mb is None else f"{s.peak_rss_mb:,.0f}"
+            print(f"{s.name:<30} {s.status:<8} {s.wall_s:>8.2f} {s.cpu_s:>8.2f} {rss:>8} "
+                  f"{s.rows_in:>11,} {s.rows_out:>11,} {s.bytes_read / 2**20:>9.1f} {s.bytes_written / 2**20:>9.1f}")
+
+        statuses: dict[str, int] = {}
+        for s in self.steps:
+            statuses[s.status] = statuses.get(s.status, 0) + 1
+        peaks = [s.peak_rss_mb for s in self.steps if s.peak_rss_mb is not None]
+        with self._lock:
+            self._append({
+                "type": "summary",
+                "run_ts": self.run_ts,
+                "steps": len(self.steps),
+                "statuses": statuses,
+                # 並行実行したステップは重なるため、全体の経過時間とは一致しない
+                "step_wall_s": round(sum(s.wall_s for s in self.steps), 4),
+                "peak_rss_mb": max(peaks) if peaks else None,
+                "bytes_read": sum(s.bytes_read for s in self.steps),
+                "bytes_written": sum(s.bytes_written for s in self.steps),
+            })
+        print(f"📝 計測ログ: {self.path}")
@@ -0,0 +1,327 @@
+# apps/utils/output.py
+import codecs
+import io
+import os
+from pathlib import Path
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from apps.utils.catalog import register_artifact
+from apps.utils.common import OUTPUT_DIR
+from apps.utils.metrics import record_write
+from apps.utils.parquet_meta import sorted_schema, write_sorted_parquet
+from apps.utils.schema import STRING_DTYPE
+
+# ==========================================
+# 出力形式の設定（全エクスポーターで共通）
+#   環境変数 OUTPUT_FORMATS に parquet / csv / both（既定）を指定する
+#   例: OUTPUT_FORMATS=parquet python main.py
+#   後続のステップ（latest_artifact・結合・付与など）は Parquet を読むため、Parquet は常に出力する
+#   （csv を指定した場合も Parquet を出力し、CSV を追加で出す）
+# ==========================================
+
+OUTPUT_FORMATS_ENV = "OUTPUT_FORMATS"
+FORMATS = ("csv", "parquet")
+
+# CSV は Excel で開けるよう BOM付き UTF-8。レセプト系は cp932
+CSV_ENCODING = "utf-8-sig"
+CSV_ENCODINGS = ("utf-8-sig", "cp932")
+
+PARQUET_COMPRESSION = "snappy"
+
+# Parquet の1行グループの最大行数。既定（約100万行）より小さくし、
+# 行グループごとの最小・最大の統計で読み飛ばせる範囲を細かくする（apps/patient_timeline.py）
+PARQUET_ROW_GROUP_SIZE = 128 * 1024
+
+# pyarrow の quoting_style="needed" は値の中身ではなく型で判断し、文字列の値（と見出し）はすべて引用符で囲み、
+# 数値など引用符を含みえない型は囲まない（"all_valid" は数値も囲むため使わない）
+_CSV_OPTIONS = pacsv.WriteOptions(quoting_style="needed")
+
+
+_warned_csv_only = False
+
+
+def output_formats(formats: str | None = None) -> tuple[str, ...]:
+    """
+    出力する形式を返す。formats 未指定なら環境変数 OUTPUT_FORMATS（既定 both）。
+    "parquet" / "csv" / "both" のほか "parquet,csv" のような指定も受け付ける。
+    Parquet は常に含める（csv だけの指定は csv + parquet として扱う）。
+    """
+    global _warned_csv_only
+    value = (formats or os.environ.get(OUTPUT_FORMATS_ENV) or "both").strip().lower()
+    if value == "both":
+        return FORMATS
+    selected = {v.strip() for v in value.split(",") if v.strip()}
+    unknown = selected - set(FORMATS)
+    if unknown or not selected:
+        raise ValueError(f"出力形式は parquet / csv / both で指定してください: {value!r}")
+    if "parquet" not in selected:
+        if not _warned_csv_only:
+            print("⚠ 後続のステップが Parquet を読むため、csv 指定でも Parquet を出力します。")
+            _warned_csv_only = True
+        selected.add("parquet")
+    return tuple(f for f in FORMATS if f in selected)
+
+
+def _numpy_dtype(dtype: pd.ArrowDtype) -> str:
+    """ArrowDtype に対応する通常の pandas の型（schema.py と同じ型の付け方）"""
+    t = dtype.pyarrow_dtype
+    if pa.types.is_dictionary(t):
+        return "category"
+    if pa.types.is_integer(t):
+        return f"{'UInt' if pa.types.is_unsigned_integer(t) else 'Int'}{t.bit_width}"
+    if pa.types.is_boolean(t):
+        return "boolean"
+    if pa.types.is_floating(t):
+        return "float64"
+    if pa.types.is_timestamp(t):
+        return f"datetime64[{t.unit}]"
+    if pa.types.is_string(t) or pa.types.is_large_string(t):
+        return STRING_DTYPE
+    return "object"
+
+
+def to_arrow(data: pd.DataFrame | pa.Table) -> pa.Table:
+    """
+    DataFrame を Arrow の Table にする。
+    ArrowDtype の列（reader.read_parquet の結果）は、読み直したときに通常の型
+    （Int64 / category など）に戻るよう pandas のメタデータだけを差し替える。
+    """
+    if isinstance(data, pa.Table):
+        return data
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    arrow_cols = {c: _numpy_dtype(t) for c, t in data.dtypes.items() if isinstance(t, pd.ArrowDtype)}
+    if arrow_cols:
+        metadata = pa.Schema.from_pandas(data.iloc[:0].astype(arrow_cols), preserve_index=False).metadata
+        table = table.replace_schema_metadata(metadata)
+    return table
+
+
+def _csv_type(t: pa.DataType) -> pa.DataType:
+    """CSV に書くときの型（日付・真偽値は文字列、カテゴリは値の型）"""
+    if pa.types.is_timestamp(t) or pa.types.is_boolean(t):
+        return pa.string()
+    if pa.types.is_dictionary(t):
+        return _csv_type(t.value_type)
+    return t
+
+
+def _csv_column(col: pa.ChunkedArray) -> pa.ChunkedArray:
+    """pandas の to_csv と同じ表記にそろえる"""
+    t = col.type
+    if pa.types.is_dictionary(t):
+        return _csv_column(col.cast(t.value_type))
+    if pa.types.is_boolean(t):
+        return pc.if_else(col, "True", "False")
+    if pa.types.is_timestamp(t):
+        # 時刻がすべて 0:00 なら日付だけ（pandas と同じ）
+        midnight = pc.all(pc.equal(pc.subtract(col, pc.floor_temporal(col, unit="day")), pa.scalar(0, pa.duration(t.unit))))
+        fmt = "%Y-%m-%d" if midnight.as_py() in (True, None) else "%Y-%m-%d %H:%M:%S"
+        # 秒単位にそろえてから書式化（%S に小数秒が付かないように）
+        return pc.strftime(pc.floor_temporal(col, unit="second").cast(pa.timestamp("s")), format=fmt)
+    return col
+
+
+def _csv_schema(schema: pa.Schema) -> pa.Schema:
+    return pa.schema([pa.field(f.name, _csv_type(f.type)) for f in schema])
+
+
+def _csv_table(table: pa.Table) -> pa.Table:
+    return pa.Table.from_arrays(
+        [_csv_column(col) for col in table.columns],
+        schema=_csv_schema(table.schema),
+    )
+
+
+# 変換できなかった文字の例として警告に出す数
+_REPLACED_EXAMPLES = 5
+
+
+class _TranscodingSink(io.RawIOBase):
+    """
+    pyarrow の CSV（UTF-8）を cp932 などに変換しながらファイルへ書く。
+    表せない文字は ? にし、その文字数と例を replaced / examples に記録する（CsvWriter が警告する）。
+    """
+
+    def __init__(self, f, encoding: str):
+        self.f = f
+        self.encoding = encoding
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.replaced = 0
+        self.examples: list[str] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def _count_unencodable(self, text: str) -> None:
+        for c in set(text):
+            try:
+                c.encode(self.encoding)
+            except UnicodeEncodeError:
+                self.replaced += text.count(c)
+                if len(self.examples) < _REPLACED_EXAMPLES and c not in self.examples:
+                    self.examples.append(c)
+
+    def write(self, b) -> int:
+        text = self.decoder.decode(bytes(b))
+        try:
+            data = text.encode(self.encoding)
+        except UnicodeEncodeError:
+            self._count_unencodable(text)
+            data = text.encode(self.encoding, errors="replace")
+        self.f.write(data)
+        return len(b)
+
+
+class CsvWriter:
+    """pyarrow のマルチスレッド CSV ライターで書く（utf-8-sig / cp932）"""
+
+    def __init__(self, path: Path, schema: pa.Schema, encoding: str = CSV_ENCODING):
+        if encoding not in CSV_ENCODINGS:
+            raise ValueError(f"CSV の文字コードは {CSV_ENCODINGS} のいずれかを指定してください: {encoding}")
+        self.path = Path(path)
+        self.file = open(path, "wb")
+        if encoding == "utf-8-sig":
+            self.file.write(codecs.BOM_UTF8)
+            self.sink = None
+            sink = self.file
+        else:
+            self.sink = sink = _TranscodingSink(self.file, encoding)
+        self.writer = pacsv.CSVWriter(sink, _csv_schema(schema), write_options=_CSV_OPTIONS)
+
+    def write(self, table: pa.Table) -> None:
+        self.writer.write_table(_csv_table(table))
+
+    def close(self) -> None:
+        self.writer.close()
+        self.file.close()
+        if self.sink is not None and self.sink.replaced:
+            examples = "".join(self.sink.examples)
+            print(f"⚠ {self.path.name}: {self.sink.encoding} で表せない文字 {self.sink.replaced:,} 文字を ? に置き換えました"
+                  f"（例: {examples}）。元の文字は Parquet に残っています。")
+
+
+class OutputWriter:
+    """
+    バッチごとに Parquet / CSV へ追記する（write_outputs のストリーミング版）。
+    出力形式・文字コード・圧縮は write_outputs と同じ設定に従う。
+    close 時に成果物カタログへ登録する。with ブロックが例外で抜けた場合は登録せず、書きかけのファイルを削除する。
+    sort_keys を渡すと Parquet に並び順を記録する（書き込むバッチが全体としてその順に並んでいること）。
+    """
+
+    def __init__(
+        self,
+        stem: str,
+        schema: pa.Schema,
+        output_dir: Path = OUTPUT_DIR,
+        formats: str | None = None,
+        encoding: str = CSV_ENCODING,
+        lineage: tuple[str, ...] = (),
+        sort_keys: list[str] | None = None,
+    ):
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        self.output_dir = output_dir
+        self.schema = schema
+        self.lineage = lineage
+        self.paths: list[Path] = []
+        self.num_rows = 0
+        self.parquet = None
+        self.csv = None
+        self.closed = False
+        for fmt in output_formats(formats):
+            path = output_dir / f"{stem}.{fmt}"
+            if fmt == "parquet":
+                if sort_keys:
+                    sorted_as, sorting = sorted_schema(schema, sort_keys)
+                    self.parquet = pq.ParquetWriter(path, sorted_as, compression=PARQUET_COMPRESSION,
+                                                    sorting_columns=sorting)
+                else:
+                    self.parquet = pq.ParquetWriter(path, schema, compression=PARQUET_COMPRESSION)
+            else:
+                self.csv = CsvWriter(path, schema, encoding)
+            self.paths.append(path)
+
+    def write(self, data: pa.Table | pa.RecordBatch) -> None:
+        table = pa.Table.from_batches([data]) if isinstance(data, pa.RecordBatch) else data
+        if self.parquet is not None:
+            self.parquet.write_table(table, row_group_size=PARQUET_ROW_GROUP_SIZE)
+        if self.csv is not None:
+            self.csv.write(table)
+        self.num_rows += table.num_rows
+
+    def _close_files(self) -> None:
+        self.closed = True
+        try:
+            if self.parquet is not None:
+                self.parquet.close()
+        finally:
+            if self.csv is not None:
+                self.csv.close()
+
+    def close(self) -> None:
+        """書き終えたファイルを閉じて成果物カタログに登録する"""
+        if self.closed:
+            return
+        self._close_files()
+        record_write(self.paths, self.num_rows)
+        register_artifact(self.paths, self.schema, self.num_rows, self.lineage, self.output_dir)
+
+    def discard(self) -> None:
+        """書きかけのファイルを閉じて削除する（カタログには登録しない）"""
+        if not self.closed:
+            try:
+                self._close_files()
+            except Exception:
+                pass
+        for path in self.paths:
+            path.unlink(missing_ok=True)
+
+    def __enter__(self) -> "OutputWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def write_outputs(
+    data: pd.DataFrame | pa.Table,
+    stem: str,
+    output_dir: Path = OUTPUT_DIR,
+    formats: str | None = None,
+    encoding: str = CSV_ENCODING,
+    sort_keys: list[str] | None = None,
+    lineage: tuple[str, ...] = (),
+) -> list[Path]:
+    """
+    {stem}.parquet / {stem}.csv を出力形式の設定に従って書き出し、書いたパスを返す。
+    sort_keys を渡すと Parquet に並び順を記録する（write_sorted_parquet）。
+    書き出したファイルは成果物カタログに登録する（lineage は元にした成果物名）。
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    table = to_arrow(data)
+    paths = []
+    for fmt in output_formats(formats):
+        path = output_dir / f"{stem}.{fmt}"
+        if fmt == "parquet":
+            if sort_keys:
+                write_sorted_parquet(table, path, sort_keys, compression=PARQUET_COMPRESSION,
+                                     row_group_size=PARQUET_ROW_GROUP_SIZE)
+            else:
+                pq.write_table(table, path, compression=PARQUET_COMPRESSION, row_group_size=PARQUET_ROW_GROUP_SIZE)
+        else:
+            writer = CsvWriter(path, table.schema, encoding)
+            try:
+                writer.write(table)
+            finally:
+                writer.close()
+        paths.append(path)
+    record_write(paths, table.num_rows)
+    register_artifact(paths, table.schema, table.num_rows, lineage, output_dir)
+    return paths
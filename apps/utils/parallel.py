@@ -0,0 +1,18 @@
+# apps/utils/parallel.py
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# ==========================================
+# プロセスプールの作成（UKE の解析・期間フォルダの読み込みなどで共通）
+#   main.py のパイプラインはタスクをスレッドで並行に実行するため、プロセスプールを作る時点で
+#   ほかのスレッドが動いていることがある。その状態で fork すると、ほかのスレッドが持っていたロック
+#   （メモリ確保・I/O など）を子プロセスが持ったまま始まり、デッドロックすることがある。
+#   ほかのスレッドがいるときは spawn（新しいインタプリタで起動）で子プロセスを作る。
+# ==========================================
+
+
+def process_pool(workers: int) -> ProcessPoolExecutor:
+    """max_workers=workers のプロセスプール（ほかのスレッドが動いていれば spawn で起動する）"""
+    context = multiprocessing.get_context("spawn") if threading.active_count() > 1 else None
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context)
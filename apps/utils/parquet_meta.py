@@ -0,0 +1,129 @@
+# apps/utils/parquet_meta.py
+import json
+from pathlib import Path
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from apps.utils.common import open_dataset, open_parquet
+
+# ==========================================
+# Parquet のフッター（メタデータ）だけで分かる情報を返す。
+# データ本体は読まないので、ファイルサイズによらず一瞬で終わる。
+# pq_path にはデータセットのフォルダ（save_outputs(layout="dataset")）も渡せる（中の全ファイルを合わせる）。
+# ==========================================
+
+
+def parquet_files(pq_path: Path) -> list[Path]:
+    """pq_path がフォルダなら中の Parquet ファイル（パス順）、ファイルならそれだけ"""
+    pq_path = Path(pq_path)
+    if pq_path.is_dir():
+        return sorted(pq_path.rglob("*.parquet"))
+    return [pq_path]
+
+
+def read_schema(pq_path: Path) -> pa.Schema:
+    """列名と型（pandas の index 列などのメタデータ列は含まない。フォルダはパーティション列を含む）"""
+    if Path(pq_path).is_dir():
+        return open_dataset(pq_path).schema
+    return pq.read_schema(pq_path)
+
+
+def column_names(pq_path: Path) -> list[str]:
+    return read_schema(pq_path).names
+
+
+def num_rows(pq_path: Path) -> int:
+    return sum(pq.ParquetFile(p).metadata.num_rows for p in parquet_files(pq_path))
+
+
+def column_stats(pq_path: Path) -> pd.DataFrame:
+    """
+    列ごとの統計（欠損数・最小値・最大値・圧縮後サイズ）を行グループの統計から集計。
+    統計が書かれていない列は欠損数などが NA になる。
+    """
+    stats: dict[str, dict] = {}
+    row_groups = (
+        meta.row_group(rg)
+        for meta in (pq.ParquetFile(p).metadata for p in parquet_files(pq_path))
+        for rg in range(meta.num_row_groups)
+    )
+    for row_group in row_groups:
+        for ci in range(row_group.num_columns):
+            col = row_group.column(ci)
+            s = stats.setdefault(col.path_in_schema, {
+                "列": col.path_in_schema,
+                "物理型": col.physical_type,
+                "欠損数": 0,
+                "最小値": None,
+                "最大値": None,
+                "圧縮後バイト数": 0,
+                "_has_stats": True,
+            })
+            s["圧縮後バイト数"] += col.total_compressed_size
+            st = col.statistics
+            if st is None or not st.has_null_count:
+                s["_has_stats"] = False
+                continue
+            s["欠損数"] += st.null_count
+            if st.has_min_max:
+                s["最小値"] = st.min if s["最小値"] is None else min(s["最小値"], st.min)
+                s["最大値"] = st.max if s["最大値"] is None else max(s["最大値"], st.max)
+
+    rows = []
+    for s in stats.values():
+        if not s.pop("_has_stats"):
+            s["欠損数"] = pd.NA
+        rows.append(s)
+    return pd.DataFrame(rows)
+
+
+def distinct_count(pq_path: Path, column: str) -> int:
+    """1列だけを読み込んで一意な値の数を数える（欠損は数えない。pandas の nunique と同じ）"""
+    col = open_parquet(pq_path).to_table(columns=[column]).column(column)
+    if pa.types.is_dictionary(col.type):
+        col = col.cast(col.type.value_type)
+    return pc.count_distinct(col, mode="only_valid").as_py()
+
+
+# ==========================================
+# 並び順の記録
+# ==========================================
+
+# 並び順を記録するスキーマメタデータのキー（値は列名の JSON 配列）
+SORTED_BY_KEY = b"sorted_by"
+
+
+def write_sorted_parquet(
+    table: pa.Table,
+    pq_path: Path,
+    sort_keys: list[str],
+    compression: str = "snappy",
+    row_group_size: int | None = None,
+) -> None:
+    """
+    sort_keys の昇順（欠損は末尾）に並んだ table を保存し、並び順をメタデータに残す。
+    Parquet 標準の sorting_columns と、読みやすいスキーマメタデータの両方に書く。
+    """
+    schema, sorting = sorted_schema(table.schema, sort_keys)
+    table = table.replace_schema_metadata(schema.metadata)
+    pq.write_table(table, pq_path, compression=compression, sorting_columns=sorting, row_group_size=row_group_size)
+
+
+def sorted_schema(schema: pa.Schema, sort_keys: list[str]) -> tuple[pa.Schema, list[pq.SortingColumn]]:
+    """並び順（sort_keys の昇順・欠損は末尾）を記録したスキーマと、Parquet の sorting_columns"""
+    metadata = dict(schema.metadata or {})
+    metadata[SORTED_BY_KEY] = json.dumps(sort_keys, ensure_ascii=False).encode("utf-8")
+    sorting = pq.SortingColumn.from_ordering(schema, [(k, "ascending") for k in sort_keys], null_placement="at_end")
+    return schema.with_metadata(metadata), sorting
+
+
+def sorted_by(pq_path: Path) -> list[str]:
+    """
+    write_sorted_parquet で記録された並び順（記録がなければ空リスト）。
+    データセットのフォルダはファイルごとにしか並んでいないため、常に空リスト。
+    """
+    if Path(pq_path).is_dir():
+        return []
+    raw = (read_schema(pq_path).metadata or {}).get(SORTED_BY_KEY)
+    return json.loads(raw) if raw else []
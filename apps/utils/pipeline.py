@@ -0,0 +1,265 @@
+# apps/utils/pipeline.py
+import hashlib
+from collections.abc import Callable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from pathlib import Path
+import pandas as pd
+from apps.utils.common import OUTPUT_DIR
+from apps.utils.context import PipelineContext
+from apps.utils.manifest import load_manifest, save_manifest, file_fingerprint, same_content
+from apps.utils.metrics import MetricsLog, profiling_requested
+
+# 各タスクの前回実行時の入力ハッシュを保存するファイル
+STATE_PATH = OUTPUT_DIR / "pipeline_state.json"
+
+
+@dataclass
+class Task:
+    """
+    パイプラインの1ステップ。
+    inputs / outputs は PipelineContext 上のデータ名。outputs を inputs に持つタスクが後続になる。
+    sources は ctx 以外の入力ファイル（UKE など）を返す関数。
+    artifacts は output/ 内の成果物の glob。artifacts が空のタスク（画面表示のみ）は毎回実行する。
+    実行時に書き出された（更新された）ファイルを状態ファイルに記録し、それが残っている場合だけスキップする。
+    after は ctx を介さず成果物ファイルだけを受け取る前段のタスク名（そのタスクの後に実行する）。
+    """
+    name: str
+    func: Callable[[PipelineContext], None]
+    inputs: tuple[str, ...] = ()
+    outputs: tuple[str, ...] = ()
+    artifacts: tuple[str, ...] = ()
+    sources: Callable[[], list[Path]] | None = None
+    title: str | None = None
+    after: tuple[str, ...] = ()
+
+
+def task_dependencies(tasks: list[Task]) -> dict[str, set[str]]:
+    """タスク名 → 先に終わっている必要のあるタスク名（inputs の生成元と after）"""
+    producers = {out: t.name for t in tasks for out in t.outputs}
+    names = {t.name for t in tasks}
+    return {
+        t.name: {producers[i] for i in t.inputs if i in producers} | (set(t.after) & names)
+        for t in tasks
+    }
+
+
+def task_order(tasks: list[Task]) -> list[Task]:
+    """
+    依存関係の順（トポロジカル順）に並べたタスク。依存関係で順序が決まらないタスクは元の並びを保つ。
+    run_pipeline を1タスクずつ実行した場合と同じ順になる。循環していれば ValueError。
+    """
+    deps = task_dependencies(tasks)
+    done: set[str] = set()
+    pending = list(tasks)
+    order: list[Task] = []
+    while pending:
+        ready = next((t for t in pending if deps[t.name] <= done), None)
+        if ready is None:
+            raise ValueError(f"タスクの依存関係が循環しています: {[t.name for t in pending]}")
+        pending.remove(ready)
+        done.add(ready.name)
+        order.append(ready)
+    return order
+
+
+def frame_fingerprint(df: pd.DataFrame) -> str:
+    """DataFrame の列名・型・内容から sha256 を計算"""
+    h = hashlib.sha256()
+    h.update(repr([(c, str(t)) for c, t in df.dtypes.items()]).encode("utf-8"))
+    h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def _glob_state(patterns: tuple[str, ...]) -> dict[str, dict[str, tuple[int, int]]]:
+    """成果物の glob ごとに、該当ファイル（output/ からの相対パス）→ (更新時刻, サイズ)"""
+    out = {}
+    for pattern in patterns:
+        files = {}
+        for path in OUTPUT_DIR.glob(pattern):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            files[path.relative_to(OUTPUT_DIR).as_posix()] = (st.st_mtime_ns, st.st_size)
+        out[pattern] = files
+    return out
+
+
+@dataclass
+class _Runner:
+    tasks: list[Task]
+    ctx: PipelineContext
+    force: bool = False
+    metrics: MetricsLog | None = None
+    state: dict = field(default_factory=dict)
+    hashes: dict[str, str] = field(default_factory=dict)
+
+    def __post_init__(self):
+        self.state = load_manifest(STATE_PATH)
+        self.state.setdefault("tasks", {})
+        self.producers = {out: t.name for t in self.tasks for out in t.outputs}
+        self.deps = task_dependencies(self.tasks)
+
+    def _frame_hash(self, name: str) -> str | None:
+        """ctx 上のデータのハッシュ。ctx に無ければ生成元タスクが前回記録したハッシュ"""
+        if name in self.hashes:
+            return self.hashes[name]
+        df = self.ctx.get(name)
+        if df is not None:
+            self.hashes[name] = frame_fingerprint(df)
+            return self.hashes[name]
+        producer = self.producers.get(name)
+        if producer is None:
+            return None
+        return self.state["tasks"].get(producer, {}).get("outputs", {}).get(name)
+
+    def _fingerprints(self, task: Task) -> tuple[dict, dict]:
+        prev = self.state["tasks"].get(task.name, {})
+        inputs = {name: self._frame_hash(name) for name in task.inputs}
+        files = {}
+        if task.sources is not None:
+            prev_files = prev.get("files", {})
+            for path in task.sources():
+                files[str(path)] = file_fingerprint(path, prev_files.get(str(path)))
+        return inputs, files
+
+    def is_up_to_date(self, task: Task, inputs: dict, files: dict) -> bool:
+        if self.force or not task.artifacts:
+            return False
+        prev = self.state["tasks"].get(task.name)
+        if prev is None or None in inputs.values() or prev.get("inputs") != inputs:
+            return False
+        prev_files = prev.get("files", {})
+        if set(prev_files) != set(files):
+            return False
+        if not all(same_content(prev_files[p], fp) for p, fp in files.items()):
+            return False
+        # 前回の実行で記録した成果物がすべて残っているか（同じ名前の古いファイルでは代わりにしない）
+        recorded = prev.get("artifacts", {})
+        return all(
+            recorded.get(pattern) and all((OUTPUT_DIR / p).exists() for p in recorded[pattern])
+            for pattern in task.artifacts
+        )
+
+    def _written_artifacts(self, task: Task, before: dict) -> dict[str, list[str]]:
+        """
+        実行中に作られた・更新された成果物。glob に該当する書き出しがなかった場合
+        （ストアの差分更新で変更なしなど）は、前回記録した成果物のうち残っているものを引き継ぐ。
+        """
+        prev = self.state["tasks"].get(task.name, {}).get("artifacts", {})
+        after = _glob_state(task.artifacts)
+        out = {}
+        for pattern in task.artifacts:
+            written = sorted(p for p, st in after[pattern].items() if before[pattern].get(p) != st)
+            if not written:
+                written = [p for p in prev.get(pattern, []) if p in after[pattern]]
+            out[pattern] = written
+        return out
+
+    def execute(self, task: Task) -> tuple[dict[str, str], dict[str, list[str]]]:
+        """
+        タスクを実行し、(出力データのハッシュ, 書き出した成果物) を返す。
+        宣言した outputs が ctx に揃わなかった場合（入力不足で何も出力せずに戻ったなど）は RuntimeError。
+        """
+        before = _glob_state(task.artifacts)
+        if task.title:
+            print(f"\n--- {task.title} ---")
+        rows_in = sum(len(df) for name in task.inputs if (df := self.ctx.get(name)) is not None)
+        measure = self.metrics.step(task.name, rows_in) if self.metrics is not None else nullcontext()
+        with measure as m:
+            task.func(self.ctx)
+            missing = [name for name in task.outputs if self.ctx.get(name) is None]
+            if missing:
+                # 成功扱いにすると、後続のタスクが前回の出力のハッシュで「変更なし」とみなしてしまう
+                raise RuntimeError(f"出力 {missing} が得られませんでした（入力不足など）")
+            if m is not None and not m.rows_out:
+                m.rows_out = sum(len(self.ctx.get(name)) for name in task.outputs)
+        out_hashes = {name: frame_fingerprint(self.ctx.get(name)) for name in task.outputs}
+        return out_hashes, self._written_artifacts(task, before)
+
+    def _skip(self, task: Task, status: str) -> None:
+        if self.metrics is not None:
+            self.metrics.skip(task.name, status)
+
+    def run(self, workers: int) -> dict[str, str]:
+        status: dict[str, str] = {}
+        pending = list(self.tasks)
+        running: dict[Future, tuple[Task, dict, dict]] = {}
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+            while pending or running:
+                progressed = True
+                while progressed:
+                    progressed = False
+                    for task in list(pending):
+                        deps = self.deps[task.name]
+                        if not deps <= status.keys():
+                            continue
+                        pending.remove(task)
+                        progressed = True
+
+                        failed = [d for d in deps if status[d] in ("failed", "blocked")]
+                        if failed:
+                            print(f"⚠ {task.name}: 前段 {failed} が失敗したため実行しません。")
+                            status[task.name] = "blocked"
+                            self._skip(task, "blocked")
+                            continue
+
+                        inputs, files = self._fingerprints(task)
+                        if self.is_up_to_date(task, inputs, files):
+                            print(f"⏭ {task.name}: 入力に変更がないためスキップします。")
+                            status[task.name] = "skipped"
+                            self._skip(task, "skipped")
+                            continue
+
+                        running[ex.submit(self.execute, task)] = (task, inputs, files)
+
+                if not running:
+                    if pending:
+                        raise ValueError(f"タスクの依存関係が循環しています: {[t.name for t in pending]}")
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    task, inputs, files = running.pop(fut)
+                    try:
+                        out_hashes, artifacts = fut.result()
+                    except Exception as e:
+                        print(f"⚠ {task.name} でエラー: {e}")
+                        status[task.name] = "failed"
+                        # 前回の記録を消し、次回はこのタスクと後続（前回の出力のハッシュを使えない）を実行し直す
+                        if self.state["tasks"].pop(task.name, None) is not None:
+                            save_manifest(self.state, STATE_PATH)
+                        continue
+                    status[task.name] = "done"
+                    self.hashes.update(out_hashes)
+                    self.state["tasks"][task.name] = {
+                        "inputs": inputs,
+                        "files": files,
+                        "outputs": out_hashes,
+                        "artifacts": artifacts,
+                    }
+                    save_manifest(self.state, STATE_PATH)
+        return status
+
+
+def run_pipeline(
+    tasks: list[Task],
+    ctx: PipelineContext,
+    workers: int = 4,
+    force: bool = False,
+    metrics: MetricsLog | None = None,
+) -> dict[str, str]:
+    """
+    タスクを依存関係の順に実行する。依存のないタスクはスレッドで並行実行し、
+    入力（ctx 上のデータ・入力ファイル）が前回から変わっていないタスクはスキップする。
+    metrics を渡すと各タスクの所要時間・メモリ・行数などを記録する。
+    cProfile / tracemalloc を指定した場合は、計測が混ざらないよう1タスクずつ実行する。
+    戻り値はタスク名 → done / skipped / failed / blocked。
+    """
+    if metrics is not None and profiling_requested():
+        print("🔬 プロファイル指定があるため、タスクを1つずつ実行します。")
+        workers = 1
+    return _Runner(tasks, ctx, force=force, metrics=metrics).run(workers)
@@ -0,0 +1,111 @@
+# apps/utils/reader.py
+import json
+import os
+from pathlib import Path
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+from apps.utils.catalog import artifact_name
+from apps.utils.common import OUTPUT_DIR, open_dataset
+from apps.utils.metrics import record_read
+
+# ==========================================
+# 解析系アプリ共通の Parquet 読み込み
+#   ・memory_map=True でファイルを読み、Arrow のまま DataFrame にする（dtype_backend="pyarrow"）
+#   ・環境変数 ARROW_CACHE=1 で、非圧縮の Feather(Arrow IPC) キャッシュを output/cache/ に作る。
+#     2回目以降はキャッシュを mmap するだけなので、展開・コピーがなく、
+#     複数のプロセスで同じページキャッシュを共有できる
+# ==========================================
+
+CACHE_DIR = OUTPUT_DIR / "cache"
+CACHE_ENV = "ARROW_CACHE"
+
+# キャッシュの元ファイル（サイズ・更新時刻）を記録するスキーマメタデータのキー
+_SOURCE_KEY = b"cache_source"
+
+
+def cache_enabled(cache: bool | None = None) -> bool:
+    """cache 未指定なら環境変数 ARROW_CACHE（1 / true で有効）に従う"""
+    if cache is not None:
+        return cache
+    return os.environ.get(CACHE_ENV, "").strip().lower() in ("1", "true", "yes")
+
+
+def _source_stamp(pq_path: Path) -> bytes:
+    st = pq_path.stat()
+    return json.dumps({"name": pq_path.name, "size": st.st_size, "mtime_ns": st.st_mtime_ns}).encode("utf-8")
+
+
+def _cache_path(pq_path: Path) -> Path:
+    return CACHE_DIR / f"{pq_path.stem}.arrow"
+
+
+def _is_fresh(cache_path: Path, stamp: bytes) -> bool:
+    """キャッシュが元の Parquet と同じ内容から作られたものか（フッターのメタデータだけ読む）"""
+    try:
+        with pa.memory_map(str(cache_path)) as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or {}
+    except (FileNotFoundError, pa.ArrowInvalid):
+        return False
+    return metadata.get(_SOURCE_KEY) == stamp
+
+
+def _write_cache(pq_path: Path, cache_path: Path, stamp: bytes) -> None:
+    """Parquet 全列を非圧縮の Feather に変換して保存（一時ファイル経由）。同じ成果物の古いキャッシュは削除"""
+    table = pq.read_table(pq_path, memory_map=True)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), _SOURCE_KEY: stamp})
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = cache_path.with_name(cache_path.name + ".tmp")
+    feather.write_feather(table, tmp, compression="uncompressed")
+    os.replace(tmp, cache_path)
+
+    name = artifact_name(pq_path.stem)
+    for old in CACHE_DIR.glob(f"{name}_*.arrow"):
+        if old != cache_path and artifact_name(old.stem) == name:
+            old.unlink(missing_ok=True)
+
+
+def read_arrow(pq_path: Path, columns: list[str] | None = None, cache: bool | None = None) -> pa.Table:
+    """
+    Parquet を Arrow の Table として読む。
+    キャッシュ有効時は Feather キャッシュを（なければ作ってから）mmap で読む。
+    pq_path がデータセットのフォルダ（save_outputs(layout="dataset")）の場合は、
+    open_dataset で開いて columns の列だけを読む（パーティション列も列として読める。キャッシュは作らない）。
+    """
+    pq_path = Path(pq_path)
+    if pq_path.is_dir():
+        record_read(pq_path)
+        return open_dataset(pq_path).to_table(columns=columns)
+    if not cache_enabled(cache):
+        record_read(pq_path)
+        return pq.read_table(pq_path, columns=columns, memory_map=True)
+
+    cache_path = _cache_path(pq_path)
+    stamp = _source_stamp(pq_path)
+    if not _is_fresh(cache_path, stamp):
+        _write_cache(pq_path, cache_path, stamp)
+    record_read(cache_path)
+    return feather.read_table(cache_path, columns=columns, memory_map=True)
+
+
+def to_frame(table: pa.Table, dtype_backend: str = "pyarrow") -> pd.DataFrame:
+    """
+    Table を DataFrame にする。dtype_backend="pyarrow" では Arrow の配列をそのまま使い（ArrowDtype）、
+    "numpy_nullable" では保存時の pandas の型（Int64 / category など）に戻す。
+    """
+    if dtype_backend == "pyarrow":
+        return table.to_pandas(types_mapper=pd.ArrowDtype)
+    if dtype_backend == "numpy_nullable":
+        return table.to_pandas()
+    raise ValueError(f"dtype_backend は pyarrow / numpy_nullable で指定してください: {dtype_backend}")
+
+
+def read_parquet(
+    pq_path: Path,
+    columns: list[str] | None = None,
+    dtype_backend: str = "pyarrow",
+    cache: bool | None = None,
+) -> pd.DataFrame:
+    """解析系アプリ共通の Parquet 読み込み（pd.read_parquet の代わり）"""
+    return to_frame(read_arrow(pq_path, columns=columns, cache=cache), dtype_backend)
@@ -0,0 +1,101 @@
+# apps/utils/schema.py
+import pandas as pd
+
+# ==========================================
+# テーブルごとの列の型（load_all_periods で結合後に適用）
+#   int      : 整数ID（nullable Int64）
+#   date     : 日付（datetime64）
+#   category : 種類の少ない列
+#   上記以外の列は pyarrow バックエンドの文字列にする
+# ==========================================
+
+_PERIOD_COLUMNS = {
+    "期間開始": "date",
+    "期間終了": "date",
+    "ソースフォルダ": "category",
+}
+
+TABLE_SCHEMAS: dict[str, dict[str, str]] = {
+    "karte": {
+        "カルテID": "int",
+        "患者番号": "int",
+        "日付": "date",
+        "診療科": "category",
+        "保険種別": "category",
+        **_PERIOD_COLUMNS,
+    },
+    "procedure": {
+        "カルテID": "int",
+        "患者番号": "int",
+        "日付": "date",
+        "診療科": "category",
+        "保険種別": "category",
+        **_PERIOD_COLUMNS,
+    },
+    "diagnosis": {
+        "患者番号": "int",
+        "診療科": "category",
+        "保険種別": "category",
+        **_PERIOD_COLUMNS,
+    },
+    # 名寄せの結果（apps/patient_identity.py）
+    "patient_clusters": {
+        "クラスタID": "int",
+        "患者番号": "int",
+        "クラスタ人数": "int",
+    },
+}
+
+STRING_DTYPE = "string[pyarrow]"
+
+# 日付列として試す書式（順に試し、全値を解釈できた書式を採用）
+DATE_FORMATS = ("%Y/%m/%d", "%Y-%m-%d", "%Y%m%d", "%Y/%m/%d %H:%M:%S", "%Y-%m-%d %H:%M:%S")
+
+# 先頭ゼロ付きのIDは数値化すると元に戻せないため対象外（int64 に収まる桁数まで）
+_INT_RE = r"0|-?[1-9]\d{0,17}"
+
+
+def _to_int(s: pd.Series) -> pd.Series | None:
+    """全値が整数表記なら Int64 に変換。変換できない値があれば None"""
+    values = s.dropna().astype(str).str.strip()
+    if not values.str.fullmatch(_INT_RE).all():
+        return None
+    return pd.to_numeric(s.astype(str).str.strip().where(s.notna()), errors="coerce").astype("Int64")
+
+
+def _to_date(s: pd.Series) -> pd.Series | None:
+    """全値が日付として解釈できれば datetime64 に変換。できない値があれば None"""
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return s
+    n_missing = s.isna().sum()
+    for fmt in DATE_FORMATS:
+        converted = pd.to_datetime(s, errors="coerce", format=fmt)
+        if converted.isna().sum() == n_missing:
+            return converted
+    return None
+
+
+def apply_schema(df: pd.DataFrame, key: str) -> pd.DataFrame:
+    """
+    TABLE_SCHEMAS[key] に従って列の型を変換する。
+    整数・日付に変換できない値を含む列は警告を出して文字列のまま残す。
+    """
+    schema = TABLE_SCHEMAS.get(key, {})
+    out = {}
+    for col in df.columns:
+        kind = schema.get(col)
+        s = df[col]
+        if kind == "int":
+            converted = _to_int(s)
+        elif kind == "date":
+            converted = _to_date(s)
+        elif kind == "category":
+            converted = s.astype("category")
+        else:
+            converted = s.astype(STRING_DTYPE)
+
+        if converted is None:
+            print(f"  ⚠ {key}.{col} を {kind} に変換できない値があるため文字列のまま扱います。")
+            converted = s.astype(STRING_DTYPE)
+        out[col] = converted
+    return pd.DataFrame(out, index=df.index)
@@ -0,0 +1,77 @@
+# benchmarks/bench_katakana.py
+"""
+カタカナ氏名判定の新旧比較。
+合成した karte（1行=1受診）に対し、従来の行ごとの apply と
+患者単位に一意化してからのベクトル化判定の所要時間を比べる。
+
+    python -m benchmarks.bench_katakana --rows 1000000 --patients 20000
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from apps.find_katakana_patients import is_katakana_only, katakana_mask
+
+KATAKANA_NAMES = ["ヤマダ タロウ", "スズキ　ハナコ", "サトウ イチロウ", "タナカ ジロウ", "イトウ ミキ"]
+KANJI_NAMES = ["山田 太郎", "鈴木 花子", "佐藤 一郎", "田中 次郎", "伊藤 美紀", "ｻﾄｳ ｲﾁﾛｳ"]
+
+
+def make_karte(n_rows: int, n_patients: int, seed: int = 0) -> pd.DataFrame:
+    """患者 n_patients 人・受診 n_rows 行の合成 karte（患者番号・患者氏名のみ）"""
+    rng = np.random.default_rng(seed)
+    pool = np.array(KATAKANA_NAMES + KANJI_NAMES, dtype=object)
+    names = pool[rng.integers(0, len(pool), n_patients)] + pd.Series(range(n_patients)).map(
+        lambda i: "ー" * (i % 3)
+    ).to_numpy(dtype=object)
+    patient_ids = rng.integers(0, n_patients, n_rows)
+    return pd.DataFrame({
+        "患者番号": pd.array(patient_ids + 1, dtype="Int64"),
+        "患者氏名": pd.array(names[patient_ids], dtype="string[pyarrow]"),
+    })
+
+
+def legacy(df: pd.DataFrame) -> pd.DataFrame:
+    """従来の処理: 受診行ごとに apply して抽出"""
+    return df[df["患者氏名"].apply(is_katakana_only)]
+
+
+def vectorized(df: pd.DataFrame) -> pd.DataFrame:
+    """新しい処理: 患者単位に一意化 → まとめて fullmatch"""
+    patients = df[["患者番号", "患者氏名"]].drop_duplicates()
+    return patients[katakana_mask(patients["患者氏名"])]
+
+
+def _best_of(fn, df: pd.DataFrame, repeat: int) -> tuple[float, pd.DataFrame]:
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn(df)
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--patients", type=int, default=20_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    df = make_karte(args.rows, args.patients, args.seed)
+    t_old, old = _best_of(legacy, df, args.repeat)
+    t_new, new = _best_of(vectorized, df, args.repeat)
+
+    # 結果の一致確認（患者単位で比較）
+    old_set = set(old[["患者番号", "患者氏名"]].drop_duplicates().itertuples(index=False))
+    new_set = set(new.itertuples(index=False))
+    assert old_set == new_set, "新旧の判定結果が一致しません"
+
+    print(f"rows={args.rows:,} patients={args.patients:,} matches={len(new_set):,}")
+    print(f"legacy     : {t_old:8.3f}s")
+    print(f"vectorized : {t_new:8.3f}s  (x{t_old / t_new:.1f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+# benchmarks/bench_pipeline.py
+"""
+パイプライン全体のベンチマーク。
+合成データ（benchmarks/synthetic.py）を一時フォルダに作り、main.py の各ステップを
+1ステップ = 1プロセスで順に実行して、所要時間（wall / CPU）とピークメモリ（RSS）を JSON に記録する。
+--compare で以前の JSON と比べ、遅くなったステップを表示する（閾値を超えたら終了コード 1）。
+
+    python -m benchmarks.bench_pipeline --periods 12 --patients 5000 --visits 20000
+    python -m benchmarks.bench_pipeline --compare output/benchmarks/pipeline_20240101_120000.json
+
+各ステップは本番と同じコードを一時フォルダにコピーして実行する（data/ と output/ は触らない）。
+解析ステップは PipelineContext を使わず、単体実行と同じく output/ の Parquet から読み込む。
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from benchmarks.synthetic import Scale, generate_dataset
+
+REPO_DIR = Path(__file__).resolve().parents[1]
+RESULT_DIR = REPO_DIR / "output" / "benchmarks"
+
+# 一時フォルダにコピーするもの（コード一式）
+SANDBOX_ITEMS = ("main.py", "apps", "benchmarks")
+
+# 結合（load_all_periods + save_outputs）の後に main.TASKS を依存関係の順に実行する
+MERGE_STEP = "load_all_periods"
+
+# 以前の結果より何倍遅くなったら「遅くなった」とみなすか
+DEFAULT_THRESHOLD = 1.2
+
+
+def _peak_rss_mb(children: bool = False) -> float | None:
+    """ru_maxrss（Linux は KB、macOS は byte）を MB で返す。resource のない Windows では None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_step(name: str, workers: int) -> dict:
+    """1ステップを実行して計測する（子プロセス側）"""
+    t0 = time.perf_counter()
+    c0 = time.process_time()
+    if name == MERGE_STEP:
+        from apps.merge_data import load_all_periods, save_outputs
+        save_outputs(load_all_periods(incremental=True, workers=workers))
+    else:
+        from main import TASKS
+        task = {t.name: t for t in TASKS}[name]
+        task.func(None)
+    wall = time.perf_counter() - t0
+    cpu = time.process_time() - c0
+    return {
+        "wall_s": round(wall, 4),
+        "cpu_s": round(cpu, 4),
+        "peak_rss_mb": _peak_rss_mb(),
+        # ProcessPoolExecutor などの子プロセスのうち最大のもの
+        "children_peak_rss_mb": _peak_rss_mb(children=True),
+    }
+
+
+def step_names() -> list[str]:
+    """実行順のステップ名（main.TASKS は inputs / outputs / after による依存関係の順に並べる）"""
+    from apps.utils.pipeline import task_order
+    from main import TASKS
+    return [MERGE_STEP] + [t.name for t in task_order(TASKS)]
+
+
+def _make_sandbox(root: Path) -> Path:
+    """root/repo にコードをコピーする（root/data が merge_data.BASE_DIR、root/repo/output が OUTPUT_DIR になる）"""
+    repo = root / "repo"
+    repo.mkdir(parents=True)
+    ignore = shutil.ignore_patterns("__pycache__", "*.pyc")
+    for item in SANDBOX_ITEMS:
+        src = REPO_DIR / item
+        if src.is_dir():
+            shutil.copytree(src, repo / item, ignore=ignore)
+        else:
+            shutil.copy2(src, repo / item)
+    version_file = REPO_DIR / ".python-version"
+    if version_file.exists():
+        shutil.copy2(version_file, repo / version_file.name)
+    return repo
+
+
+def _run_in_sandbox(repo: Path, name: str, workers: int, log) -> dict:
+    """子プロセスで1ステップを実行し、結果（JSON）を受け取る"""
+    result_path = repo / f".bench_{name}.json"
+    cmd = [sys.executable, "-m", "benchmarks.bench_pipeline", "--run-step", name,
+           "--workers", str(workers), "--result", str(result_path)]
+    t0 = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=repo, stdout=log, stderr=subprocess.STDOUT)
+    elapsed = time.perf_counter() - t0
+    if proc.returncode != 0 or not result_path.exists():
+        return {"name": name, "status": "error", "process_s": round(elapsed, 4)}
+    record = json.loads(result_path.read_text(encoding="utf-8"))
+    # process_s はインタプリタ起動・import を含む
+    return {"name": name, "status": "ok", **record, "process_s": round(elapsed, 4)}
+
+
+def _artifact_rows(repo: Path) -> dict[str, int]:
+    """成果物カタログから各成果物の件数を取り出す（実行ごとの出力規模の比較用）"""
+    path = repo / "output" / "catalog.json"
+    if not path.exists():
+        return {}
+    catalog = json.loads(path.read_text(encoding="utf-8"))
+    return {name: entry.get("num_rows") for name, entry in sorted(catalog.get("artifacts", {}).items())}
+
+
+def _versions() -> dict:
+    import numpy, pandas, pyarrow
+    return {
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "pandas": pandas.__version__,
+        "pyarrow": pyarrow.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def run_benchmark(scale: Scale, seed: int, workers: int, steps: list[str] | None = None,
+                  keep: Path | None = None) -> dict:
+    """合成データ作成 → 各ステップを順に実行して結果をまとめる"""
+    root = Path(keep) if keep else Path(tempfile.mkdtemp(prefix="bench_pipeline_"))
+    try:
+        t0 = time.perf_counter()
+        dataset = generate_dataset(root / "data", scale, seed)
+        print(f"📦 合成データ: {dataset['business_reports']} 期間 / UKE {dataset['receipt_files']} ファイル "
+              f"({dataset['bytes'] / 1e6:.1f} MB, {time.perf_counter() - t0:.1f}s)")
+
+        repo = _make_sandbox(root)
+        order = step_names()
+        # --steps の指定も依存関係の順に実行する（不明な名前は最後に回し、エラーとして記録される）
+        selected = sorted(steps, key=lambda n: order.index(n) if n in order else len(order)) if steps else order
+        records = []
+        with open(root / "bench.log", "w", encoding="utf-8") as log:
+            for name in selected:
+                record = _run_in_sandbox(repo, name, workers, log)
+                records.append(record)
+                if record["status"] == "ok":
+                    rss = record["peak_rss_mb"]
+                    rss_label = "-" if rss is None else f"{rss:,.0f} MB"
+                    print(f"  {name:<30} {record['wall_s']:8.2f}s  cpu {record['cpu_s']:8.2f}s  rss {rss_label}")
+                else:
+                    print(f"  {name:<30} ⚠ エラー（ログ: {root / 'bench.log'}）")
+
+        return {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "dataset": dataset,
+            "workers": workers,
+            "environment": _versions(),
+            "steps": records,
+            "total_wall_s": round(sum(r.get("wall_s", 0.0) for r in records), 4),
+            "artifacts": _artifact_rows(repo),
+        }
+    finally:
+        if keep is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def compare(current: dict, previous: dict, threshold: float = DEFAULT_THRESHOLD) -> list[str]:
+    """前回の結果と比べ、wall が threshold 倍を超えて遅くなったステップ名を返す"""
+    if previous.get("dataset", {}).get("scale") != current["dataset"]["scale"]:
+        print("⚠ 前回とデータ規模が異なります（比較は参考値）")
+    before = {r["name"]: r for r in previous.get("steps", []) if r.get("status") == "ok"}
+    slower = []
+    print(f"\n=== 前回との比較（閾値 x{threshold:.2f}） ===")
+    for record in current["steps"]:
+        old = before.get(record["name"])
+        if record.get("status") != "ok" or old is None or not old["wall_s"]:
+            continue
+        ratio = record["wall_s"] / old["wall_s"]
+        mark = "🐢" if ratio > threshold else "  "
+        print(f"{mark} {record['name']:<30} {old['wall_s']:8.2f}s → {record['wall_s']:8.2f}s  (x{ratio:.2f})")
+        if ratio > threshold:
+            slower.append(record["name"])
+    return slower
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--periods", type=int, default=Scale.periods)
+    parser.add_argument("--patients", type=int, default=Scale.patients)
+    parser.add_argument("--visits", type=int, default=Scale.visits)
+    parser.add_argument("--procedures", type=float, default=Scale.procedures)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--steps", nargs="+", help="実行するステップ名（既定: すべて）")
+    parser.add_argument("--out", type=Path, help="結果 JSON の保存先（既定: output/benchmarks/pipeline_<時刻>.json）")
+    parser.add_argument("--compare", type=Path, help="比較する以前の結果 JSON")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--keep", type=Path, help="合成データと出力を残すフォルダ（既定: 終了時に削除）")
+    # 子プロセス用（1ステップだけ実行して結果を書く）
+    parser.add_argument("--run-step", help=argparse.SUPPRESS)
+    parser.add_argument("--result", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_step:
+        record = run_step(args.run_step, args.workers)
+        args.result.write_text(json.dumps(record), encoding="utf-8")
+        return
+
+    scale = Scale(periods=args.periods, patients=args.patients, visits=args.visits, procedures=args.procedures)
+    result = run_benchmark(scale, args.seed, args.workers, args.steps, args.keep)
+
+    out = args.out or RESULT_DIR / f"pipeline_{datetime.now():%Y%m%d_%H%M%S}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"✅ 結果を保存しました: {out} (合計 {result['total_wall_s']:.1f}s)")
+
+    failed = [r["name"] for r in result["steps"] if r["status"] != "ok"]
+    slower = []
+    if args.compare:
+        slower = compare(result, json.loads(args.compare.read_text(encoding="utf-8")), args.threshold)
+        if slower:
+            print(f"🐢 遅くなったステップ: {', '.join(slower)}")
+    if failed or slower:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
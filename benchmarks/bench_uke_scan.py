@@ -0,0 +1,48 @@
+# benchmarks/bench_uke_scan.py
+"""
+UKE フリーコメント抽出の新旧比較。
+合成した RECEIPTC.UKE（benchmarks/synthetic.py）に対し、従来の全行デコード（engine="lines"）と
+RE / SY / SI / CO の行だけをバイト列のまま拾う方式（engine="scan"）の所要時間を比べる。
+
+    python -m benchmarks.bench_uke_scan --patients 100000
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+from apps.extract_free_comments import iter_free_comments
+from benchmarks.synthetic import Scale, generate_receipts
+
+
+def _best_of(engine: str, files: list[Path], repeat: int) -> tuple[float, list]:
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = [rec for uke_path in files for rec in iter_free_comments(uke_path, engine=engine)]
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        files = generate_receipts(Path(tmp), Scale(periods=1, patients=args.patients), args.seed)
+        size = sum(f.stat().st_size for f in files)
+        t_old, old = _best_of("lines", files, args.repeat)
+        t_new, new = _best_of("scan", files, args.repeat)
+
+    assert old == new, "新旧の抽出結果が一致しません"
+
+    print(f"files={len(files)} size={size / 1e6:,.1f} MB comments={len(new):,}")
+    print(f"lines : {t_old:8.3f}s")
+    print(f"scan  : {t_new:8.3f}s  (x{t_old / t_new:.1f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+# benchmarks/synthetic.py
+"""
+ベンチマーク用の合成データ生成（乱数シード固定）。
+本物の data/ と同じ構成で、以下を作る。
+
+    business_report_YYYYMMDD_YYYYMMDD/  カルテ集計.csv / 処置行為集計.csv / 傷病名一覧.csv（cp932）
+    receipt_YYYYMM/{kokuho,shaho}/RECEIPTC.UKE                                         （cp932, CRLF）
+    futurenet/18透析回数.csv / 31透析記録.csv / 32バイタル.csv / 33愁訴処置.csv           （cp932）
+
+    python -m benchmarks.synthetic ../bench_data --periods 12 --patients 5000
+"""
+import argparse
+import calendar
+from dataclasses import asdict, dataclass
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from apps.extract_free_comments import TARGET_INSURERS
+from apps.merge_data import TARGET_FILES
+
+# TARGET_FILES の逆引き（テーブル名 → CSV ファイル名）
+CSV_NAMES = {key: name for name, key in TARGET_FILES.items()}
+
+SURNAMES = ["ヤマダ", "スズキ", "サトウ", "タナカ", "イトウ", "山田", "鈴木", "佐藤", "田中", "伊藤", "ﾜﾀﾅﾍﾞ"]
+GIVEN_NAMES = ["タロウ", "ハナコ", "イチロウ", "ミキ", "太郎", "花子", "一郎", "美紀", "ｼﾞﾛｳ"]
+# 漢字の姓・名の読み（RE のカタカナ氏名。カナの姓・名はそのまま）
+READINGS = {"山田": "ヤマダ", "鈴木": "スズキ", "佐藤": "サトウ", "田中": "タナカ", "伊藤": "イトウ",
+            "太郎": "タロウ", "花子": "ハナコ", "一郎": "イチロウ", "美紀": "ミキ"}
+DEPARTMENTS = ["内科", "外科", "腎臓内科", "透析科", "整形外科"]
+INSURANCES = ["社保", "国保", "後期高齢", "公費"]
+PROCEDURES = ["人工腎臓", "採血", "注射", "処方", "画像診断", "透析", "心電図", "点滴"]
+DISEASES = ["慢性腎不全", "高血圧症", "糖尿病", "貧血", "二次性副甲状腺機能亢進症"]
+COMPLAINTS = [("血圧低下", "下肢挙上"), ("足つり", "補液"), ("頭痛", "経過観察"), ("かゆみ", "軟膏塗布")]
+
+# UKE のコード（フリーコメントは CO の 810000001）
+FREE_COMMENT_CODE = "810000001"
+SI_CODES = ["140033770", "140007310", "160000310", "160008010"]
+IY_CODES = ["620000001", "620000002", "620000003"]
+
+
+@dataclass
+class Scale:
+    """合成データの規模"""
+    periods: int = 6               # 月数（business_report と receipt の両方）
+    patients: int = 2_000          # 患者数
+    visits: int = 10_000           # 1期間あたりの受診（カルテ）件数
+    procedures: float = 3.0        # 1受診あたりの平均処置件数
+    comment_rate: float = 0.3      # レセプト1件にフリーコメントが付く割合
+    dialysis_rate: float = 0.1     # 透析患者の割合（FutureNet のエクスポート）
+    start: str = "2024-01"         # 最初の月
+
+
+def _months(scale: Scale) -> list[pd.Timestamp]:
+    return list(pd.date_range(scale.start, periods=scale.periods, freq="MS"))
+
+
+def _patient_names(n: int, rng: np.random.Generator) -> np.ndarray:
+    """患者ごとの氏名（姓 + 全角スペース/半角スペース + 名）"""
+    surnames = np.array(SURNAMES, dtype=object)[rng.integers(0, len(SURNAMES), n)]
+    given = np.array(GIVEN_NAMES, dtype=object)[rng.integers(0, len(GIVEN_NAMES), n)]
+    sep = np.where(rng.random(n) < 0.2, "　", " ").astype(object)
+    return surnames + sep + given
+
+
+def _patient_readings(names: np.ndarray) -> np.ndarray:
+    """氏名（姓 + 空白 + 名）から RE のカタカナ氏名（姓 + 半角スペース + 名）を作る"""
+    def reading(name: str) -> str:
+        return " ".join(READINGS.get(part, part) for part in name.replace("　", " ").split(" "))
+    return np.array([reading(n) for n in names], dtype=object)
+
+
+def _birth_dates(n: int, seed: int) -> np.ndarray:
+    """患者ごとの生年月日（YYYYMMDD。1930〜2009年の範囲で一様）"""
+    rng = np.random.default_rng(seed + 3)
+    days = pd.Timestamp("1930-01-01") + pd.to_timedelta(rng.integers(0, 80 * 365, n), unit="D")
+    return np.asarray(days.strftime("%Y%m%d"), dtype=object)
+
+
+def _days_in_month(month: pd.Timestamp, n: int, rng: np.random.Generator) -> pd.DatetimeIndex:
+    last = calendar.monthrange(month.year, month.month)[1]
+    return month + pd.to_timedelta(rng.integers(0, last, n), unit="D")
+
+
+def generate_business_reports(base: Path, scale: Scale, seed: int = 0) -> list[Path]:
+    """business_report_* フォルダ（3種類の CSV）を期間数だけ作り、作ったフォルダを返す"""
+    rng = np.random.default_rng(seed)
+    names = _patient_names(scale.patients, rng)
+    dirs = []
+    for i, month in enumerate(_months(scale)):
+        end = month + pd.offsets.MonthEnd(0)
+        period_dir = Path(base) / f"business_report_{month:%Y%m%d}_{end:%Y%m%d}"
+        period_dir.mkdir(parents=True, exist_ok=True)
+
+        # カルテ: 1行 = 1受診
+        patient_idx = rng.integers(0, scale.patients, scale.visits)
+        dates = _days_in_month(month, scale.visits, rng).strftime("%Y/%m/%d")
+        karte_ids = i * scale.visits + np.arange(scale.visits) + 1
+        karte = pd.DataFrame({
+            "カルテID": karte_ids,
+            "患者番号": patient_idx + 1,
+            "患者氏名": names[patient_idx],
+            "診療科": rng.choice(DEPARTMENTS, scale.visits),
+            "保険種別": rng.choice(INSURANCES, scale.visits),
+            "日付": dates,
+        })
+
+        # 処置行為: 受診ごとに平均 procedures 件（最低1件）
+        counts = np.maximum(1, rng.poisson(scale.procedures, scale.visits))
+        rows = np.repeat(np.arange(scale.visits), counts)
+        procedure = pd.DataFrame({
+            "カルテID": karte_ids[rows],
+            "日付": dates[rows],
+            "処置行為": rng.choice(PROCEDURES, len(rows)),
+            "数量": rng.integers(1, 4, len(rows)),
+        })
+
+        # 傷病名: 期間内に受診した患者ごとに1件
+        seen = np.unique(patient_idx)
+        diagnosis = pd.DataFrame({
+            "患者番号": seen + 1,
+            "患者氏名": names[seen],
+            "傷病名": rng.choice(DISEASES, len(seen)),
+            "開始日": _days_in_month(month, len(seen), rng).strftime("%Y/%m/%d"),
+        })
+
+        for key, df in (("karte", karte), ("procedure", procedure), ("diagnosis", diagnosis)):
+            df.to_csv(period_dir / CSV_NAMES[key], index=False, encoding="cp932")
+        dirs.append(period_dir)
+    return dirs
+
+
+def _receipt_lines(month: pd.Timestamp, patients: np.ndarray, names: np.ndarray, readings: np.ndarray,
+                   births: np.ndarray, scale: Scale, rng: np.random.Generator) -> list[str]:
+    """1ファイル分（請求月×保険者）の UKE レコード"""
+    ym = f"{month:%Y%m}"
+    last = calendar.monthrange(month.year, month.month)[1]
+    lines = [f"IR,1,13,1,1234567,,テスト病院,{ym},00,"]
+    for seq, pid in enumerate(patients, start=1):
+        # カルテ番号（14項目目）の後、カタカナ氏名は37項目目
+        lines.append(f"RE,{seq},1112,{ym},{names[pid]},1,{births[pid]},,,,,,,{pid + 1}{',' * 23}{readings[pid]},")
+        lines.append(f"HO,06130000,1234,{pid + 1:08d},1,,,")
+        for _ in range(rng.integers(1, 4)):
+            day = rng.integers(1, last + 1)
+            lines.append(f"SY,8846961,{ym}{day:02d},1,,")
+            for _ in range(rng.integers(1, 4)):
+                lines.append(f"SI,40,1,{rng.choice(SI_CODES)},,1,1,0,1,,,,,,,,,,,,,,,,,,,,,,,,,")
+                lines.append(f"IY,21,1,{rng.choice(IY_CODES)},1,5,1,0,1,")
+            if rng.random() < scale.comment_rate:
+                lines.append(f"CO,40,1,{FREE_COMMENT_CODE},透析条件変更 {seq}-{day},")
+            lines.append("CO,40,1,820000001,定型コメント,")
+    return lines
+
+
+def generate_receipts(base: Path, scale: Scale, seed: int = 0) -> list[Path]:
+    """receipt_YYYYMM/{kokuho,shaho}/RECEIPTC.UKE を月数だけ作り、作ったファイルを返す"""
+    rng = np.random.default_rng(seed + 1)
+    names = _patient_names(scale.patients, np.random.default_rng(seed))
+    readings = _patient_readings(names)
+    births = _birth_dates(scale.patients, seed)
+    files = []
+    for month in _months(scale):
+        for k, insurer in enumerate(TARGET_INSURERS):
+            # 患者番号の偶奇で保険者を振り分ける
+            patients = np.arange(k, scale.patients, len(TARGET_INSURERS))
+            uke_path = Path(base) / f"receipt_{month:%Y%m}" / insurer / "RECEIPTC.UKE"
+            uke_path.parent.mkdir(parents=True, exist_ok=True)
+            lines = _receipt_lines(month, patients, names, readings, births, scale, rng)
+            uke_path.write_bytes(("\r\n".join(lines) + "\r\n").encode("cp932"))
+            files.append(uke_path)
+    return files
+
+
+def generate_futurenet(base: Path, scale: Scale, seed: int = 0) -> list[Path]:
+    """futurenet/ 以下に透析回数・透析記録（週3回）・バイタル（1回4〜6測定）・愁訴処置の CSV を作る"""
+    rng = np.random.default_rng(seed + 2)
+    out_dir = Path(base) / "futurenet"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    patients = np.flatnonzero(rng.random(scale.patients) < scale.dialysis_rate) + 1
+    months = _months(scale)
+    days = pd.date_range(months[0], months[-1] + pd.offsets.MonthEnd(0), freq="D")
+
+    # 透析記録: 患者ごとに月水金 / 火木土
+    group = rng.integers(0, 2, len(patients))
+    on_day = (days.dayofweek.to_numpy()[None, :] % 2 == group[:, None]) & (days.dayofweek.to_numpy()[None, :] < 6)
+    p_idx, d_idx = np.nonzero(on_day)
+    n = len(p_idx)
+    dry = rng.normal(55, 8, len(patients)).round(1)
+    pre = (dry[p_idx] + rng.uniform(0.5, 3.5, n)).round(1)
+    post = (pre - rng.uniform(0.5, 3.0, n)).round(1)
+    start_min = np.where(rng.random(n) < 0.5, 9 * 60, 14 * 60) + rng.integers(0, 30, n)
+    sessions = pd.DataFrame({
+        "患者番号": patients[p_idx],
+        "透析日": days[d_idx].strftime("%Y/%m/%d"),
+        "開始時刻": [f"{m // 60:02d}:{m % 60:02d}:00" for m in start_min],
+        "終了時刻": [f"{m // 60:02d}:{m % 60:02d}:00" for m in start_min + 240],
+        "透析前体重": pre,
+        "透析後体重": post,
+        "ドライウェイト": dry[p_idx],
+        "除水量": ((pre - post) * 1000).round(0),
+    })
+
+    # バイタル: 1回あたり4〜6回（開始から1時間ごと）、一部は欠測
+    per = rng.integers(4, 7, n)
+    rows = np.repeat(np.arange(n), per)
+    offset = np.arange(len(rows)) - np.repeat(np.cumsum(per) - per, per)
+    minutes = start_min[rows] + offset * 60
+    sbp = rng.normal(145, 20, len(rows)).round(0)
+    sbp[rng.random(len(rows)) < 0.02] = np.nan
+    vitals = pd.DataFrame({
+        "患者番号": sessions["患者番号"].to_numpy()[rows],
+        "透析日": sessions["透析日"].to_numpy()[rows],
+        "測定時刻": [f"{m // 60:02d}:{m % 60:02d}:00" for m in minutes],
+        "収縮期血圧": sbp,
+        "拡張期血圧": (sbp * 0.55 + rng.normal(0, 5, len(rows))).round(0),
+        "脈拍": rng.normal(75, 10, len(rows)).round(0),
+    })
+
+    # 愁訴処置: 透析の約5%
+    hit = np.flatnonzero(rng.random(n) < 0.05)
+    pairs = rng.integers(0, len(COMPLAINTS), len(hit))
+    complaints = pd.DataFrame({
+        "患者番号": sessions["患者番号"].to_numpy()[hit],
+        "透析日": sessions["透析日"].to_numpy()[hit],
+        "時刻": [f"{m // 60:02d}:{m % 60:02d}:00" for m in start_min[hit] + 120],
+        "愁訴": [COMPLAINTS[k][0] for k in pairs],
+        "処置": [COMPLAINTS[k][1] for k in pairs],
+    })
+
+    counts = (
+        sessions.assign(年月=pd.to_datetime(sessions["透析日"]).dt.strftime("%Y%m"))
+        .groupby(["患者番号", "年月"]).size().rename("透析回数").reset_index()
+    )
+
+    files = []
+    for name, df in (("18透析回数", counts), ("31透析記録", sessions), ("32バイタル", vitals), ("33愁訴処置", complaints)):
+        path = out_dir / f"{name}.csv"
+        df.to_csv(path, index=False, encoding="cp932")
+        files.append(path)
+    return files
+
+
+def generate_dataset(base: Path, scale: Scale, seed: int = 0) -> dict:
+    """business_report・receipt・FutureNet のエクスポートを作り、件数の概要を返す"""
+    base = Path(base)
+    reports = generate_business_reports(base, scale, seed)
+    receipts = generate_receipts(base, scale, seed)
+    futurenet = generate_futurenet(base, scale, seed)
+    size = sum(f.stat().st_size for f in base.rglob("*") if f.is_file())
+    return {
+        "scale": asdict(scale),
+        "seed": seed,
+        "business_reports": len(reports),
+        "receipt_files": len(receipts),
+        "futurenet_files": len(futurenet),
+        "bytes": size,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("out_dir", type=Path, help="生成先（data/ と同じ構成になる）")
+    parser.add_argument("--periods", type=int, default=Scale.periods)
+    parser.add_argument("--patients", type=int, default=Scale.patients)
+    parser.add_argument("--visits", type=int, default=Scale.visits)
+    parser.add_argument("--procedures", type=float, default=Scale.procedures)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    scale = Scale(periods=args.periods, patients=args.patients, visits=args.visits, procedures=args.procedures)
+    summary = generate_dataset(args.out_dir, scale, args.seed)
+    print(f"✅ 合成データを作成しました: {args.out_dir} ({summary['bytes'] / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
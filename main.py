@@ -1,8 +1,17 @@
 # main.py
+import os
 from datetime import datetime
 
 # 結合・出力
-from apps.merge_data import load_all_periods, save_outputs
+from apps.merge_data import (
+    mark_merged_outputs,
+    merge_workers,
+    merged_outputs_current,
+    output_layout,
+    read_period_datasets,
+    save_outputs,
+    update_period_datasets,
+)
 
 # 解析系
 from apps.find_duplicate_patients import find_duplicate_patients
@@ -13,96 +22,143 @@ from apps.export_unique_karte_core import export_unique_karte_core
 from apps.join_procedure_with_patients import join_procedure_with_patients
 from apps.analyze_procedure_data import analyze_procedure_data
 from apps.export_unique_procedures import export_unique_procedures
-from apps.extract_free_comments import run_extract_free_comments  # ⑨ 追加
-
-
-def run_duplicate_check() -> None:
-    print("\n--- ① 氏名あたり患者番号の重複チェック ---")
-    try:
-        find_duplicate_patients()
-    except Exception as e:
-        print(f"⚠ 重複チェックでエラー: {e}")
-
-
-def run_katakana_check() -> None:
-    print("\n--- ② カタカナ氏名の患者一覧 ---")
-    try:
-        find_katakana_patients()
-    except Exception as e:
-        print(f"⚠ カタカナチェックでエラー: {e}")
-
-
-def run_inspect_headers() -> None:
-    print("\n--- ③ 各テーブルの最新Parquetヘッダー確認 ---")
-    try:
-        show_latest_headers()
-    except Exception as e:
-        print(f"⚠ ヘッダー確認でエラー: {e}")
-
-
-def run_export_unique_patients() -> None:
-    print("\n--- ④ 一意の患者リストを出力（CSV/Parquet） ---")
-    try:
-        export_unique_patients()
-    except Exception as e:
-        print(f"⚠ 一意患者リスト出力でエラー: {e}")
-
-
-def run_export_unique_karte_core() -> None:
-    print("\n--- ⑤ カルテID×患者番号で一意化したリストを出力（CSV/Parquet） ---")
-    try:
-        export_unique_karte_core()
-    except Exception as e:
-        print(f"⚠ 一意カルテリスト出力でエラー: {e}")
-
-
-def run_join_procedure_with_patients() -> None:
-    print("\n--- ⑥ procedure に患者番号・氏名を付与して出力（CSV/Parquet） ---")
-    try:
-        join_procedure_with_patients()
-    except Exception as e:
-        print(f"⚠ procedure結合でエラー: {e}")
-
-
-def run_analyze_procedure_data() -> None:
-    print("\n--- ⑦ procedure集計のサマリ表示（ターミナル出力） ---")
-    try:
-        analyze_procedure_data()
-    except Exception as e:
-        print(f"⚠ procedure解析でエラー: {e}")
-
-
-def run_export_unique_procedures() -> None:
-    print("\n--- ⑧ 一意の処置行為リストを出力（CSV/Parquet） ---")
-    try:
-        export_unique_procedures()
-    except Exception as e:
-        print(f"⚠ 一意処置行為リスト出力でエラー: {e}")
+from apps.procedure_rollups import export_procedure_rollups
+from apps.enrich_free_comments import enrich_free_comments, comment_sources
+from apps.extract_free_comments import run_extract_free_comments, list_receipt_files  # ⑨ 追加
+from apps.receipt_store import run_build_receipt_store
+from apps.futurenet_ingest import run_ingest_futurenet, list_futurenet_files
+from apps.utils.context import PipelineContext
+from apps.utils.metrics import MetricsLog
+from apps.utils.pipeline import Task, run_pipeline
+
+
+# 各ステップの入出力（PipelineContext 上のデータ名）と成果物。依存は inputs/outputs から決まる
+TASKS = [
+    Task(
+        "duplicate_check", find_duplicate_patients,
+        inputs=("diagnosis", "karte", "receipt_patients"),
+        artifacts=("patient_clusters_*.parquet",),
+        title="① 患者の名寄せ（同一人物と思われる患者番号のクラスタ）",
+    ),
+    Task(
+        "katakana_check", find_katakana_patients,
+        inputs=("karte",),
+        artifacts=("katakana_patients_*.parquet",),
+        title="② カタカナ氏名の患者一覧",
+    ),
+    Task(
+        "inspect_headers", show_latest_headers,
+        inputs=("diagnosis", "karte", "procedure"),
+        title="③ 各テーブルの最新Parquetヘッダー確認",
+    ),
+    Task(
+        "export_unique_patients", export_unique_patients,
+        inputs=("karte",),
+        outputs=("unique_patients",),
+        artifacts=("unique_patients_*.parquet",),
+        title="④ 一意の患者リストを出力（CSV/Parquet）",
+    ),
+    Task(
+        "export_unique_karte_core", export_unique_karte_core,
+        inputs=("karte",),
+        outputs=("unique_karte_core",),
+        artifacts=("unique_karte_core_*.parquet",),
+        title="⑤ カルテID×患者番号で一意化したリストを出力（CSV/Parquet）",
+    ),
+    Task(
+        "join_procedure_with_patients", join_procedure_with_patients,
+        inputs=("procedure", "unique_karte_core"),
+        outputs=("procedure_with_patient",),
+        artifacts=("procedure_with_patient_*.parquet",),
+        title="⑥ procedure に患者番号・氏名を付与して出力（CSV/Parquet）",
+    ),
+    Task(
+        "analyze_procedure_data", analyze_procedure_data,
+        inputs=("procedure_with_patient",),
+        title="⑦ procedure集計のサマリ表示（ターミナル出力）",
+    ),
+    Task(
+        "export_unique_procedures", export_unique_procedures,
+        inputs=("procedure_with_patient",),
+        artifacts=("unique_procedures_*.parquet",),
+        title="⑧ 一意の処置行為リストを出力（CSV/Parquet）",
+    ),
+    # ⑩ レセプト全レコードのストア更新（見出しは run_build_receipt_store 側で表示）
+    #   UKE の本文を読むのはこのステップだけ（CPU 数のプロセスプールで変更のあったファイルを取り込む）
+    Task(
+        "build_receipt_store", lambda ctx: run_build_receipt_store(workers=os.cpu_count() or 1, ctx=ctx),
+        outputs=("receipt_patients",),
+        artifacts=("receipt_store/index/*.parquet",),
+        sources=list_receipt_files,
+    ),
+    # ⑨ レセプト・フリーコメント抽出（見出しは run_extract_free_comments 側で表示）
+    #   ⑩ のストアの CO / SY / SI から作るため、UKE を読み直さない
+    Task(
+        "extract_free_comments", lambda ctx: run_extract_free_comments(ctx=ctx, from_store=True),
+        after=("build_receipt_store",),
+        artifacts=("receipt_free_comments_all_*.parquet",),
+        sources=list_receipt_files,
+    ),
+    Task(
+        "procedure_rollups", export_procedure_rollups,
+        inputs=("procedure_with_patient", "unique_karte_core"),
+        outputs=("procedure_month_department", "procedure_patient"),
+        artifacts=("procedure_month_department_*.parquet", "procedure_patient_*.parquet"),
+        title="⑪ 処置行為の集計（月×診療科・患者別）を期間の差分で更新して出力（CSV/Parquet）",
+    ),
+    Task(
+        "enrich_free_comments", enrich_free_comments,
+        inputs=("procedure_with_patient", "unique_karte_core"),
+        after=("extract_free_comments",),
+        artifacts=("receipt_free_comments_enriched_*.parquet",),
+        sources=comment_sources,
+        title="⑫ フリーコメントに受診・診療科・処置行為を付与（患者番号ごとの as-of 結合・バッチ処理）",
+    ),
+    # ⑬ FutureNet（透析）のエクスポート取り込み（見出しは run_ingest_futurenet 側で表示）
+    Task(
+        "ingest_futurenet", run_ingest_futurenet,
+        artifacts=("futurenet_session_summary_*.parquet", "futurenet/*/*/part-0.parquet"),
+        sources=list_futurenet_files,
+    ),
+]
 
 
 def main() -> None:
     start = datetime.now()
     print("=== データ結合を開始します ===")
 
+    # ステップごとの所要時間・メモリ・行数（output/metrics/pipeline_<開始時刻>.jsonl）
+    metrics = MetricsLog(start.strftime("%Y%m%d_%H%M%S"))
+
     try:
-        periods = load_all_periods()
-        save_outputs(periods)
+        # save_outputs の保存形式（OUTPUT_LAYOUT / OUTPUT_PARTITION_BY）と CSV を読み込むプロセス数（MERGE_WORKERS）
+        layout, partition_by = output_layout()
+        workers = merge_workers()
+        with metrics.step("load_all_periods") as m:
+            # 新規・変更された期間だけ期間ごとのデータセットに取り込み、まとめて読み込む
+            updated = update_period_datasets(workers=workers)
+            periods = read_period_datasets()
+            m.rows_out = sum(len(df) for df in periods.values())
+        # 前回の save_outputs が途中で失敗・中断した・保存形式が変わった場合は、期間に変更がなくても出力し直す
+        if updated or not merged_outputs_current(layout, partition_by):
+            with metrics.step("save_outputs", rows_in=m.rows_out):
+                run_ts = save_outputs(periods, layout, partition_by)
+            mark_merged_outputs(layout, partition_by)
+        else:
+            print("✅ 期間フォルダに変更がないため、結合済みの出力（karte / procedure / diagnosis）を再利用します。")
+            metrics.skip("save_outputs", "skipped")
+            run_ts = start.strftime("%Y%m%d_%H%M%S")
     except Exception as e:
         print(f"⚠ 結合処理でエラー: {e}")
+        metrics.print_summary()
         return
 
-    # 解析フロー
-    run_duplicate_check()
-    run_katakana_check()
-    run_inspect_headers()
-    run_export_unique_patients()
-    run_export_unique_karte_core()
-    run_join_procedure_with_patients()
-    run_analyze_procedure_data()
-    run_export_unique_procedures()
+    # 結合済みデータをメモリ上で各ステップに渡す（output/ の再読み込みを避ける）
+    ctx = PipelineContext(run_ts=run_ts, frames=dict(periods))
 
-    # ⑨ レセプト・フリーコメント抽出
-    run_extract_free_comments()
+    # 解析フロー（依存のないステップは並行実行、入力が前回と同じステップはスキップ）
+    run_pipeline(TASKS, ctx, metrics=metrics)
+    metrics.print_summary()
 
     elapsed = (datetime.now() - start).total_seconds()
     print(f"\n=== 結合 + 分析 完了 ({elapsed:.1f}s) ===")
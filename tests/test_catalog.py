@@ -0,0 +1,34 @@
+# tests/test_catalog.py
+import pyarrow as pa
+import pyarrow.dataset as ds
+from apps.utils.catalog import latest_artifact, register_dataset
+from apps.utils.output import write_outputs
+from apps.utils.parquet_meta import column_names, num_rows
+from apps.utils.reader import read_parquet
+
+
+def test_latest_dataset_is_readable_as_parquet(tmp_path):
+    table = pa.table({"患者番号": [1, 2, 3], "患者氏名": ["A", "B", "C"], "ソースフォルダ": ["p1", "p1", "p2"]})
+    write_outputs(table, "karte_120000", tmp_path, formats="parquet")
+    folder = tmp_path / "dataset" / "karte"
+    ds.write_dataset(table, folder, format="parquet", partitioning=["ソースフォルダ"], partitioning_flavor="hive")
+    register_dataset("karte", folder, table.schema, table.num_rows, output_dir=tmp_path)
+
+    path = latest_artifact("karte", output_dir=tmp_path)
+    assert path == folder
+    assert latest_artifact("karte", "csv", output_dir=tmp_path) is None
+    assert num_rows(path) == 3
+    assert set(column_names(path)) == {"患者番号", "患者氏名", "ソースフォルダ"}
+    df = read_parquet(path, columns=["患者番号", "ソースフォルダ"])
+    assert list(df.columns) == ["患者番号", "ソースフォルダ"]
+    assert sorted(df["患者番号"].tolist()) == [1, 2, 3]
+
+
+def test_latest_timestamped_file_replaces_dataset(tmp_path):
+    folder = tmp_path / "dataset" / "karte"
+    table = pa.table({"患者番号": [1]})
+    ds.write_dataset(table, folder, format="parquet")
+    register_dataset("karte", folder, table.schema, 1, output_dir=tmp_path)
+    path = tmp_path / "karte_130000.parquet"
+    write_outputs(table, "karte_130000", tmp_path, formats="parquet")
+    assert latest_artifact("karte", output_dir=tmp_path) == path
@@ -0,0 +1,53 @@
+# tests/test_extract_free_comments.py
+import pyarrow as pa
+import pyarrow.parquet as pq
+from apps.extract_free_comments import (
+    COMMENT_SCHEMA, _sorted_comments, add_normalized_patient_ids, export_comment_results,
+    export_comment_results_streaming, extract_all_receipts,
+)
+from benchmarks.synthetic import Scale, generate_receipts
+
+
+def _comments(patient_ids: list[str | None], dates: list[str]) -> pa.Table:
+    n = len(patient_ids)
+    return pa.table(
+        {
+            "receipt_month": ["202401"] * n,
+            "insurer_type": ["kokuho"] * n,
+            "patient_id": patient_ids,
+            "comment_date": dates,
+            "free_comment": [""] * n,
+            "si_code": [""] * n,
+            "comment_date_ymd": pa.array(dates, pa.string()).cast(pa.timestamp("s")).cast(pa.timestamp("ns")),
+        },
+        schema=COMMENT_SCHEMA,
+    )
+
+
+def test_normalized_patient_ids_strip_leading_zeros_of_numbers_only():
+    ids = ["000123", " 45 ", "0000", "A0012", None]
+    out = add_normalized_patient_ids(_comments(ids, ["2024-01-01"] * 5))
+    assert out["normalized_patient_id"].to_pylist() == ["123", "45", "0", "A0012", None]
+    assert out["patient_id"].to_pylist() == ids
+
+
+def test_sorted_comments_order_by_patient_then_date():
+    table = _comments(["0002", "1", "2", "001"], ["2024-01-03", "2024-01-02", "2024-01-01", "2024-01-01"])
+    out = _sorted_comments(table)
+    assert list(zip(out["patient_id"].to_pylist(), out["comment_date"].to_pylist())) == [
+        ("001", "2024-01-01"), ("1", "2024-01-02"), ("2", "2024-01-01"), ("0002", "2024-01-03"),
+    ]
+
+
+def test_streaming_export_matches_in_memory_order(tmp_path):
+    base = tmp_path / "data"
+    generate_receipts(base, Scale(periods=2, patients=200, visits=400))
+    export_comment_results(extract_all_receipts(str(base)), output_dir=tmp_path / "memory")
+    # batch_size を小さくして、複数の並べ替え済み一時ファイルを突き合わせる
+    export_comment_results_streaming(str(base), output_dir=tmp_path / "streaming", batch_size=50)
+
+    memory, = (tmp_path / "memory").glob("*.parquet")
+    streaming, = (tmp_path / "streaming").glob("*.parquet")
+    expected = pq.read_table(memory)
+    assert expected.num_rows > 50
+    assert pq.read_table(streaming).equals(expected)
@@ -0,0 +1,23 @@
+# tests/test_merge_data.py
+from apps.merge_data import SNIFF_BYTES, read_csv_with_fallback
+
+
+def test_utf8_after_ascii_prefix_is_read_without_replacement(tmp_path, capsys):
+    # 先頭 SNIFF_BYTES が ASCII だけなので cp932 と判定されるが、後半は UTF-8
+    rows = ["A,B"] + ["1,x"] * (SNIFF_BYTES // 4 + 1) + ["2,山田 太郎"]
+    path = tmp_path / "karte.csv"
+    path.write_bytes("\n".join(rows).encode("utf-8"))
+
+    df = read_csv_with_fallback(path)
+    assert df["B"].iloc[-1] == "山田 太郎"
+    assert "置換文字" not in capsys.readouterr().out
+
+
+def test_undecodable_bytes_are_replaced_with_warning(tmp_path, capsys):
+    path = tmp_path / "karte.csv"
+    # cp932 としても UTF-8 としても読めないバイト（0x85 0x40）
+    path.write_bytes(b"A,B\n1,x\n2,\x85@\n")
+
+    df = read_csv_with_fallback(path)
+    assert df["B"].tolist() == ["x", "\ufffd@"]
+    assert "置換文字（\ufffd）が 1 文字" in capsys.readouterr().out
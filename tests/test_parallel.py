@@ -0,0 +1,21 @@
+# tests/test_parallel.py
+import threading
+from apps.utils.parallel import process_pool
+
+
+def _square(x: int) -> int:
+    return x * x
+
+
+def test_process_pool_uses_spawn_while_other_threads_run():
+    results = {}
+
+    def task():
+        with process_pool(2) as ex:
+            results["context"] = ex._mp_context.get_start_method()
+            results["values"] = list(ex.map(_square, range(4)))
+
+    worker = threading.Thread(target=task)
+    worker.start()
+    worker.join()
+    assert results == {"context": "spawn", "values": [0, 1, 4, 9]}
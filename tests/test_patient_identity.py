@@ -0,0 +1,78 @@
+# tests/test_patient_identity.py
+import pandas as pd
+import apps.patient_identity as identity
+from apps.patient_identity import _clusters, collect_names, fuzzy_links, name_links
+
+
+def _cluster_of(karte: pd.DataFrame, receipts: pd.DataFrame) -> dict[str, str]:
+    """患者番号 → クラスタID（クラスタに入らなかった患者番号は含まない）"""
+    records = collect_names([karte], receipts)
+    links = pd.concat([name_links(records), fuzzy_links(records)], ignore_index=True)
+    clusters = _clusters(records, links)
+    return dict(zip(clusters["患者番号"], clusters["クラスタID"]))
+
+
+def test_twins_with_same_birth_date_stay_separate():
+    karte = pd.DataFrame({"患者番号": ["1", "2"], "患者氏名": ["伊藤 一郎", "伊藤 二郎"]})
+    receipts = pd.DataFrame({
+        "patient_id": ["1", "2"],
+        "氏名": ["伊藤　一郎", "伊藤　二郎"],
+        "カタカナ氏名": ["ｲﾄｳ ｲﾁﾛｳ", "ｲﾄｳ ｼﾞﾛｳ"],
+        "生年月日": ["19800101", "19800101"],
+    })
+    assert _cluster_of(karte, receipts) == {}
+
+
+def test_kanji_and_kana_registrations_link_through_receipt_reading():
+    # 患者番号 1 は漢字、2 はカナで登録（2 にはレセプトがない）
+    karte = pd.DataFrame({"患者番号": ["1", "2"], "患者氏名": ["山田 太郎", "ﾔﾏﾀﾞ ﾀﾛｳ"]})
+    receipts = pd.DataFrame({
+        "patient_id": ["0001"],
+        "氏名": ["山田　太郎"],
+        "カタカナ氏名": ["ﾔﾏﾀﾞ ﾀﾛｳ"],
+        "生年月日": ["19500101"],
+    })
+    assert _cluster_of(karte, receipts) == {"1": "1", "2": "1"}
+
+
+def test_kana_readings_one_edit_apart_link():
+    karte = pd.DataFrame({"患者番号": ["1", "2"], "患者氏名": ["サトウハナコ", "サトウハナ子"]})
+    receipts = pd.DataFrame({
+        "patient_id": ["1", "2"],
+        "氏名": ["サトウハナコ", "佐藤花子"],
+        "カタカナ氏名": ["サトウハナコ", "サトーハナコー"],
+        "生年月日": ["19600505", "19600505"],
+    })
+    assert _cluster_of(karte, receipts) == {"1": "1", "2": "1"}
+
+
+def _resolve(karte: pd.DataFrame, receipts: pd.DataFrame, state, monkeypatch, force: bool = False) -> pd.DataFrame:
+    monkeypatch.setattr(identity, "RECORDS_PATH", state / "records.parquet")
+    monkeypatch.setattr(identity, "LINKS_PATH", state / "links.parquet")
+    monkeypatch.setattr(identity, "CLUSTERS_PATH", state / "clusters.parquet")
+    clusters, _ = identity.resolve_patient_identity([karte], receipts, force=force)
+    return clusters
+
+
+def test_incremental_update_matches_full_rebuild(tmp_path, monkeypatch):
+    receipts = pd.DataFrame({
+        "patient_id": ["1", "3"],
+        "氏名": ["山田　太郎", "鈴木　花子"],
+        "カタカナ氏名": ["ﾔﾏﾀﾞ ﾀﾛｳ", "ｽｽﾞｷ ﾊﾅｺ"],
+        "生年月日": ["19500101", "19700303"],
+    })
+    before = pd.DataFrame({
+        "患者番号": ["1", "2", "3", "4"],
+        "患者氏名": ["山田 太郎", "ﾔﾏﾀﾞ ﾀﾛｳ", "鈴木 花子", "すずき はなこ"],
+    })
+    # 患者番号 2 の氏名の訂正でつながりが切れ、患者番号 5 が増えて別のクラスタに入る
+    after = pd.DataFrame({
+        "患者番号": ["1", "2", "3", "4", "5"],
+        "患者氏名": ["山田 太郎", "ﾔﾏｸﾞﾁ ｼﾞﾛｳ", "鈴木 花子", "すずき はなこ", "鈴木花子"],
+    })
+    assert set(_resolve(before, receipts, tmp_path / "state", monkeypatch)["患者番号"]) == {1, 2, 3, 4}
+
+    incremental = _resolve(after, receipts, tmp_path / "state", monkeypatch)
+    full = _resolve(after, receipts, tmp_path / "full", monkeypatch, force=True)
+    pd.testing.assert_frame_equal(incremental, full)
+    assert set(incremental["患者番号"]) == {3, 4, 5}
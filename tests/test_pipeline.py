@@ -0,0 +1,38 @@
+# tests/test_pipeline.py
+import pytest
+from apps.utils.pipeline import Task, task_order
+
+
+def _noop(ctx):
+    pass
+
+
+def test_task_order_follows_inputs_and_after():
+    tasks = [
+        Task("report", _noop, inputs=("store",)),
+        Task("extract", _noop, after=("build",)),
+        Task("build", _noop, outputs=("store",)),
+        Task("standalone", _noop),
+    ]
+    assert [t.name for t in task_order(tasks)] == ["build", "report", "extract", "standalone"]
+
+
+def test_task_order_rejects_cycles():
+    tasks = [Task("a", _noop, after=("b",)), Task("b", _noop, after=("a",))]
+    with pytest.raises(ValueError):
+        task_order(tasks)
+
+
+def test_task_without_its_output_fails_and_blocks_consumers(tmp_path, monkeypatch):
+    import apps.utils.pipeline as pipeline
+    from apps.utils.context import PipelineContext
+
+    monkeypatch.setattr(pipeline, "STATE_PATH", tmp_path / "pipeline_state.json")
+    ran = []
+    tasks = [
+        Task("join", lambda ctx: ran.append("join"), outputs=("joined",)),
+        Task("report", lambda ctx: ran.append("report"), inputs=("joined",)),
+    ]
+    status = pipeline.run_pipeline(tasks, PipelineContext("20240101_000000"), workers=1)
+    assert status == {"join": "failed", "report": "blocked"}
+    assert ran == ["join"]
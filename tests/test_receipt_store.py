@@ -0,0 +1,87 @@
+# tests/test_receipt_store.py
+import pandas as pd
+import pyarrow as pa
+import apps.receipt_store as store
+from apps.extract_free_comments import COMMENT_SCHEMA, extract_all_receipts
+from benchmarks.synthetic import Scale, generate_receipts
+
+# 走査側の境界条件をそろえた手書きの UKE
+#   - RE の前の CO / カルテ番号もレセプト番号もない RE の CO は対象外
+#   - 診療日のない SY は SI をリセットするが、診療日は直前の SY のものを使う
+#   - 9桁数字でない SI は採用しない / RE をまたいで SI・診療日を持ち越さない
+#   - コメントにカンマを含む（最初のカンマまでが文字データ）
+TRICKY_LINES = [
+    "IR,1,13,1,1234567,,テスト病院,202401,00,",
+    "CO,,,810000001,RE より前,",
+    "RE,1,1112,202401,甲,1,19500101,,,,,,,100,",
+    "CO,,,810000001,SY より前,",
+    "SY,8830052,20240105,,,,,",
+    "SI,11,1,111000110,,1,",
+    "CO,,,810000001,一件目,",
+    "SI,11,1,ABC,,1,",
+    "CO,,,810000001,不正なSI,",
+    "SY,8830053,,,,,,",
+    "CO,,,810000001,日付なしSYの後,",
+    "SI,11,1, 112007410 ,,1,",
+    "CO,,,810000001,前後に空白のSI,",
+    "CO,,,810000002,別コード,",
+    "CO,,,810000001,,",
+    "RE,2,1112,202401,乙,1,19600101,,,,,,,,",
+    "SY,8830052,20240110,,,,,",
+    "CO,,,810000001,レセプト番号,カンマ付き",
+    "RE,,1112,202401,丙,1,19700101,,,,,,,,",
+    "SY,8830052,20240111,,,,,",
+    "CO,,,810000001,患者IDなし,",
+    "RE,4,1112,202401,丁,1,19800101,,,,,,,200,",
+    "CO,,,810000001,SYなし,",
+    "SI,11,1,111000110,,1,",
+    "SY,8830052,20240112,,,,,",
+    "CO,,,810000001,RE直後のSI,",
+]
+
+
+def _sorted(df: pd.DataFrame) -> pd.DataFrame:
+    cols = list(COMMENT_SCHEMA.names)
+    return df[cols].sort_values(cols[:5]).reset_index(drop=True)
+
+
+def _build(base, tmp_path, monkeypatch) -> pd.DataFrame:
+    root = tmp_path / "receipt_store"
+    monkeypatch.setattr(store, "STORE_DIR", root)
+    monkeypatch.setattr(store, "INDEX_DIR", root / "index")
+    monkeypatch.setattr(store, "MANIFEST_PATH", root / "manifest.json")
+    store.build_receipt_store(str(base), workers=1)
+    tables = [store.free_comments_from_store(name) for name in store.store_file_names()]
+    return pa.concat_tables(tables).to_pandas()
+
+
+def test_free_comments_from_store_match_scanner(tmp_path, monkeypatch):
+    base = tmp_path / "data"
+    generate_receipts(base, Scale(periods=2, patients=200, visits=400))
+    tricky = base / "receipt_202312" / "kokuho" / "RECEIPTC.UKE"
+    tricky.parent.mkdir(parents=True)
+    tricky.write_bytes(("\r\n".join(TRICKY_LINES) + "\r\n").encode("cp932"))
+
+    expected = _sorted(extract_all_receipts(str(base), workers=1))
+    actual = _sorted(_build(base, tmp_path, monkeypatch))
+    assert len(expected) > 0
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+def test_tricky_receipt_comments(tmp_path, monkeypatch):
+    base = tmp_path / "data"
+    tricky = base / "receipt_202401" / "shaho" / "RECEIPTC.UKE"
+    tricky.parent.mkdir(parents=True)
+    tricky.write_bytes(("\r\n".join(TRICKY_LINES) + "\r\n").encode("cp932"))
+
+    df = _build(base, tmp_path, monkeypatch)
+    got = list(zip(df["patient_id"], df["comment_date"], df["free_comment"], df["si_code"]))
+    assert got == [
+        ("100", "20240105", "一件目", "111000110"),
+        ("100", "20240105", "不正なSI", "111000110"),
+        ("100", "20240105", "日付なしSYの後", ""),
+        ("100", "20240105", "前後に空白のSI", "112007410"),
+        ("100", "20240105", "", "112007410"),
+        ("2", "20240110", "レセプト番号", ""),
+        ("200", "20240112", "RE直後のSI", ""),
+    ]